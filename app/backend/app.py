@@ -7,7 +7,6 @@ from datetime import datetime
 import asyncio
 import logging
 import os
-import json
 import urllib.parse
 import pandas as pd
 import pydantic
@@ -23,8 +22,7 @@ from approaches.gpt_direct_approach import GPTDirectApproach
 from approaches.approach import Approaches
 from azure.identity import ManagedIdentityCredential, AzureAuthorityHosts, DefaultAzureCredential, get_bearer_token_provider
 from azure.mgmt.cognitiveservices import CognitiveServicesManagementClient
-from azure.search.documents import SearchClient
-from azure.storage.blob import BlobServiceClient, ContentSettings
+from azure.storage.blob import ContentSettings
 from approaches.mathassistant import(
     generate_response,
     process_agent_response,
@@ -38,7 +36,9 @@ from approaches.tabulardataassistant import (
     get_images_in_temp
 )
 from shared_code.status_log import State, StatusClassification, StatusLog
-from azure.cosmos import CosmosClient
+from shared_code.vector_compression import IndexCalibration
+from shared_code.clients import get_blob_service_client, get_cosmos_client, get_search_client
+from shared_code.chunk_pack import PackIndexCache, read_chunk
 
 
 # === ENV Setup ===
@@ -77,6 +77,8 @@ ENV = {
     "COSMOSDB_LOG_CONTAINER_NAME": "statuscontainer",
     "QUERY_TERM_LANGUAGE": "English",
     "TARGET_EMBEDDINGS_MODEL": "BAAI/bge-small-en-v1.5",
+    "EMBEDDING_COMPRESSION_MODE": "none",
+    "EMBEDDING_COMPRESSION_DIMENSIONS": "0",
     "ENRICHMENT_APPSERVICE_URL": "enrichment",
     "TARGET_TRANSLATION_LANGUAGE": "en",
     "AZURE_AI_ENDPOINT": None,
@@ -151,20 +153,34 @@ statusLog = StatusLog(
 )
 
 # Set up clients for Cognitive Search and Storage
-search_client = SearchClient(
-    endpoint=ENV["AZURE_SEARCH_SERVICE_ENDPOINT"],
-    index_name=ENV["AZURE_SEARCH_INDEX"],
-    credential=azure_credential,
+search_client = get_search_client(
+    ENV["AZURE_SEARCH_SERVICE_ENDPOINT"],
+    ENV["AZURE_SEARCH_INDEX"],
+    azure_credential,
     audience=ENV["AZURE_SEARCH_AUDIENCE"]
 )
 
-blob_client = BlobServiceClient(
-    account_url=ENV["AZURE_BLOB_STORAGE_ENDPOINT"],
-    credential=azure_credential,
+blob_client = get_blob_service_client(
+    ENV["AZURE_BLOB_STORAGE_ENDPOINT"],
+    azure_credential,
 )
 blob_container = blob_client.get_container_client(ENV["AZURE_BLOB_STORAGE_CONTAINER"])
 blob_upload_container_client = blob_client.get_container_client(
                                     os.environ["AZURE_BLOB_STORAGE_UPLOAD_CONTAINER"])
+# the indexes of packed documents, so that a citation is a single range read
+chunk_index_cache = PackIndexCache()
+
+# When the index stores compressed vectors, query vectors get the same transform,
+# read from the calibration stored for the index, which must match the vector field
+# the index was deployed with. Searches report the mismatch until the index is calibrated
+vector_calibration = IndexCalibration(blob_container,
+                                      ENV["AZURE_SEARCH_INDEX"],
+                                      ENV["EMBEDDING_COMPRESSION_MODE"],
+                                      int(ENV["EMBEDDING_COMPRESSION_DIMENSIONS"]))
+try:
+    vector_calibration.get()
+except ValueError as error:
+    log.error(f"Vector search is unavailable until the index is calibrated: {str(error)}")
 
 MODEL_NAME = ''
 MODEL_VERSION = ''
@@ -216,7 +232,8 @@ chat_approaches = {
                                     ENV["AZURE_AI_ENDPOINT"],
                                     ENV["AZURE_AI_LOCATION"],
                                     token_provider,
-                                    str_to_bool.get(ENV["USE_SEMANTIC_RERANKER"])
+                                    str_to_bool.get(ENV["USE_SEMANTIC_RERANKER"]),
+                                    vector_calibration
                                 ),
     Approaches.ChatWebRetrieveRead: ChatWebRetrieveRead(
                                     MODEL_NAME,
@@ -257,7 +274,8 @@ chat_approaches = {
                                     ENV["AZURE_AI_ENDPOINT"],
                                     ENV["AZURE_AI_LOCATION"],
                                     token_provider,
-                                    str_to_bool.get(ENV["USE_SEMANTIC_RERANKER"])
+                                    str_to_bool.get(ENV["USE_SEMANTIC_RERANKER"]),
+                                    vector_calibration
                                 ),
     Approaches.GPTDirect: GPTDirectApproach(
                                 token_provider,
@@ -368,9 +386,7 @@ async def get_all_upload_status(request: Request):
         # retrieve tags for each file
          # Initialize an empty list to hold the tags
         items = []
-        cosmos_client = CosmosClient(url=statusLog._url,
-                                     credential=azure_credential,
-                                     consistency_level='Session')
+        cosmos_client = get_cosmos_client(statusLog._url, azure_credential)
         database = cosmos_client.get_database_client(statusLog._database_name)
         container = database.get_container_client(statusLog._container_name)
         query_string = "SELECT DISTINCT VALUE t FROM c JOIN t IN c.tags"
@@ -507,7 +523,7 @@ async def get_tags(request: Request):
     try:
         # Initialize an empty list to hold the tags
         items = []              
-        cosmos_client = CosmosClient(url=statusLog._url, credential=azure_credential, consistency_level='Session')     
+        cosmos_client = get_cosmos_client(statusLog._url, azure_credential)
         database = cosmos_client.get_database_client(statusLog._database_name)               
         container = database.get_container_client(statusLog._container_name) 
         query_string = "SELECT DISTINCT VALUE t FROM c JOIN t IN c.tags"  
@@ -623,9 +639,10 @@ async def get_citation(request: Request):
     try:
         json_body = await request.json()
         citation = urllib.parse.unquote(json_body.get("citation"))    
-        blob = blob_container.get_blob_client(citation).download_blob()
-        decoded_text = blob.readall().decode()
-        results = json.loads(decoded_text)
+        # read the chunk from its own blob, or from the pack of its document
+        results = read_chunk(blob_container, citation, chunk_index_cache)
+        # chunks embedded by earlier versions carry their vector inline, which is not displayed
+        results.pop("contentVector", None)
     except Exception as ex:
         log.exception("Exception in /getcitation")
         raise HTTPException(status_code=500, detail=str(ex)) from ex
@@ -5,8 +5,7 @@ import json
 import re
 import logging
 import urllib.parse
-from datetime import datetime, timedelta
-from typing import Any, Sequence
+from typing import Any, Optional, Sequence
 
 import openai
 from openai import  AsyncAzureOpenAI
@@ -18,11 +17,12 @@ from azure.search.documents.models import QueryType
 from azure.storage.blob import (
     BlobSasPermissions,
     BlobServiceClient,
-    generate_blob_sas,
 )
 from text import nonewlines
 from core.modelhelper import get_token_limit
-import requests
+from shared_code.vector_compression import IndexCalibration
+from shared_code.clients import get_http_session
+from shared_code.sas_cache import get_blob_sas_cache
 
 class ChatReadRetrieveReadApproach(Approach):
     """Approach that uses a simple retrieve-then-read implementation, using the Azure AI Search and
@@ -103,7 +103,8 @@ class ChatReadRetrieveReadApproach(Approach):
         azure_ai_endpoint:str,
         azure_ai_location:str,
         azure_ai_token_provider:str,
-        use_semantic_reranker: bool
+        use_semantic_reranker: bool,
+        vector_calibration: Optional[IndexCalibration] = None
     ):
         self.search_client = search_client
         self.chatgpt_deployment = chatgpt_deployment
@@ -124,6 +125,7 @@ class ChatReadRetrieveReadApproach(Approach):
         self.oai_endpoint=oai_endpoint
         self.embedding_service_url = enrichment_appservice_uri
         self.use_semantic_reranker=use_semantic_reranker
+        self.vector_calibration = vector_calibration
         
         openai.api_base = oai_endpoint
         openai.api_type = 'azure'
@@ -229,7 +231,7 @@ class ChatReadRetrieveReadApproach(Approach):
 
         embedded_query_vector = None
         try:
-            response = requests.post(url, json=data,headers=headers,timeout=60)
+            response = get_http_session().post(url, json=data,headers=headers,timeout=60)
             if response.status_code == 200:
                 response_data = response.json()
                 embedded_query_vector =response_data.get('data')
@@ -244,6 +246,17 @@ class ChatReadRetrieveReadApproach(Approach):
             yield json.dumps({"error": f"Error generating embedding: {str(e)}"}) + "\n"
             return # Go no further
         
+        # match the compression of the vectors stored in the index
+        if self.vector_calibration is not None:
+            try:
+                vector_compressor = self.vector_calibration.get()
+            except ValueError as e:
+                log.error(f"Error matching the vector compression of the index: {str(e)}")
+                yield json.dumps({"error": f"Error matching the vector compression of the index: {str(e)}"}) + "\n"
+                return # Go no further
+            if vector_compressor is not None:
+                embedded_query_vector = vector_compressor.transform_query(embedded_query_vector)
+
         #vector set up for pure vector search & Hybrid search & Hybrid semantic
         vector = VectorizedQuery(vector=embedded_query_vector, k_nearest_neighbors=top, fields="contentVector")
 
@@ -449,7 +462,7 @@ class ChatReadRetrieveReadApproach(Approach):
                 }
             } 
 
-            response = requests.post(api_detect_endpoint, headers=headers, json=data)
+            response = get_http_session().post(api_detect_endpoint, headers=headers, json=data)
 
             if response.status_code == 200:
                 detected_language = response.json()["results"]["documents"][0]["detectedLanguage"]["iso6391Name"]
@@ -471,7 +484,7 @@ class ChatReadRetrieveReadApproach(Approach):
         data = [{
             "text": response
         }]          
-        response = requests.post(api_translate_endpoint, headers=headers, json=data, params=params)
+        response = get_http_session().post(api_translate_endpoint, headers=headers, json=data, params=params)
         
         if response.status_code == 200:
             translated_response = response.json()[0]['translations'][0]['text']
@@ -487,16 +500,11 @@ class ChatReadRetrieveReadApproach(Approach):
                 source_file.split(separator)[4:])
             container_name = separator.join(
                 source_file.split(separator)[3:4])
-            # Obtain the user delegation key
-            user_delegation_key = self.blob_client.get_user_delegation_key(key_start_time=datetime.utcnow(), key_expiry_time=datetime.utcnow() + timedelta(hours=2))
-
-            sas_token = generate_blob_sas(
-                account_name=self.blob_client.account_name,
-                container_name=container_name,
-                blob_name=file_path_w_name_no_cont,
-                user_delegation_key=user_delegation_key,
-                permission=BlobSasPermissions(read=True),
-                expiry=datetime.utcnow() + timedelta(hours=1),
+            # Reuse the delegation key, and the token of a file cited again, while they are valid
+            sas_token = get_blob_sas_cache(self.blob_client).get_sas(
+                container_name,
+                file_path_w_name_no_cont,
+                BlobSasPermissions(read=True)
             )
             return source_file + "?" + sas_token
         except Exception as error:
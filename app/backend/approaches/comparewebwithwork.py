@@ -6,7 +6,7 @@ import json
 import logging
 import re
 import urllib.parse
-from typing import Any, Sequence
+from typing import Any, Optional, Sequence
 import openai
 from openai import AzureOpenAI, BadRequestError
 from openai import  AsyncAzureOpenAI
@@ -18,6 +18,7 @@ from azure.storage.blob import (
     BlobServiceClient
 )
 from core.modelhelper import get_token_limit
+from shared_code.vector_compression import IndexCalibration
 
 class CompareWebWithWork(Approach):
     """
@@ -62,7 +63,8 @@ class CompareWebWithWork(Approach):
         azure_ai_endpoint:str,
         azure_ai_location: str,
         azure_ai_token_provider: str,
-        use_semantic_reranker: bool
+        use_semantic_reranker: bool,
+        vector_calibration: Optional[IndexCalibration] = None
     ):
         self.search_client = search_client
         self.chatgpt_deployment = chatgpt_deployment
@@ -84,6 +86,7 @@ class CompareWebWithWork(Approach):
         self.model_version = model_version
         self.enrichment_appservice_url = enrichment_appservice_url
         self.use_semantic_reranker = use_semantic_reranker
+        self.vector_calibration = vector_calibration
         
           # openai.api_base = oai_endpoint
         openai.api_type = 'azure'
@@ -124,7 +127,8 @@ class CompareWebWithWork(Approach):
                                     self.azure_ai_endpoint,
                                     self.azure_ai_location,
                                     self.azure_ai_token_provider,
-                                    self.use_semantic_reranker
+                                    self.use_semantic_reranker,
+                                    self.vector_calibration
                                 )
         rrr_response = chat_rrr_approach.run(history, overrides, {}, thought_chain)
         content = ""
@@ -0,0 +1,144 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import logging
+import threading
+import time
+from typing import List, Mapping, Optional
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def estimate_tokens(texts: List[str]) -> int:
+    """ Estimates the tokens an embeddings request will be charged for, using the
+    cl100k_base encoding of the Azure OpenAI embedding models """
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding("cl100k_base")
+                except Exception as error:
+                    logging.warning(f"Falling back to a character based token estimate: {str(error)}")
+                    _encoding = False
+    if _encoding is False:
+        return sum(len(text) // 4 + 1 for text in texts)
+    return sum(len(tokens) for tokens in _encoding.encode_ordinary_batch(texts))
+
+
+def parse_retry_after(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    """ Returns the seconds to wait from the retry-after-ms or retry-after headers of
+    a throttled response, if the service sent either """
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms") is not None:
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after") is not None:
+            return float(headers["retry-after"])
+    except ValueError:
+        return None
+    return None
+
+
+class AIMDConcurrencyController:
+    """ Limits the number of Azure OpenAI requests in flight, adapting the limit with
+    additive increase, multiplicative decrease: every successful request grows the
+    limit by additive_increase / limit (about one request per round of requests)
+    and every throttled request cuts it by decrease_factor. A throttled response
+    also pauses all new requests for its retry-after period, and a request is held
+    back while the remaining tokens reported by the service would not cover it
+    together with the requests already in flight, so the deployment's quota is
+    used without triggering waves of retries """
+
+    def __init__(self, initial_limit: int, max_limit: int, min_limit: int = 1,
+                 additive_increase: float = 1.0, decrease_factor: float = 0.5):
+        self.min_limit = max(1, int(min_limit))
+        self.max_limit = max(self.min_limit, int(max_limit))
+        self.limit = float(min(max(int(initial_limit), self.min_limit), self.max_limit))
+        self.additive_increase = additive_increase
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self.tokens_in_flight = 0
+        self.remaining_requests = None
+        self.remaining_tokens = None
+        self.throttle_events = 0
+        self.paused_until = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self, tokens: int) -> float:
+        """ Blocks until a request costing the given tokens may be sent, returning
+        the seconds spent waiting """
+        start = time.monotonic()
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    self._condition.wait(self.paused_until - now)
+                    continue
+                if self.in_flight >= int(self.limit):
+                    self._condition.wait()
+                    continue
+                # with nothing in flight a request is always sent, to refresh the remaining quota
+                if self.in_flight > 0 and self.remaining_tokens is not None \
+                        and self.tokens_in_flight + tokens > self.remaining_tokens:
+                    self._condition.wait(1.0)
+                    continue
+                break
+            self.in_flight += 1
+            self.tokens_in_flight += tokens
+        return time.monotonic() - start
+
+    def on_success(self, tokens: int, headers: Optional[Mapping[str, str]] = None) -> None:
+        """ Records a completed request and the quota the service reported with it """
+        with self._condition:
+            self._release(tokens)
+            self.limit = min(self.max_limit, self.limit + self.additive_increase / self.limit)
+            self._update_remaining(headers)
+            self._condition.notify_all()
+
+    def on_throttle(self, tokens: int, retry_after: Optional[float], headers=None) -> None:
+        """ Records a throttled (429) request, shrinking the limit and pausing new requests """
+        with self._condition:
+            self._release(tokens)
+            self.throttle_events += 1
+            self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+            self.paused_until = max(self.paused_until, time.monotonic() + (retry_after or 1.0))
+            self._update_remaining(headers)
+            self._condition.notify_all()
+
+    def on_error(self, tokens: int) -> None:
+        """ Records a request that failed for a reason other than throttling """
+        with self._condition:
+            self._release(tokens)
+            self._condition.notify_all()
+
+    def stats(self):
+        """ Returns the current limit and quota state """
+        with self._condition:
+            return {
+                "limit": self.limit,
+                "in_flight": self.in_flight,
+                "tokens_in_flight": self.tokens_in_flight,
+                "remaining_requests": self.remaining_requests,
+                "remaining_tokens": self.remaining_tokens,
+                "throttle_events": self.throttle_events
+            }
+
+    def _release(self, tokens):
+        self.in_flight -= 1
+        self.tokens_in_flight -= tokens
+
+    def _update_remaining(self, headers):
+        if not headers:
+            return
+        for header, attribute in (("x-ratelimit-remaining-requests", "remaining_requests"),
+                                  ("x-ratelimit-remaining-tokens", "remaining_tokens")):
+            value = headers.get(header)
+            if value is not None:
+                try:
+                    setattr(self, attribute, int(float(value)))
+                except ValueError:
+                    pass
@@ -10,23 +10,42 @@ import re
 from datetime import datetime
 from typing import List
 import base64
-import requests
 import random
-from azure.storage.queue import QueueClient, TextBase64EncodePolicy
+from concurrent.futures import ThreadPoolExecutor
+from azure.storage.queue import TextBase64EncodePolicy
 from azure.search.documents import SearchClient
 from azure.identity import ManagedIdentityCredential, DefaultAzureCredential, get_bearer_token_provider, AzureAuthorityHosts
-from data_model import (EmbeddingResponse, ModelInfo, ModelListResponse,
-                        StatusResponse)
+from aoai_concurrency import AIMDConcurrencyController, estimate_tokens, parse_retry_after
+from data_model import (BatchingStatsResponse, CacheStatsResponse,
+                        EmbeddingBatchResponse, EmbeddingResponse, ModelInfo,
+                        ModelListResponse, PipelineStatsResponse,
+                        ReembedStatusResponse, StatusResponse)
+from embedding_batcher import MicroBatcher
+from embedding_cache import EmbeddingCache
+from embedding_worker import embed_chunks
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import RedirectResponse
-from model_handling import load_models
+from inference_pool import InferencePool
+from fastapi.responses import RedirectResponse, Response
+from message_lease import MessageLease
+from reembed_job import RateLimiter, ReembedJob
+import metrics
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from model_handling import ModelRegistry, sanitize_model_name
 import openai
 from openai import AzureOpenAI
 from tenacity import retry, wait_random_exponential, stop_after_attempt
 from sentence_transformers import SentenceTransformer
 from shared_code.utilities_helper import UtilitiesHelper
+from shared_code.clients import (get_blob_service_client, get_http_session,
+                                 get_queue_client, get_search_client)
 from shared_code.status_log import State, StatusClassification, StatusLog
-from azure.storage.blob import BlobServiceClient
+from shared_code.search_index_writer import SearchIndexWriter
+from shared_code.vector_compression import IndexCalibration, VectorCompressor
+from shared_code.chunk_pack import (PackedChunks, delete_blob_quietly, is_pack_blob,
+                                    is_pack_index_blob, new_pack_name)
+from shared_code.vector_sidecar import (SIDECAR_EXTENSION, encode_vectors, is_chunk_blob,
+                                        read_chunk_vector, sidecar_reference,
+                                        sidecar_row_reference)
 from urllib.parse import unquote
 
 # === ENV Setup ===
@@ -35,6 +54,32 @@ ENV = {
     "EMBEDDINGS_QUEUE": None,
     "LOG_LEVEL": "DEBUG", # Will be overwritten by LOG_LEVEL in Environment
     "DEQUEUE_MESSAGE_BATCH_SIZE": 1,
+    "MAX_EMBEDDING_BATCH_SIZE": 32,
+    "EMBEDDING_MICRO_BATCH_MAX_SIZE": 32,
+    "EMBEDDING_MICRO_BATCH_WAIT_MS": 5,
+    "EMBEDDING_CACHE_PATH": "cache/embeddings.db",
+    "EMBEDDING_CACHE_MAX_ENTRIES": 200000,
+    "EMBEDDING_CACHE_SNAPSHOT_PATH": "",
+    "EMBEDDING_CACHE_SNAPSHOT_MINUTES": 15,
+    "CHUNK_IO_CONCURRENCY": 8,
+    "EMBEDDING_PIPELINE_QUEUE_SIZE": 2,
+    "EMBEDDING_MESSAGE_WORKERS": 3,
+    "EMBEDDING_MESSAGE_LEASE_SECONDS": 300,
+    "EMBEDDING_INFERENCE_PROCESSES": 0,
+    "EMBEDDING_INFERENCE_THREADS_PER_PROCESS": 0,
+    "AZURE_OPENAI_EMBEDDING_INITIAL_CONCURRENCY": 4,
+    "AZURE_OPENAI_EMBEDDING_MAX_CONCURRENCY": 16,
+    "AZURE_OPENAI_EMBEDDING_MAX_ATTEMPTS": 5,
+    "SEARCH_INDEX_MAX_BATCH_BYTES": 8388608,
+    "SEARCH_INDEX_WRITE_CONCURRENCY": 4,
+    "SEARCH_INDEX_MAX_RETRIES": 5,
+    "EMBEDDING_VECTOR_DTYPE": "float32",
+    "EMBEDDING_COMPRESSION_MODE": "none",
+    "EMBEDDING_COMPRESSION_DIMENSIONS": 0,
+    "REEMBED_TARGET_INDEX": "",
+    "REEMBED_MAX_CHUNKS_PER_SECOND": 20,
+    "REEMBED_PAGE_SIZE": 1000,
+    "REEMBED_AUTO_RESUME": "true",
     "AZURE_BLOB_STORAGE_ACCOUNT": None,
     "AZURE_BLOB_STORAGE_CONTAINER": None,
     "AZURE_BLOB_STORAGE_ENDPOINT": None,
@@ -54,6 +99,10 @@ ENV = {
     "AZURE_SEARCH_SERVICE_ENDPOINT": None,
     "AZURE_SEARCH_AUDIENCE": None,
     "LOCAL_DEBUG": "false",
+    "EMBEDDINGS_MODELS_PATH": "models/",
+    "EMBEDDINGS_MODELS_OFFLINE": "false",
+    "EMBEDDINGS_MODEL_MEMORY_BUDGET_MB": 0,
+    "EMBEDDINGS_MODEL_VERIFY_CHECKSUMS": "true",
     "AZURE_AI_CREDENTIAL_DOMAIN": None,
     "AZURE_OPENAI_AUTHORITY_HOST": None
 }
@@ -95,18 +144,59 @@ client = AzureOpenAI(
         api_version=openai.api_version)
 
 class AzOAIEmbedding(object):
-    """A wrapper for a Azure OpenAI Embedding model"""
-    def __init__(self, deployment_name) -> None:
+    """A wrapper for a Azure OpenAI Embedding model. Requests go through an adaptive
+    concurrency controller that follows the rate limit headers of the deployment"""
+    def __init__(self, deployment_name, controller, max_attempts) -> None:
         self.deployment_name = deployment_name
-    
-    @retry(wait=wait_random_exponential(multiplier=1, max=10), stop=stop_after_attempt(5))
+        self.controller = controller
+        self.max_attempts = max_attempts
+        # throttled requests are retried here, paced by the controller, rather than by the SDK
+        self.client = client.with_options(max_retries=0)
+
     def encode(self, texts):
         """Embeds a list of texts using a given model"""
-        response = client.embeddings.create(
-        model= self.deployment_name,
-        input=texts
-        )
-        return response
+        tokens = estimate_tokens(texts)
+        for attempt in range(1, self.max_attempts + 1):
+            metrics.AOAI_WAIT_SECONDS.observe(self.controller.acquire(tokens))
+            self._report()
+            try:
+                raw_response = self.client.embeddings.with_raw_response.create(
+                    model=self.deployment_name,
+                    input=texts
+                )
+            except openai.RateLimitError as error:
+                self.controller.on_throttle(tokens, parse_retry_after(error.response.headers), error.response.headers)
+                metrics.AOAI_THROTTLES.inc()
+                self._report()
+                log.debug("Azure OpenAI throttled an embeddings request, concurrency limit now %.1f",
+                          self.controller.limit)
+                if attempt == self.max_attempts:
+                    raise
+                continue
+            except (openai.APIConnectionError, openai.InternalServerError):
+                self.controller.on_error(tokens)
+                self._report()
+                if attempt == self.max_attempts:
+                    raise
+                time.sleep(random.uniform(0, min(10, 2 ** attempt)))
+                continue
+            except Exception:
+                self.controller.on_error(tokens)
+                self._report()
+                raise
+            self.controller.on_success(tokens, raw_response.headers)
+            metrics.AOAI_TOKENS.inc(tokens)
+            self._report()
+            return raw_response.parse()
+
+    def _report(self):
+        stats = self.controller.stats()
+        metrics.AOAI_CONCURRENCY_LIMIT.set(stats["limit"])
+        metrics.AOAI_IN_FLIGHT.set(stats["in_flight"])
+        if stats["remaining_tokens"] is not None:
+            metrics.AOAI_REMAINING_TOKENS.set(stats["remaining_tokens"])
+        if stats["remaining_requests"] is not None:
+            metrics.AOAI_REMAINING_REQUESTS.set(stats["remaining_requests"])
     
    
 
@@ -143,22 +233,109 @@ start_time = datetime.now()
 
 IS_READY = False
 
-#download models
-log.debug("Loading embedding models...")
-models, model_info = load_models()
+# Models are loaded on first use from the local artifact directory, only falling
+# back to the hub when a model has not been saved locally yet
+models = ModelRegistry(
+    os.getenv("TARGET_EMBEDDINGS_MODEL",
+              "all-mpnet-base-v2|paraphrase-multilingual-MiniLM-L12-v2|BAAI/bge-small-en-v1.5").split("|"),
+    models_path=ENV["EMBEDDINGS_MODELS_PATH"],
+    memory_budget_mb=float(ENV["EMBEDDINGS_MODEL_MEMORY_BUDGET_MB"]),
+    offline=ENV["EMBEDDINGS_MODELS_OFFLINE"] == "true",
+    verify_checksums=ENV["EMBEDDINGS_MODEL_VERIFY_CHECKSUMS"] == "true",
+    load_in_process=int(ENV["EMBEDDING_INFERENCE_PROCESSES"]) == 0)
 
 # Add Azure OpenAI Embedding & additional Model
-models["azure-openai_" + ENV["AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME"]] = AzOAIEmbedding(
-    ENV["AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME"])
-
-model_info["azure-openai_" + ENV["AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME"]] = {
-    "model": "azure-openai_" + ENV["AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME"],
-    "vector_size": 1536,
-    # Source: https://platform.openai.com/docs/guides/embeddings/what-are-embeddings
-}
-
-log.debug("Models loaded")
-IS_READY = True
+models.register("azure-openai_" + ENV["AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME"],
+                AzOAIEmbedding(ENV["AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME"],
+                               AIMDConcurrencyController(int(ENV["AZURE_OPENAI_EMBEDDING_INITIAL_CONCURRENCY"]),
+                                                         int(ENV["AZURE_OPENAI_EMBEDDING_MAX_CONCURRENCY"])),
+                               int(ENV["AZURE_OPENAI_EMBEDDING_MAX_ATTEMPTS"])),
+                {
+                    "model": "azure-openai_" + ENV["AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME"],
+                    "vector_size": 1536,
+                    # Source: https://platform.openai.com/docs/guides/embeddings/what-are-embeddings
+                    "backend": "azure-openai",
+                })
+metrics.register_model_collector(models.status)
+
+# Local models can be served by a pool of worker processes, each with its own copy
+# of the models, so inference is not limited by the GIL of this process
+inference_pool = None
+if int(ENV["EMBEDDING_INFERENCE_PROCESSES"]) > 0:
+    inference_pool = InferencePool(int(ENV["EMBEDDING_INFERENCE_PROCESSES"]),
+                                   models.names(),
+                                   models_path=ENV["EMBEDDINGS_MODELS_PATH"],
+                                   memory_budget_mb=float(ENV["EMBEDDINGS_MODEL_MEMORY_BUDGET_MB"]),
+                                   threads_per_process=int(ENV["EMBEDDING_INFERENCE_THREADS_PER_PROCESS"]))
+
+def preload_target_model():
+    """ Loads the model used by the embeddings queue, the only model needed before
+    the service is ready. Other models are loaded when first requested. A failed load,
+    such as a model download that times out, is retried with a growing backoff, as the
+    service never becomes ready without the model """
+    global IS_READY
+    target_embeddings_model = sanitize_model_name(ENV["TARGET_EMBEDDINGS_MODEL"])
+    attempt = 0
+    while not IS_READY:
+        attempt += 1
+        log.debug("Loading embedding model %s, attempt %d...", target_embeddings_model, attempt)
+        try:
+            if target_embeddings_model in models:
+                if inference_pool is not None:
+                    # download and verify the model once here, then load it in every worker
+                    models.prepare(target_embeddings_model)
+                    inference_pool.start(preload=[target_embeddings_model])
+                else:
+                    models[target_embeddings_model]
+            elif inference_pool is not None:
+                inference_pool.start()
+            log.debug("Models loaded")
+            IS_READY = True
+        except Exception as error:
+            backoff = min(300, 5 * 2 ** (attempt - 1))
+            log.error("Failed to load embedding model %s on attempt %d, retrying in %d seconds: %s",
+                      target_embeddings_model, attempt, backoff, str(error))
+            time.sleep(random.uniform(backoff / 2, backoff))
+
+threading.Thread(target=preload_target_model, name="model-preload", daemon=True).start()
+
+# Micro-batchers are created per model on the first /embed call
+batchers = {}
+batchers_lock = threading.Lock()
+
+# Embeddings are cached by model and text hash so unchanged chunks are never re-embedded
+embedding_cache = EmbeddingCache(ENV["EMBEDDING_CACHE_PATH"], int(ENV["EMBEDDING_CACHE_MAX_ENTRIES"]),
+                                 snapshot_path=ENV["EMBEDDING_CACHE_SNAPSHOT_PATH"],
+                                 snapshot_seconds=float(ENV["EMBEDDING_CACHE_SNAPSHOT_MINUTES"]) * 60)
+
+# Bounded pool for concurrent chunk downloads and write-backs to blob storage
+chunk_io_pool = ThreadPoolExecutor(max_workers=int(ENV["CHUNK_IO_CONCURRENCY"]),
+                                   thread_name_prefix="chunk-io")
+
+# Threads for concurrent Azure OpenAI embedding calls, paced by the model's concurrency controller
+aoai_pool = ThreadPoolExecutor(max_workers=int(ENV["AZURE_OPENAI_EMBEDDING_MAX_CONCURRENCY"]),
+                               thread_name_prefix="aoai-embedding")
+
+# Throughput of each embeddings pipeline stage, accumulated across documents
+pipeline_stats = {}
+
+# Documents are embedded concurrently, one queue message per worker
+message_worker_pool = ThreadPoolExecutor(max_workers=int(ENV["EMBEDDING_MESSAGE_WORKERS"]),
+                                         thread_name_prefix="embedding-worker")
+message_slots = threading.BoundedSemaphore(int(ENV["EMBEDDING_MESSAGE_WORKERS"]))
+
+# One search client and upload pool shared by the index writers of every document
+search_client = get_search_client(ENV["AZURE_SEARCH_SERVICE_ENDPOINT"],
+                                  ENV["AZURE_SEARCH_INDEX"],
+                                  azure_credential,
+                                  audience=ENV["AZURE_SEARCH_AUDIENCE"])
+index_write_pool = ThreadPoolExecutor(max_workers=int(ENV["SEARCH_INDEX_WRITE_CONCURRENCY"]) *
+                                      int(ENV["EMBEDDING_MESSAGE_WORKERS"]),
+                                      thread_name_prefix="index-writer")
+
+# Vector compression calibrations, by index name, read from the content container on first use
+vector_calibrations = {}
+vector_calibrations_lock = threading.Lock()
 
 # Create API
 app = FastAPI(
@@ -190,8 +367,10 @@ def health():
     uptime = datetime.now() - start_time
     uptime_seconds = uptime.total_seconds()
 
-    output = {"status": None, "uptime_seconds": uptime_seconds, "version": app.version}
+    output = {"status": None, "uptime_seconds": uptime_seconds, "version": app.version,
+              "models": models.status()}
 
+    # ready once the model used by the embeddings queue has been loaded
     if IS_READY:
         output["status"] = "ready"
     else:
@@ -208,7 +387,7 @@ def get_models():
     Returns:
         ModelListResponse: A list of available models
     """
-    return {"models": list(model_info.values())}
+    return {"models": [models.info(name) for name in models.names()]}
 
 
 @app.get("/models/{model}", response_model=ModelInfo, tags=["models"])
@@ -224,7 +403,7 @@ def get_model(model: str):
 
     if model not in models:
         return {"message": f"Model {model} not found"}
-    return model_info[model]
+    return models.info(model)
 
 
 @app.post("/models/{model}/embed", response_model=EmbeddingResponse, tags=["models"])
@@ -242,19 +421,18 @@ def embed_texts(model: str, texts: List[str]):
     if model not in models:
         return {"message": f"Model {model} not found"}
 
-    model_obj = models[model]
     try:
         if model.startswith("azure-openai_"):
-            embeddings = model_obj.encode(texts)
-            embeddings= embeddings.data[0].embedding
-            
+            # Azure OpenAI calls are network bound, so they are sent straight to the service
+            encode_fn = lambda uncached: encode_uncached(model, uncached)
         else:
-            embeddings = model_obj.encode(texts)
-            embeddings = embeddings.tolist()[0]
+            # local models coalesce concurrent requests into shared encode calls
+            encode_fn = get_batcher(model).submit
+        embeddings = embedding_cache.get_or_compute(model, texts, encode_fn)[0]
 
         output = {
             "model": model,
-            "model_info": model_info[model],
+            "model_info": models.info(model),
             "data": embeddings
         }
     
@@ -265,24 +443,217 @@ def embed_texts(model: str, texts: List[str]):
     return output
 
 
+@app.post("/models/{model}/embed_batch", response_model=EmbeddingBatchResponse, tags=["models"])
+def embed_texts_batch(model: str, texts: List[str]):
+    """Embeds a list of texts using a given model, returning one vector per text
+    Args:
+        model (str): The name of the model
+        texts (List[str]): A list of texts
+
+    Returns:
+        EmbeddingBatchResponse: The embeddings of the texts, in the order they were supplied
+    """
+
+    if model not in models:
+        raise HTTPException(status_code=404, detail=f"Model {model} not found")
+
+    try:
+        embeddings = encode_batch(model, texts)
+    except Exception as error:
+        logging.error(f"Failed to embed: {str(error)}")
+        raise HTTPException(status_code=500, detail=f"Failed to embed: {str(error)}") from error
+
+    return {
+        "model": model,
+        "model_info": models.info(model),
+        "data": embeddings
+    }
+
+
+@app.get("/cache", response_model=CacheStatsResponse, tags=["models"])
+def get_cache_stats():
+    """Returns the hit and miss counters of the embedding cache
+
+    Returns:
+        CacheStatsResponse: Embedding cache statistics
+    """
+    return embedding_cache.stats()
+
+
+@app.get("/pipeline", response_model=PipelineStatsResponse, tags=["health"])
+def get_pipeline_stats():
+    """Returns the throughput of each stage of the embeddings pipeline
+
+    Returns:
+        PipelineStatsResponse: Cumulative statistics per pipeline stage
+    """
+    return {"stages": [stats.to_dict() for stats in list(pipeline_stats.values())]}
+
+
+@app.get("/metrics", tags=["health"], response_class=Response)
+def get_metrics():
+    """Returns the service metrics in the Prometheus text exposition format
 
-def index_sections(chunks):
-    """ Pushes a batch of content to the search index
-    """    
-    search_client = SearchClient(endpoint=ENV["AZURE_SEARCH_SERVICE_ENDPOINT"],
-                                    index_name=ENV["AZURE_SEARCH_INDEX"],
-                                    credential=azure_credential,
-                                    audience=ENV["AZURE_SEARCH_AUDIENCE"])
+    Returns:
+        Response: Counters and histograms for queue polling, embedding, blob storage,
+        search uploads and model loading
+    """
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/reembed", response_model=ReembedStatusResponse, tags=["models"])
+def get_reembed_status():
+    """Returns the progress of the job that re-embeds stored chunks with the target model
+
+    Returns:
+        ReembedStatusResponse: Progress of the re-embedding job
+    """
+    return reembed_job.status()
 
-    results = search_client.upload_documents(documents=chunks)
-    succeeded = sum([1 for r in results if r.succeeded])
-    log.debug(f"\tIndexed {len(results)} chunks, {succeeded} succeeded")
+
+@app.post("/reembed", response_model=ReembedStatusResponse, tags=["models"])
+def start_reembed(restart: bool = False):
+    """Starts the re-embedding job, or resumes it from its last checkpoint
+    Args:
+        restart (bool): Discard the progress of an earlier run and start from the first chunk
+
+    Returns:
+        ReembedStatusResponse: Progress of the re-embedding job
+    """
+    if not IS_READY:
+        raise HTTPException(status_code=503, detail="The target embeddings model is not loaded yet")
+    try:
+        return reembed_job.start(restart=restart)
+    except RuntimeError as error:
+        raise HTTPException(status_code=409, detail=str(error)) from error
+
+
+@app.delete("/reembed", response_model=ReembedStatusResponse, tags=["models"])
+def stop_reembed():
+    """Stops the re-embedding job after the page in progress, keeping its checkpoint.
+    Returns without waiting for the page, with the state stopping until the job has stopped
+
+    Returns:
+        ReembedStatusResponse: Progress of the re-embedding job
+    """
+    return reembed_job.stop()
+
+
+@app.get("/batching", response_model=BatchingStatsResponse, tags=["models"])
+def get_batching_stats():
+    """Returns the batch sizes achieved by the micro-batching scheduler for each model
+
+    Returns:
+        BatchingStatsResponse: Batching statistics per model
+    """
+    with batchers_lock:
+        return {"models": [batcher.stats() for batcher in batchers.values()]}
+
+
+def get_batcher(model: str) -> MicroBatcher:
+    """ Returns the micro-batcher that coalesces concurrent /embed calls for a model,
+    creating it on first use
+    """
+    with batchers_lock:
+        if model not in batchers:
+            batchers[model] = MicroBatcher(model,
+                                           lambda texts: encode_uncached(model, texts),
+                                           int(ENV["EMBEDDING_MICRO_BATCH_MAX_SIZE"]),
+                                           float(ENV["EMBEDDING_MICRO_BATCH_WAIT_MS"]),
+                                           # keep every inference worker busy when there is a pool
+                                           max_in_flight=inference_pool.processes if inference_pool is not None else 1)
+        return batchers[model]
+
+
+def encode_batch(model: str, texts: List[str]) -> List[List[float]]:
+    """ Embeds the texts with the given model, returning one vector per text in
+    input order. Only texts missing from the embedding cache reach the model
+    """
+    return embedding_cache.get_or_compute(model, texts, lambda uncached: encode_uncached(model, uncached))
+
+
+def encode_uncached(model: str, texts: List[str]) -> List[List[float]]:
+    """ Embeds the texts with the given model in slices of at most
+    MAX_EMBEDDING_BATCH_SIZE, returning one vector per text in input order
+    """
+    use_pool = inference_pool is not None and not model.startswith("azure-openai_")
+    if use_pool:
+        models.prepare(model)
+    else:
+        model_obj = models[model]
+    max_batch_size = int(ENV["MAX_EMBEDDING_BATCH_SIZE"])
+    batches = [texts[start:start + max_batch_size] for start in range(0, len(texts), max_batch_size)]
+    embeddings = []
+    if model.startswith("azure-openai_"):
+        # send the slices concurrently, the model's controller decides how many are in flight
+        def encode_batch(batch):
+            metrics.EMBEDDING_BATCH_SIZE.labels(model).observe(len(batch))
+            with metrics.EMBEDDING_SECONDS.labels(model).time():
+                response = model_obj.encode(batch)
+            return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+        for batch_embeddings in aoai_pool.map(encode_batch, batches):
+            embeddings.extend(batch_embeddings)
+        return embeddings
+    for batch in batches:
+        metrics.EMBEDDING_BATCH_SIZE.labels(model).observe(len(batch))
+        with metrics.EMBEDDING_SECONDS.labels(model).time():
+            if use_pool:
+                embeddings.extend(inference_pool.encode(model, batch).tolist())
+            else:
+                embeddings.extend(model_obj.encode(batch).tolist())
+    return embeddings
+
+
+def get_index_writer(client: SearchClient = None) -> SearchIndexWriter:
+    """ Returns a buffered writer to the search index, or to the index of the given
+    client. Writers share the search client and the upload threads, but each
+    tracks the failures of its own documents
+    """
+    return SearchIndexWriter(client or search_client,
+                             max_batch_bytes=int(ENV["SEARCH_INDEX_MAX_BATCH_BYTES"]),
+                             max_concurrency=int(ENV["SEARCH_INDEX_WRITE_CONCURRENCY"]),
+                             max_retries=int(ENV["SEARCH_INDEX_MAX_RETRIES"]),
+                             executor=index_write_pool,
+                             on_batch=metrics.observe_search_batch)
 
 @app.on_event("startup") 
 def startup_event():
     poll_thread = threading.Thread(target=poll_queue_thread)
     poll_thread.daemon = True
     poll_thread.start()
+    if ENV["REEMBED_AUTO_RESUME"] == "true":
+        threading.Thread(target=resume_reembed_job, name="reembed-resume", daemon=True).start()
+
+@app.on_event("shutdown")
+def shutdown_event():
+    # keep the embeddings added since the last snapshot across the restart
+    try:
+        embedding_cache.snapshot(if_changed=True)
+    except Exception as error:
+        log.warning("Failed to snapshot the embedding cache on shutdown: %s", str(error))
+
+def get_vector_compressor(index_name: str) -> VectorCompressor:
+    """ Returns the compression calibrated for a search index, or None when the index
+    stores full vectors. Calibrations are written by scripts/vector-compression.py.
+    The calibration of AZURE_SEARCH_INDEX must match the vector field it was deployed
+    with, EMBEDDING_COMPRESSION_MODE and EMBEDDING_COMPRESSION_DIMENSIONS, otherwise
+    a ValueError is raised. A missing calibration is looked for again on the next call,
+    while one in use is kept, so the service is restarted after an index is recalibrated
+    """
+    with vector_calibrations_lock:
+        if index_name not in vector_calibrations:
+            blob_service_client = get_blob_service_client(ENV["AZURE_BLOB_STORAGE_ENDPOINT"],
+                                                          azure_credential)
+            container_client = blob_service_client.get_container_client(ENV["AZURE_BLOB_STORAGE_CONTAINER"])
+            if index_name == ENV["AZURE_SEARCH_INDEX"]:
+                vector_calibrations[index_name] = IndexCalibration(container_client, index_name,
+                                                                   ENV["EMBEDDING_COMPRESSION_MODE"],
+                                                                   int(ENV["EMBEDDING_COMPRESSION_DIMENSIONS"]))
+            else:
+                # other indexes, such as a re-embedding target, are created by hand
+                vector_calibrations[index_name] = IndexCalibration(container_client, index_name)
+        calibration = vector_calibrations[index_name]
+    return calibration.get()
 
 def poll_queue_thread():
     while True:
@@ -296,8 +667,8 @@ def get_tags(blob_path):
     path_parts = blob_path.split('/')
     blob_path = '/'.join(path_parts[1:])
 
-    blob_service_client = BlobServiceClient(ENV["AZURE_BLOB_STORAGE_ENDPOINT"],
-                                            credential=azure_credential)
+    blob_service_client = get_blob_service_client(ENV["AZURE_BLOB_STORAGE_ENDPOINT"],
+                                                  azure_credential)
     blob_client = blob_service_client.get_blob_client(
         container=ENV["AZURE_BLOB_STORAGE_UPLOAD_CONTAINER"],
         blob=blob_path)
@@ -314,165 +685,438 @@ def get_tags(blob_path):
     return tags_list
 
 
+def download_chunk(chunk_name):
+    """ Downloads a chunk from the content container and parses its json
+    """
+    with metrics.BLOB_OPERATION_SECONDS.labels("fetch").time():
+        blob_path_plus_sas = utilities_helper.get_blob_and_sas(
+            ENV["AZURE_BLOB_STORAGE_CONTAINER"] + '/' + chunk_name)
+        response = get_http_session().get(blob_path_plus_sas)
+        response.raise_for_status()
+    return json.loads(response.text)
+
+def download_blob_bytes(blob_name):
+    """ Downloads a binary blob, such as a vector sidecar, from the content container
+    """
+    with metrics.BLOB_OPERATION_SECONDS.labels("fetch").time():
+        blob_path_plus_sas = utilities_helper.get_blob_and_sas(
+            ENV["AZURE_BLOB_STORAGE_CONTAINER"] + '/' + blob_name)
+        response = get_http_session().get(blob_path_plus_sas)
+        response.raise_for_status()
+    return response.content
+
+def load_chunk(chunk_name):
+    """ Downloads a chunk along with its embedding, if it has one, whether stored in
+    a vector sidecar or inline in the chunk by earlier versions
+    """
+    chunk_dict = download_chunk(chunk_name)
+    vector = read_chunk_vector(chunk_dict, download_blob_bytes)
+    if vector is not None:
+        chunk_dict['contentVector'] = vector
+    return chunk_dict
+
+def upload_chunk(blob_service_client, chunk_name, chunk_dict, model):
+    """ Writes a chunk back to the content container, with its embedding stored in a
+    binary vector sidecar referenced from the chunk rather than inline as a JSON list
+    """
+    vector = chunk_dict['contentVector']
+    dtype = ENV["EMBEDDING_VECTOR_DTYPE"]
+    reference = sidecar_reference(chunk_name, model, len(vector), dtype)
+    sidecar_blob_client = blob_service_client.get_blob_client(container=ENV["AZURE_BLOB_STORAGE_CONTAINER"],
+                                                              blob=reference["blob"])
+    # write the sidecar first so a chunk never references a vector that does not exist
+    with metrics.BLOB_OPERATION_SECONDS.labels("write").time():
+        sidecar_blob_client.upload_blob(encode_vectors(vector, model, dtype), overwrite=True)
+
+    stored_dict = {key: value for key, value in chunk_dict.items() if key != 'contentVector'}
+    stored_dict['contentVectorRef'] = reference
+    json_str = json.dumps(stored_dict, indent=2, ensure_ascii=False)
+    block_blob_client = blob_service_client.get_blob_client(container=ENV["AZURE_BLOB_STORAGE_CONTAINER"], blob=chunk_name)
+    with metrics.BLOB_OPERATION_SECONDS.labels("write").time():
+        block_blob_client.upload_blob(json_str, overwrite=True)
+
+
+def packed_chunk_loader(packed_chunks):
+    """ Returns the load_chunk of embed_chunks for a packed document. The pack, and the
+    sidecar holding the embeddings of all of its chunks, are each downloaded once
+    """
+    sidecars = {}
+    sidecar_lock = threading.Lock()
+
+    def read_sidecar(blob_name):
+        with sidecar_lock:
+            if blob_name not in sidecars:
+                sidecars[blob_name] = download_blob_bytes(blob_name)
+            return sidecars[blob_name]
+
+    def load(chunk_name):
+        chunk_dict = packed_chunks.read_chunk(chunk_name)
+        vector = read_chunk_vector(chunk_dict, read_sidecar)
+        if vector is not None:
+            chunk_dict['contentVector'] = vector
+        return chunk_dict
+    return load
+
+def chunk_callbacks(blob_service_client, packed_chunks, model):
+    """ Returns the load_chunk and persist_chunk callbacks of embed_chunks for the
+    chunks of a document, whether they are packed or stored one per blob. Packed
+    chunks are only updated in memory, and written by commit_packed_chunks
+    """
+    if packed_chunks is None:
+        return load_chunk, lambda chunk_name, chunk_dict: upload_chunk(
+            blob_service_client, chunk_name, chunk_dict, model)
+    return packed_chunk_loader(packed_chunks), packed_chunks.update
+
+def commit_packed_chunks(packed_chunks, model):
+    """ Writes back the chunks of a packed document once they have been embedded, with
+    the embeddings of all of them in a single vector sidecar that each chunk
+    references by row
+    """
+    if not packed_chunks.dirty:
+        return
+    container_client = packed_chunks.container_client
+    chunks = packed_chunks.read_all()
+    embedded = [(chunk_name, chunk_dict) for chunk_name, chunk_dict in chunks.items()
+                if 'contentVector' in chunk_dict]
+    previous_sidecars = {(chunk_dict.get('contentVectorRef') or {}).get('blob') for chunk_dict in chunks.values()}
+    dtype = ENV["EMBEDDING_VECTOR_DTYPE"]
+    vectors = [chunk_dict['contentVector'] for _, chunk_dict in embedded]
+    sidecar_blob = new_pack_name(packed_chunks.folder, SIDECAR_EXTENSION)
+    # write the sidecar first so a chunk never references a vector that does not exist
+    with metrics.BLOB_OPERATION_SECONDS.labels("write").time():
+        container_client.upload_blob(sidecar_blob, encode_vectors(vectors, model, dtype), overwrite=True)
+    for row, (chunk_name, chunk_dict) in enumerate(embedded):
+        stored_dict = {key: value for key, value in chunk_dict.items() if key != 'contentVector'}
+        stored_dict['contentVectorRef'] = sidecar_row_reference(sidecar_blob, row, model, len(vectors[row]), dtype)
+        packed_chunks.update(chunk_name, stored_dict)
+    with metrics.BLOB_OPERATION_SECONDS.labels("write").time():
+        packed_chunks.commit()
+    # the sidecars of earlier packs are no longer referenced
+    for blob_name in previous_sidecars:
+        if blob_name and is_pack_blob(blob_name):
+            delete_blob_quietly(container_client, blob_name)
+
+
+def build_index_document(chunk_name, chunk_dict, text, folder, tag_list, compressor=None):
+    """ Prepares the index schema based representation of a chunk with its embedding,
+    compressed when the index stores compressed vectors
+    """
+    index_chunk = {}
+    index_chunk['id'] = statusLog.encode_document_id(chunk_name)
+    index_chunk['processed_datetime'] = f"{chunk_dict['processed_datetime']}+00:00"
+    index_chunk['file_name'] = chunk_dict["file_name"]
+    index_chunk['file_uri'] = chunk_dict["file_uri"]
+    index_chunk['folder'] = folder
+    index_chunk['tags'] = tag_list
+    index_chunk['chunk_file'] = chunk_name
+    index_chunk['file_class'] = chunk_dict["file_class"]
+    index_chunk['title'] = chunk_dict["title"]
+    index_chunk['pages'] = chunk_dict["pages"]
+    index_chunk['translated_title'] = chunk_dict["translated_title"]
+    index_chunk['content'] = text
+    vector = chunk_dict['contentVector']
+    if compressor is not None:
+        index_chunk['contentVector'] = compressor.compress_document_vector(vector)
+    else:
+        index_chunk['contentVector'] = vector.tolist() if hasattr(vector, "tolist") else vector
+    index_chunk['entities'] = chunk_dict["entities"]
+    index_chunk['key_phrases'] = chunk_dict["key_phrases"]
+    return index_chunk
+
+
 def poll_queue() -> None:
-    """Polls the queue for messages and embeds them"""
+    """Polls the queue for messages and hands them to the message worker pool"""
     
     if IS_READY == False:
         log.debug("Skipping poll_queue call, models not yet loaded")
         return
+
+    # only take as many messages as there are idle workers to process them
+    available_workers = 0
+    while available_workers < int(ENV["DEQUEUE_MESSAGE_BATCH_SIZE"]) and message_slots.acquire(blocking=False):
+        available_workers += 1
+    if available_workers == 0:
+        log.debug("All embeddings workers are busy, skipping poll")
+        return
     
-    queue_client = QueueClient(account_url=ENV["AZURE_QUEUE_STORAGE_ENDPOINT"],
-                               queue_name=ENV["EMBEDDINGS_QUEUE"],
-                               credential=azure_credential)
+    queue_client = get_queue_client(ENV["AZURE_QUEUE_STORAGE_ENDPOINT"],
+                                    ENV["EMBEDDINGS_QUEUE"],
+                                    azure_credential)
 
     log.debug("Polling embeddings queue for messages...")
-    response = queue_client.receive_messages(max_messages=int(ENV["DEQUEUE_MESSAGE_BATCH_SIZE"]))
-    messages = [x for x in response]
+    # messages stay invisible to other instances under a lease for as long as they are being processed
+    try:
+        with metrics.QUEUE_RECEIVE_SECONDS.time():
+            response = queue_client.receive_messages(max_messages=available_workers,
+                                                     visibility_timeout=int(ENV["EMBEDDING_MESSAGE_LEASE_SECONDS"]))
+            messages = [x for x in response]
+        metrics.QUEUE_MESSAGES_RECEIVED.inc(len(messages))
+    except Exception:
+        for _ in range(available_workers):
+            message_slots.release()
+        raise
+
+    # return the worker slots that were not needed
+    for _ in range(available_workers - len(messages)):
+        message_slots.release()
 
     if not messages:
         log.debug("No messages to process. Waiting for a couple of minutes...")
         time.sleep(120)  # Sleep for 2 minutes
         return
 
-    target_embeddings_model = re.sub(r'[^a-zA-Z0-9_\-.]', '_', ENV["TARGET_EMBEDDINGS_MODEL"])
-
-    # Remove from queue to prevent duplicate processing from any additional instances
     for message in messages:
-        queue_client.delete_message(message)
-    
-    for message in messages:       
-        message_b64 = message.content
-        message_json = json.loads(base64.b64decode(message_b64))
-        blob_path = message_json["blob_name"]
-
-        try:  
-            statusLog.upsert_document(blob_path, f'Embeddings process started with model {target_embeddings_model}', StatusClassification.INFO, State.PROCESSING)
-            log.debug("Processing file: %s", blob_path)
-            file_name, file_extension, file_directory  = utilities_helper.get_filename_and_extension(blob_path)
-            chunk_folder_path = file_directory + file_name + file_extension
-            blob_service_client = BlobServiceClient(ENV["AZURE_BLOB_STORAGE_ENDPOINT"],
-                                            credential=azure_credential)
-            container_client = blob_service_client.get_container_client(ENV["AZURE_BLOB_STORAGE_CONTAINER"])
-            index_chunks = []
-                                    
-            # get tags to apply to the chunk
-            tag_list = get_tags(blob_path)
-            log.debug("Successfully pulled tags for %s. %d tags found.", blob_path, len(tag_list))
+        message_worker_pool.submit(process_message, queue_client, message)
 
-            # Iterate over the chunks in the container
-            chunk_list = container_client.list_blobs(name_starts_with=chunk_folder_path)
-            chunks = list(chunk_list)
-            i = 0
-            log.debug("Processing %d chunks", len(chunks))         
-            for chunk in chunks:
-                log.debug("Processing chunk %s", chunk.name)
-                statusLog.update_document_state( blob_path, f"Indexing {i+1}/{len(chunks)}", State.INDEXING)
-                # statusLog.update_document_state( blob_path, f"Indexing {i+1}/{len(chunks)}", State.PROCESSING
-                # open the file and extract the content
-                blob_path_plus_sas = utilities_helper.get_blob_and_sas(
-                    ENV["AZURE_BLOB_STORAGE_CONTAINER"] + '/' + chunk.name)
-                response = requests.get(blob_path_plus_sas)
-                response.raise_for_status()
-                chunk_dict = json.loads(response.text)
-
-                # create the json to be indexed
-                try:
-                    text = (
-                        chunk_dict["translated_title"] + " \n " +
-                        chunk_dict["translated_subtitle"] + " \n " +
-                        chunk_dict["translated_section"] + " \n " +
-                        chunk_dict["translated_content"]
-                    )
-                except KeyError:
-                    text = (
-                        chunk_dict["title"] + " \n " +
-                        chunk_dict["subtitle"] + " \n " +
-                        chunk_dict["section"] + " \n " +
-                        chunk_dict["content"]
-                    )
-
-                try:
-                    # try first to read the embedding from the chunk, in case it was already created
-                    embedding_data = chunk_dict['contentVector']
-                except KeyError:      
-                    # create embedding
-                    embedding = embed_texts(target_embeddings_model, [text])
-                    embedding_data = embedding['data']      
-
-                # Prepare the index schema based representation of the chunk with the embedding
-                index_chunk = {}
-                index_chunk['id'] = statusLog.encode_document_id(chunk.name)
-                index_chunk['processed_datetime'] = f"{chunk_dict['processed_datetime']}+00:00"
-                index_chunk['file_name'] = chunk_dict["file_name"]
-                index_chunk['file_uri'] = chunk_dict["file_uri"]
-                index_chunk['folder'] = file_directory[:-1]
-                index_chunk['tags'] = tag_list
-                index_chunk['chunk_file'] = chunk.name
-                index_chunk['file_class'] = chunk_dict["file_class"]
-                index_chunk['title'] = chunk_dict["title"]
-                index_chunk['pages'] = chunk_dict["pages"]
-                index_chunk['translated_title'] = chunk_dict["translated_title"]
-                index_chunk['content'] = text
-                index_chunk['contentVector'] = embedding_data
-                index_chunk['entities'] = chunk_dict["entities"]
-                index_chunk['key_phrases'] = chunk_dict["key_phrases"]
-                index_chunks.append(index_chunk)
-
-                # write the updated chunk, with embedding to storage in case of failure
-                chunk_dict['contentVector'] = embedding_data
-                json_str = json.dumps(chunk_dict, indent=2, ensure_ascii=False)
-                block_blob_client = blob_service_client.get_blob_client(container=ENV["AZURE_BLOB_STORAGE_CONTAINER"], blob=chunk.name)
-                block_blob_client.upload_blob(json_str, overwrite=True)
-                i += 1
-                
-                # push batch of content to index, rather than each individual chunk
-                if i % 200 == 0:
-                    log.debug("Indexing %d chunks", i)
-                    index_sections(index_chunks)
-                    index_chunks = []
-
-            # push remainder chunks content to index
-            if len(index_chunks) > 0:
-                log.debug("Indexing last %d chunks", len(index_chunks))
-                index_sections(index_chunks)
-
-            statusLog.upsert_document(blob_path,
-                                      'Embeddings process complete',
-                                      StatusClassification.INFO, State.COMPLETE)
 
-        except Exception as error:
-            log.debug("An error occurred: %s", str(error))
-            # Dequeue message and update the embeddings queued count to limit the max retries
-            try:
-                requeue_count = message_json['embeddings_queued_count']
-            except KeyError:
-                requeue_count = 0
-            requeue_count += 1
-
-            if requeue_count <= int(ENV["MAX_EMBEDDING_REQUEUE_COUNT"]):
-                message_json['embeddings_queued_count'] = requeue_count
-                # Requeue with a random backoff within limits
-                queue_client = QueueClient(account_url=ENV["AZURE_QUEUE_STORAGE_ENDPOINT"],
-                               queue_name=ENV["EMBEDDINGS_QUEUE"],
-                               credential=azure_credential,
-                               message_encode_policy=TextBase64EncodePolicy())
-                message_string = json.dumps(message_json)
-                max_seconds = int(ENV["EMBEDDING_REQUEUE_BACKOFF"]) * (requeue_count**2)
-                backoff = random.randint(
-                    int(ENV["EMBEDDING_REQUEUE_BACKOFF"]) * requeue_count, max_seconds)                
-                queue_client.send_message(message_string, visibility_timeout=backoff)
-                statusLog.upsert_document(blob_path, f'Message requeued to embeddings queue, attempt {str(requeue_count)}. Visible in {str(backoff)} seconds. Error: {str(error)}.',
-                                          StatusClassification.ERROR,
-                                          State.QUEUED)
-            else:
-                # max retries has been reached
-                statusLog.upsert_document(
-                    blob_path,
-                    f"An error occurred, max requeue limit was reached. Error description: {str(error)}",
-                    StatusClassification.ERROR,
-                    State.ERROR,
-                )
+def process_message(queue_client, message) -> None:
+    """Embeds the document for a queue message, renewing the message's visibility
+    lease while the work is in progress and deleting the message only once it has
+    been handled. If the worker fails before then, the lease lapses and the message
+    is picked up again"""
+    metrics.DOCUMENTS_IN_FLIGHT.inc()
+    try:
+        with MessageLease(queue_client, message, int(ENV["EMBEDDING_MESSAGE_LEASE_SECONDS"])) as lease, \
+                metrics.DOCUMENT_SECONDS.time():
+            embed_document(message)
+            lease.complete()
+    except Exception as error:
+        log.error("Failed to process message %s: %s", message.id, str(error))
+    finally:
+        metrics.DOCUMENTS_IN_FLIGHT.dec()
+        message_slots.release()
+
 
-        statusLog.save_document(blob_path)
+def embed_document(message) -> None:
+    """Embeds and indexes the chunks of the document referenced by a queue message,
+    requeuing the document with a backoff if processing fails"""
 
+    target_embeddings_model = re.sub(r'[^a-zA-Z0-9_\-.]', '_', ENV["TARGET_EMBEDDINGS_MODEL"])
+
+    message_b64 = message.content
+    message_json = json.loads(base64.b64decode(message_b64))
+    blob_path = message_json["blob_name"]
+
+    try:  
+        statusLog.upsert_document(blob_path, f'Embeddings process started with model {target_embeddings_model}', StatusClassification.INFO, State.PROCESSING)
+        log.debug("Processing file: %s", blob_path)
+        file_name, file_extension, file_directory  = utilities_helper.get_filename_and_extension(blob_path)
+        chunk_folder_path = file_directory + file_name + file_extension
+        blob_service_client = get_blob_service_client(ENV["AZURE_BLOB_STORAGE_ENDPOINT"],
+                                                      azure_credential)
+        container_client = blob_service_client.get_container_client(ENV["AZURE_BLOB_STORAGE_CONTAINER"])
+        index_writer = get_index_writer()
+        # the vectors are still embedded and stored when the calibration is missing or does
+        # not match the index, as the calibration is fitted on the stored vectors, but none
+        # are sent to the index, which would reject them, and the document is failed after
+        try:
+            compressor = get_vector_compressor(ENV["AZURE_SEARCH_INDEX"])
+            calibration_error = None
+        except ValueError as error:
+            compressor = None
+            calibration_error = error
+            log.error("Vector compression is misconfigured, %s is not indexed: %s", blob_path, str(error))
+                                
+        # get tags to apply to the chunk
+        tag_list = get_tags(blob_path)
+        log.debug("Successfully pulled tags for %s. %d tags found.", blob_path, len(tag_list))
+
+        # the chunks of a packed document are read with a single request, and written back with one
+        packed_chunks = PackedChunks.open(container_client, chunk_folder_path)
+        if packed_chunks is not None:
+            chunk_names = packed_chunks.names
+        else:
+            # Iterate over the chunks in the container, skipping the vector sidecars stored alongside them
+            chunk_list = container_client.list_blobs(name_starts_with=chunk_folder_path)
+            chunk_names = [chunk.name for chunk in chunk_list if is_chunk_blob(chunk.name)]
+        load, persist = chunk_callbacks(blob_service_client, packed_chunks, target_embeddings_model)
+        log.debug("Processing %d chunks", len(chunk_names))
+
+        def to_index_document(chunk_name, chunk_dict, text):
+            metrics.CHUNKS_PROCESSED.labels(target_embeddings_model).inc()
+            if calibration_error is not None:
+                return None
+            return build_index_document(chunk_name, chunk_dict, text, file_directory[:-1], tag_list, compressor)
+
+        pipeline = embed_chunks(
+            chunk_names,
+            load_chunk=load,
+            encode_texts=lambda texts: encode_batch(target_embeddings_model, texts),
+            persist_chunk=persist,
+            to_index_document=to_index_document,
+            index_writer=index_writer,
+            io_pool=chunk_io_pool,
+            batch_size=int(ENV["MAX_EMBEDDING_BATCH_SIZE"]),
+            queue_size=int(ENV["EMBEDDING_PIPELINE_QUEUE_SIZE"]),
+            stats=pipeline_stats,
+            on_indexed=lambda count, total: statusLog.update_document_state(
+                blob_path, f"Indexing {count}/{total}", State.INDEXING),
+            model=target_embeddings_model)
+        if packed_chunks is not None:
+            commit_packed_chunks(packed_chunks, target_embeddings_model)
+
+        # push remainder chunks content to index and wait for the batches in flight
+        failed_chunks = index_writer.flush()
+        index_stats = index_writer.stats()
+        log.debug("Indexed %d chunks in %d batches, %d retried, p50 %.2fs p99 %.2fs per batch",
+                  index_stats["succeeded"], index_stats["batches"], index_stats["retries"],
+                  index_stats["p50_batch_seconds"], index_stats["p99_batch_seconds"])
+        if failed_chunks:
+            # fail the document so it is requeued rather than left partially indexed
+            first_key, first_error = next(iter(failed_chunks.items()))
+            raise Exception(f"{len(failed_chunks)} chunks failed to index, "
+                            f"first failure {first_key}: {first_error}")
+        if calibration_error is not None:
+            raise calibration_error
+
+        for stage in pipeline.report():
+            log.debug("Pipeline stage %s: %d chunks at %.1f chunks/sec",
+                      stage["stage"], stage["items"], stage["items_per_second"])
+
+        statusLog.upsert_document(blob_path,
+                                  'Embeddings process complete',
+                                  StatusClassification.INFO, State.COMPLETE)
+        metrics.DOCUMENTS_PROCESSED.labels("complete").inc()
 
+    except Exception as error:
+        log.debug("An error occurred: %s", str(error))
+        # Dequeue message and update the embeddings queued count to limit the max retries
+        try:
+            requeue_count = message_json['embeddings_queued_count']
+        except KeyError:
+            requeue_count = 0
+        requeue_count += 1
+
+        if requeue_count <= int(ENV["MAX_EMBEDDING_REQUEUE_COUNT"]):
+            message_json['embeddings_queued_count'] = requeue_count
+            # Requeue with a random backoff within limits
+            queue_client = get_queue_client(ENV["AZURE_QUEUE_STORAGE_ENDPOINT"],
+                                            ENV["EMBEDDINGS_QUEUE"],
+                                            azure_credential,
+                                            message_encode_policy=TextBase64EncodePolicy())
+            message_string = json.dumps(message_json)
+            max_seconds = int(ENV["EMBEDDING_REQUEUE_BACKOFF"]) * (requeue_count**2)
+            backoff = random.randint(
+                int(ENV["EMBEDDING_REQUEUE_BACKOFF"]) * requeue_count, max_seconds)                
+            queue_client.send_message(message_string, visibility_timeout=backoff)
+            metrics.REQUEUES.inc()
+            metrics.DOCUMENTS_PROCESSED.labels("requeued").inc()
+            statusLog.upsert_document(blob_path, f'Message requeued to embeddings queue, attempt {str(requeue_count)}. Visible in {str(backoff)} seconds. Error: {str(error)}.',
+                                      StatusClassification.ERROR,
+                                      State.QUEUED)
+        else:
+            # max retries has been reached
+            statusLog.upsert_document(
+                blob_path,
+                f"An error occurred, max requeue limit was reached. Error description: {str(error)}",
+                StatusClassification.ERROR,
+                State.ERROR,
+            )
+            metrics.DOCUMENTS_PROCESSED.labels("failed").inc()
+
+    statusLog.save_document(blob_path)
+
+
+# === Re-embedding job ===
+
+# Re-embeds the stored chunks when TARGET_EMBEDDINGS_MODEL changes, writing to the live
+# index or to a new index, created with the vector size of the new model, that an
+# index alias is switched to once the job completes
+reembed_target_model = sanitize_model_name(ENV["TARGET_EMBEDDINGS_MODEL"])
+reembed_target_index = ENV["REEMBED_TARGET_INDEX"] or ENV["AZURE_SEARCH_INDEX"]
+reembed_search_client = search_client if reembed_target_index == ENV["AZURE_SEARCH_INDEX"] else \
+    get_search_client(ENV["AZURE_SEARCH_SERVICE_ENDPOINT"],
+                      reembed_target_index,
+                      azure_credential,
+                      audience=ENV["AZURE_SEARCH_AUDIENCE"])
+# caps the rate of re-embedding so the job runs alongside live ingestion
+reembed_rate_limiter = RateLimiter(float(ENV["REEMBED_MAX_CHUNKS_PER_SECOND"]))
+
+
+def reembed_chunks(chunk_names: List[str]) -> dict:
+    """ Re-embeds the chunks in a page of the content container whose vectors are not
+    from the target model, and writes them to the re-embedding target index. When
+    that is a new index, chunks already embedded with the target model are copied
+    to it as well, so it holds the whole corpus. Packed documents are named by their
+    index blob and re-embedded a document at a time
+    """
+    blob_service_client = get_blob_service_client(ENV["AZURE_BLOB_STORAGE_ENDPOINT"],
+                                                  azure_credential)
+    index_writer = get_index_writer(reembed_search_client)
+    compressor = get_vector_compressor(reembed_target_index)
+    copy_current = reembed_search_client is not search_client
+    counts = {"reembedded": 0, "indexed": 0}
+    document_tags = {}
+
+    def encode_texts(texts):
+        reembed_rate_limiter.acquire(len(texts))
+        counts["reembedded"] += len(texts)
+        return encode_batch(reembed_target_model, texts)
+
+    def to_index_document(chunk_name, chunk_dict, text):
+        # the stored reference still names the model the chunk was loaded with
+        if not copy_current and (chunk_dict.get('contentVectorRef') or {}).get('model') == reembed_target_model:
+            return None
+        document_path = os.path.dirname(chunk_name)
+        if document_path not in document_tags:
+            try:
+                document_tags[document_path] = get_tags(ENV["AZURE_BLOB_STORAGE_UPLOAD_CONTAINER"] + '/' + document_path)
+            except Exception as error:
+                log.warning("Failed to read the tags of %s: %s", document_path, str(error))
+                document_tags[document_path] = []
+        counts["indexed"] += 1
+        return build_index_document(chunk_name, chunk_dict, text,
+                                    "/".join(document_path.split("/")[:-1]), document_tags[document_path],
+                                    compressor)
+
+    sources = [(None, [chunk_name for chunk_name in chunk_names if not is_pack_index_blob(chunk_name)])]
+    for index_name in filter(is_pack_index_blob, chunk_names):
+        packed_chunks = PackedChunks.open(content_container_client, os.path.dirname(index_name))
+        if packed_chunks is not None:
+            sources.append((packed_chunks, packed_chunks.names))
+
+    for packed_chunks, source_chunk_names in sources:
+        load, persist = chunk_callbacks(blob_service_client, packed_chunks, reembed_target_model)
+        embed_chunks(source_chunk_names,
+                     load_chunk=load,
+                     encode_texts=encode_texts,
+                     persist_chunk=persist,
+                     to_index_document=to_index_document,
+                     index_writer=index_writer,
+                     io_pool=chunk_io_pool,
+                     batch_size=int(ENV["MAX_EMBEDDING_BATCH_SIZE"]),
+                     queue_size=int(ENV["EMBEDDING_PIPELINE_QUEUE_SIZE"]),
+                     model=reembed_target_model)
+        if packed_chunks is not None:
+            commit_packed_chunks(packed_chunks, reembed_target_model)
+    failed_chunks = index_writer.flush()
+    if failed_chunks:
+        first_key, first_error = next(iter(failed_chunks.items()))
+        raise Exception(f"{len(failed_chunks)} chunks failed to index, "
+                        f"first failure {first_key}: {first_error}")
+    return counts
+
+
+content_container_client = get_blob_service_client(ENV["AZURE_BLOB_STORAGE_ENDPOINT"],
+                                                   azure_credential) \
+    .get_container_client(ENV["AZURE_BLOB_STORAGE_CONTAINER"])
+reembed_job = ReembedJob(content_container_client,
+                         # not a .json blob, so it is never taken for a chunk
+                         content_container_client.get_blob_client(f"reembed/{reembed_target_model}.checkpoint"),
+                         reembed_target_model,
+                         reembed_target_index,
+                         reembed_chunks,
+                         page_size=int(ENV["REEMBED_PAGE_SIZE"]))
+
+
+def resume_reembed_job():
+    """ Resumes a re-embedding job that an earlier instance did not finish, once the
+    target model is loaded """
+    while not IS_READY:
+        time.sleep(5)
+    try:
+        if reembed_job.is_unfinished():
+            log.info("Resuming the re-embedding job for %s", reembed_target_model)
+            reembed_job.start()
+    except Exception as error:
+        log.warning("Could not resume the re-embedding job: %s", str(error))
@@ -1,7 +1,7 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT license.
 
-from typing import List
+from typing import Dict, List, Optional
 
 import pydantic
 
@@ -11,6 +11,8 @@ import pydantic
 class ModelInfo(pydantic.BaseModel):
     model: str
     vector_size: int
+    backend: str = "pytorch"
+    backend_report: Optional[Dict[str, Dict[str, float]]] = None
 
 
 class Embedding(pydantic.BaseModel):
@@ -25,6 +27,12 @@ class EmbeddingResponse(pydantic.BaseModel):
     model_info: ModelInfo
 
 
+class EmbeddingBatchResponse(pydantic.BaseModel):
+    data: List[List[float]]
+    model: str
+    model_info: ModelInfo
+
+
 class EmbeddingRequest(pydantic.BaseModel):
     sentences: List[str]
 
@@ -33,7 +41,67 @@ class ModelListResponse(pydantic.BaseModel):
     models: List[ModelInfo]
 
 
+class BatchingStats(pydantic.BaseModel):
+    model: str
+    max_batch_size: int
+    max_wait_ms: float
+    requests: int
+    texts: int
+    batches: int
+    mean_batch_size: float
+    max_observed_batch_size: int
+    batch_size_counts: Dict[str, int]
+
+
+class BatchingStatsResponse(pydantic.BaseModel):
+    models: List[BatchingStats]
+
+
+class CacheStatsResponse(pydantic.BaseModel):
+    enabled: bool
+    entries: int
+    max_entries: int
+    hits: int
+    misses: int
+    hit_ratio: float
+    evictions: int
+
+
+class PipelineStageStats(pydantic.BaseModel):
+    stage: str
+    batches: int
+    items: int
+    busy_seconds: float
+    items_per_second: float
+
+
+class PipelineStatsResponse(pydantic.BaseModel):
+    stages: List[PipelineStageStats]
+
+
+class ReembedStatusResponse(pydantic.BaseModel):
+    target_model: str
+    target_index: str
+    state: str
+    pages: int
+    scanned: int
+    reembedded: int
+    indexed: int
+    started: Optional[str] = None
+    updated: Optional[str] = None
+    error: Optional[str] = None
+
+
+class ModelStatus(pydantic.BaseModel):
+    model: str
+    state: str
+    load_seconds: Optional[float] = None
+    size_mb: float = 0.0
+    error: Optional[str] = None
+
+
 class StatusResponse(pydantic.BaseModel):
     status: str
     uptime_seconds: float
     version: str
+    models: List[ModelStatus] = []
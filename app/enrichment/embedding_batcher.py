@@ -0,0 +1,121 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List
+
+
+class MicroBatcher:
+    """ Coalesces concurrent embedding requests for a single model into shared
+    encode calls. Requests arriving within max_wait_ms of the first queued request
+    are merged into one batch of up to max_batch_size texts, sorted by length to
+    reduce padding, and the resulting vectors are fanned back out to each caller.
+    Up to max_in_flight batches are encoded at once, for models served by a pool
+    of worker processes """
+
+    def __init__(self,
+                 name: str,
+                 encode_fn: Callable[[List[str]], List[List[float]]],
+                 max_batch_size: int,
+                 max_wait_ms: float,
+                 max_in_flight: int = 1
+                 ):
+        self.name = name
+        self.encode_fn = encode_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait_seconds = max(0.0, float(max_wait_ms)) / 1000
+        self.max_in_flight = max(1, int(max_in_flight))
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self._dispatcher = ThreadPoolExecutor(max_workers=self.max_in_flight,
+                                              thread_name_prefix=f"micro-batch-{name}")
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._requests = 0
+        self._texts = 0
+        self._thread = threading.Thread(target=self._run, name=f"micro-batcher-{name}", daemon=True)
+        self._thread.start()
+
+    def submit(self, texts: List[str]) -> List[List[float]]:
+        """ Queues the texts for the next batch and blocks until their vectors are available """
+        if not texts:
+            return []
+        future = Future()
+        self._queue.put((texts, future))
+        return future.result()
+
+    def stats(self):
+        """ Returns the achieved batch sizes since startup """
+        with self._stats_lock:
+            batches = sum(self._batch_sizes.values())
+            return {
+                "model": self.name,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait_seconds * 1000,
+                "requests": self._requests,
+                "texts": self._texts,
+                "batches": batches,
+                "mean_batch_size": self._texts / batches if batches else 0.0,
+                "max_observed_batch_size": max(self._batch_sizes, default=0),
+                "batch_size_counts": {str(size): count for size, count in sorted(self._batch_sizes.items())}
+            }
+
+    def _run(self):
+        while True:
+            # wait for a free slot first, so requests keep accumulating into the
+            # next batch while every slot is busy
+            self._slots.acquire()
+            pending = [self._queue.get()]
+            text_count = len(pending[0][0])
+            deadline = time.monotonic() + self.max_wait_seconds
+            # keep collecting requests until the window closes or the batch is full
+            while text_count < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        item = self._queue.get(timeout=remaining)
+                    else:
+                        item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                pending.append(item)
+                text_count += len(item[0])
+            self._dispatcher.submit(self._dispatch, pending)
+
+    def _dispatch(self, pending):
+        try:
+            self._encode_batch(pending)
+        finally:
+            self._slots.release()
+
+    def _encode_batch(self, pending):
+        # flatten the requests, remembering where each text came from, and order
+        # by length so similar sized texts are padded together
+        entries = [(text, request_index, position)
+                   for request_index, (texts, _) in enumerate(pending)
+                   for position, text in enumerate(texts)]
+        entries.sort(key=lambda entry: len(entry[0]))
+
+        try:
+            vectors = self.encode_fn([entry[0] for entry in entries])
+        except Exception as error:
+            logging.error(f"Micro-batch for {self.name} failed: {str(error)}")
+            for _, future in pending:
+                future.set_exception(error)
+            return
+
+        results = [[None] * len(texts) for texts, _ in pending]
+        for (_, request_index, position), vector in zip(entries, vectors):
+            results[request_index][position] = vector
+        for (_, future), result in zip(pending, results):
+            future.set_result(result)
+
+        with self._stats_lock:
+            self._batch_sizes[len(entries)] += 1
+            self._requests += len(pending)
+            self._texts += len(entries)
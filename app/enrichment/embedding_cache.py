@@ -0,0 +1,243 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from array import array
+from typing import Callable, List, Optional
+
+
+class EmbeddingCache:
+    """ Persistent, content addressed cache of embeddings backed by SQLite.
+    Entries are keyed by (sanitized model name, SHA-256 of the exact text embedded)
+    and the least recently used entries are evicted once max_entries is exceeded.
+    Vectors are stored as float32, the precision of the search index vector field.
+    Every worker process opens the same file, kept in rollback journal mode, which
+    unlike WAL does not need shared memory, and the number of entries is kept in
+    the database, updated in the same transaction as the inserts and evictions.
+
+    The database must be on a local disk, where SQLite file locking is reliable,
+    which on App Service is wiped by restarts and redeployments. When snapshot_path
+    is given, a copy of the database is written there every snapshot_seconds, and an
+    instance that starts without a database restores it from the latest copy """
+
+    def __init__(self, path: str, max_entries: int,
+                 snapshot_path: Optional[str] = None, snapshot_seconds: float = 900):
+        self.path = path
+        self.max_entries = int(max_entries)
+        self.enabled = self.max_entries > 0
+        self.snapshot_path = snapshot_path or None
+        self.snapshot_seconds = float(snapshot_seconds)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._connection = None
+        self._entries = 0
+        self._changed = False
+        if not self.enabled:
+            return
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if self.snapshot_path is not None and not os.path.exists(path):
+            self._restore_snapshot()
+        # wait for the other worker processes rather than failing while they write
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=DELETE")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, "
+            "text_hash BLOB NOT NULL, "
+            "vector BLOB NOT NULL, "
+            "last_used REAL NOT NULL, "
+            "PRIMARY KEY (model, text_hash)) WITHOUT ROWID")
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache_size (id INTEGER PRIMARY KEY CHECK (id = 0), entries INTEGER NOT NULL)")
+        # the table is only counted once, when the size row is first created
+        self._connection.execute(
+            "INSERT OR IGNORE INTO cache_size (id, entries) VALUES (0, (SELECT COUNT(*) FROM embeddings))")
+        self._entries = self._count()
+        logging.info(f"Embedding cache opened at {path} with {self._entries} entries")
+        if self.snapshot_path is not None:
+            threading.Thread(target=self._snapshot_loop, name="embedding-cache-snapshot", daemon=True).start()
+
+    @staticmethod
+    def text_hash(text: str) -> bytes:
+        """ Returns the cache key digest for a text """
+        return hashlib.sha256(text.encode("utf-8")).digest()
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """ Returns the cached vector for each text, or None where there is no entry """
+        if not self.enabled:
+            self.misses += len(texts)
+            return [None] * len(texts)
+
+        hashes = [self.text_hash(text) for text in texts]
+        found = {}
+        now = time.time()
+        with self._lock:
+            unique_hashes = list(set(hashes))
+            # stay well below SQLite's bound parameter limit
+            for start in range(0, len(unique_hashes), 500):
+                batch = unique_hashes[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._connection.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch]).fetchall()
+                for text_hash, vector in rows:
+                    found[text_hash] = array("f", vector).tolist()
+            if found:
+                self._connection.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                    [(now, model, text_hash) for text_hash in found])
+            results = [found.get(text_hash) for text_hash in hashes]
+            hit_count = sum(1 for result in results if result is not None)
+            self.hits += hit_count
+            self.misses += len(texts) - hit_count
+        return results
+
+    def put_many(self, model: str, texts: List[str], vectors: List[List[float]]) -> None:
+        """ Stores the vectors for the texts, evicting the least recently used entries if needed """
+        if not self.enabled or not texts:
+            return
+
+        now = time.time()
+        rows = [(model, self.text_hash(text), array("f", vector).tobytes(), now)
+                for text, vector in zip(texts, vectors)]
+        with self._lock:
+            # take the write lock up front, as the size row is read and updated in the same transaction
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                inserted = self._connection.executemany(
+                    "INSERT OR IGNORE INTO embeddings (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                    rows).rowcount
+                self._add_entries(max(inserted, 0))
+                self._entries = self._count()
+                if self._entries > self.max_entries:
+                    self._evict()
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._changed = True
+
+    def get_or_compute(self,
+                       model: str,
+                       texts: List[str],
+                       encode_fn: Callable[[List[str]], List[List[float]]]
+                       ) -> List[List[float]]:
+        """ Returns one vector per text, only calling encode_fn for the distinct
+        texts that are not already cached """
+        results = self.get_many(model, texts)
+        missing = list(dict.fromkeys(text for text, result in zip(texts, results) if result is None))
+        if missing:
+            vectors = encode_fn(missing)
+            self.put_many(model, missing, vectors)
+            computed = dict(zip(missing, vectors))
+            results = [computed[text] if result is None else result
+                       for text, result in zip(texts, results)]
+        return results
+
+    def stats(self):
+        """ Returns the cache hit and miss counters """
+        lookups = self.hits + self.misses
+        if self.enabled:
+            with self._lock:
+                # other processes add to the same cache, so read the size they keep up to date
+                self._entries = self._count()
+        return {
+            "enabled": self.enabled,
+            "entries": self._entries,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions
+        }
+
+    def snapshot(self, if_changed: bool = False) -> None:
+        """ Writes a copy of the database to snapshot_path, through a local copy taken
+        with the SQLite backup API so the snapshot is consistent, replacing the previous
+        snapshot only once the new one is complete. if_changed skips the copy when this
+        process has added nothing since its last snapshot """
+        if not self.enabled or self.snapshot_path is None or (if_changed and not self._changed):
+            return
+        # the snapshot folder is shared by every instance, so temporary names must be unique
+        local_copy = f"{self.path}.snapshot-{uuid.uuid4().hex}"
+        remote_copy = f"{self.snapshot_path}.tmp-{uuid.uuid4().hex}"
+        self._changed = False
+        try:
+            # a connection of its own, so the copy does not hold up lookups in this process
+            source = sqlite3.connect(self.path, timeout=30)
+            destination = sqlite3.connect(local_copy)
+            try:
+                source.backup(destination)
+            finally:
+                destination.close()
+                source.close()
+            snapshot_directory = os.path.dirname(self.snapshot_path)
+            if snapshot_directory:
+                os.makedirs(snapshot_directory, exist_ok=True)
+            shutil.copyfile(local_copy, remote_copy)
+            os.replace(remote_copy, self.snapshot_path)
+            logging.debug(f"Embedding cache snapshot written to {self.snapshot_path}")
+        finally:
+            for path in (local_copy, remote_copy):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _snapshot_loop(self):
+        while True:
+            time.sleep(self.snapshot_seconds)
+            try:
+                self.snapshot(if_changed=True)
+            except Exception as error:
+                self._changed = True
+                logging.warning(f"Failed to write the embedding cache snapshot: {str(error)}")
+
+    def _restore_snapshot(self):
+        if not os.path.exists(self.snapshot_path):
+            return
+        restoring = f"{self.path}.restore-{os.getpid()}"
+        try:
+            shutil.copyfile(self.snapshot_path, restoring)
+            # link rather than rename, so a database another worker process has already
+            # restored or created, and may have open, is never replaced
+            os.link(restoring, self.path)
+            logging.info(f"Embedding cache restored from {self.snapshot_path}")
+        except FileExistsError:
+            pass
+        except Exception as error:
+            logging.warning(f"Failed to restore the embedding cache from {self.snapshot_path}: {str(error)}")
+        finally:
+            if os.path.exists(restoring):
+                os.remove(restoring)
+
+    def _count(self) -> int:
+        return self._connection.execute("SELECT entries FROM cache_size WHERE id = 0").fetchone()[0]
+
+    def _add_entries(self, count: int) -> None:
+        self._connection.execute("UPDATE cache_size SET entries = entries + ? WHERE id = 0", (count,))
+
+    def _evict(self):
+        # trim to 90% of the limit so eviction is not triggered on every insert
+        excess = self._entries - int(self.max_entries * 0.9)
+        cursor = self._connection.execute(
+            "DELETE FROM embeddings WHERE (model, text_hash) IN "
+            "(SELECT model, text_hash FROM embeddings ORDER BY last_used LIMIT ?)",
+            (excess,))
+        evicted = max(cursor.rowcount, 0)
+        self._add_entries(-evicted)
+        self._entries -= evicted
+        self.evictions += evicted
+        logging.debug(f"Evicted {evicted} entries from the embedding cache")
@@ -0,0 +1,137 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+
+# Marks the end of the work flowing through the stage queues
+_END = object()
+
+
+class StageStats:
+    """ Cumulative throughput of a single pipeline stage, shared across pipeline runs """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.batches = 0
+        self.items = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, items: int, seconds: float):
+        with self._lock:
+            self.batches += 1
+            self.items += items
+            self.busy_seconds += seconds
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "stage": self.name,
+                "batches": self.batches,
+                "items": self.items,
+                "busy_seconds": self.busy_seconds,
+                "items_per_second": self.items / self.busy_seconds if self.busy_seconds else 0.0
+            }
+
+
+class StagedPipeline:
+    """ Runs batches of work through a sequence of stages, each on its own thread,
+    connected by bounded queues. While one stage works on a batch the previous
+    stage is already working on the next, so I/O overlaps with compute, and a
+    slow stage applies backpressure to the stages ahead of it through the queue
+    bounds. Batches leave the last stage in the order they were fed in """
+
+    def __init__(self, stages: List[Tuple[str, Callable[[Any], Any]]], queue_size: int = 2, stats=None):
+        self.stages = stages
+        self.queue_size = max(1, int(queue_size))
+        # stats may be shared by successive pipelines so throughput accumulates across documents
+        self.stats = stats if stats is not None else {}
+        for name, _ in stages:
+            self.stats.setdefault(name, StageStats(name))
+
+    def run(self, batches: Iterable[Any], sink: Optional[Callable[[Any], None]] = None) -> int:
+        """ Feeds the batches through every stage and returns the number of batches
+        that left the last stage. The output of the last stage for each batch is
+        passed to sink, if given, and otherwise dropped, so batches are not held once
+        done. The first error raised by any stage is re-raised here once the
+        pipeline has drained """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        errors = []
+        abort = threading.Event()
+
+        def run_stage(name, fn, input_queue, output_queue):
+            stage_stats = self.stats[name]
+            while True:
+                batch = input_queue.get()
+                if batch is _END:
+                    output_queue.put(_END)
+                    return
+                if abort.is_set():
+                    # keep draining so upstream stages never block on a full queue
+                    continue
+                start = time.perf_counter()
+                try:
+                    result = fn(batch)
+                except Exception as error:
+                    logging.error(f"Pipeline stage {name} failed: {str(error)}")
+                    errors.append(error)
+                    abort.set()
+                    continue
+                stage_stats.record(len(batch) if hasattr(batch, "__len__") else 1,
+                                   time.perf_counter() - start)
+                output_queue.put(result)
+
+        threads = []
+        for index, (name, fn) in enumerate(self.stages):
+            thread = threading.Thread(target=run_stage,
+                                      args=(name, fn, queues[index], queues[index + 1]),
+                                      name=f"pipeline-{name}",
+                                      daemon=True)
+            thread.start()
+            threads.append(thread)
+
+        def feed():
+            try:
+                for batch in batches:
+                    if abort.is_set():
+                        break
+                    queues[0].put(batch)
+            except Exception as error:
+                logging.error(f"Pipeline input failed: {str(error)}")
+                errors.append(error)
+                abort.set()
+            finally:
+                # always end the input, or the stages and run would wait for it forever
+                queues[0].put(_END)
+
+        feeder = threading.Thread(target=feed, name="pipeline-feed", daemon=True)
+        feeder.start()
+
+        completed = 0
+        while True:
+            result = queues[-1].get()
+            if result is _END:
+                break
+            if sink is not None and not abort.is_set():
+                try:
+                    sink(result)
+                except Exception as error:
+                    logging.error(f"Pipeline sink failed: {str(error)}")
+                    errors.append(error)
+                    abort.set()
+            completed += 1
+
+        feeder.join()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return completed
+
+    def report(self):
+        """ Returns the throughput of every stage """
+        return [self.stats[name].to_dict() for name, _ in self.stages]
@@ -0,0 +1,107 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+from concurrent.futures import Executor
+from typing import Callable, Dict, List, Optional
+
+from embedding_pipeline import StagedPipeline
+
+
+def get_chunk_text(chunk_dict):
+    """ Builds the text to embed and index for a chunk, preferring the translated fields
+    """
+    try:
+        return (
+            chunk_dict["translated_title"] + " \n " +
+            chunk_dict["translated_subtitle"] + " \n " +
+            chunk_dict["translated_section"] + " \n " +
+            chunk_dict["translated_content"]
+        )
+    except KeyError:
+        return (
+            chunk_dict["title"] + " \n " +
+            chunk_dict["subtitle"] + " \n " +
+            chunk_dict["section"] + " \n " +
+            chunk_dict["content"]
+        )
+
+
+def embed_chunks(chunk_names: List[str],
+                 load_chunk: Callable[[str], Dict],
+                 encode_texts: Callable[[List[str]], List[List[float]]],
+                 persist_chunk: Callable[[str, Dict], None],
+                 to_index_document: Callable[[str, Dict, str], Dict],
+                 index_writer,
+                 io_pool: Executor,
+                 batch_size: int,
+                 queue_size: int = 2,
+                 stats: Optional[Dict] = None,
+                 on_indexed: Optional[Callable[[int, int], None]] = None,
+                 model: Optional[str] = None) -> StagedPipeline:
+    """ Embeds and indexes the chunks of one document as a staged pipeline of
+    fetch, embed, persist and index, feeding it batches of batch_size chunks.
+    Storage, the model and the index are passed in so the same worker runs
+    against Azure in the service and against local stand-ins in the benchmark.
+    When model is given, stored embeddings are only reused if they are tagged
+    with that model, and chunks for which to_index_document returns None are
+    not indexed. Returns the pipeline so callers can report the throughput of
+    its stages
+    """
+    indexed_count = 0
+    embedded_chunks = set()
+
+    def fetch_stage(batch_names):
+        # download the batch concurrently, map keeps the results in chunk order
+        chunk_dicts = io_pool.map(load_chunk, batch_names)
+        return list(zip(batch_names, chunk_dicts))
+
+    def needs_embedding(chunk_dict):
+        if 'contentVector' not in chunk_dict:
+            return True
+        # vectors stored inline by earlier versions carry no model tag, so they are replaced too
+        return model is not None and (chunk_dict.get('contentVectorRef') or {}).get('model') != model
+
+    def embed_stage(batch):
+        # create the text to be embedded and indexed
+        batch = [(chunk_name, chunk_dict, get_chunk_text(chunk_dict)) for chunk_name, chunk_dict in batch]
+        # embed every chunk in the batch that does not already carry an embedding
+        # from the model in a single model call, rather than one call per chunk
+        pending = [entry for entry in batch if needs_embedding(entry[1])]
+        if pending:
+            embeddings = encode_texts([text for _, _, text in pending])
+            for (chunk_name, chunk_dict, _), embedding_data in zip(pending, embeddings):
+                chunk_dict['contentVector'] = embedding_data
+                embedded_chunks.add(chunk_name)
+        return batch
+
+    def persist_stage(batch):
+        # write the newly embedded chunks, with their vector sidecars, to storage in case of failure
+        write_futures = [io_pool.submit(persist_chunk, chunk_name, chunk_dict)
+                         for chunk_name, chunk_dict, _ in batch if chunk_name in embedded_chunks]
+        for write_future in write_futures:
+            write_future.result()
+        return batch
+
+    def index_stage(batch):
+        nonlocal indexed_count
+        for chunk_name, chunk_dict, text in batch:
+            if on_indexed is not None:
+                on_indexed(indexed_count + 1, len(chunk_names))
+            # the writer sends batches sized by payload as the chunks accumulate
+            index_document = to_index_document(chunk_name, chunk_dict, text)
+            if index_document is not None:
+                index_writer.add(index_document)
+            indexed_count += 1
+        return batch
+
+    # Downloads overlap with inference, and index uploads overlap with the
+    # next batch's embedding, with the bounded queues providing backpressure
+    pipeline = StagedPipeline([("fetch", fetch_stage),
+                               ("embed", embed_stage),
+                               ("persist", persist_stage),
+                               ("index", index_stage)],
+                              queue_size=queue_size,
+                              stats=stats)
+    pipeline.run(chunk_names[batch_start:batch_start + batch_size]
+                 for batch_start in range(0, len(chunk_names), batch_size))
+    return pipeline
@@ -0,0 +1,135 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List
+
+import numpy as np
+
+# The model registry of a worker process, created by its initializer
+_worker_models = None
+
+
+def _initialize_worker(model_names, models_path, memory_budget_mb, threads, preload, ready_count, failed_count):
+    """ Runs once in each worker process. Loads the preload models from the local
+    artifacts prepared by the parent process, so workers never download models.
+    A worker counts as ready only once all of its preload models are loaded """
+    global _worker_models
+    # imported here so the parent process does not pay for them when the pool is disabled
+    import torch
+    from model_handling import ModelRegistry
+
+    torch.set_num_threads(threads)
+    os.environ.setdefault("ONNX_INTRA_OP_THREADS", str(threads))
+    # the parent verified the checksums when it prepared the artifacts
+    _worker_models = ModelRegistry(model_names,
+                                   models_path=models_path,
+                                   memory_budget_mb=memory_budget_mb,
+                                   offline=True,
+                                   verify_checksums=False)
+    loaded = True
+    for name in preload:
+        try:
+            _worker_models[name]
+        except Exception as error:
+            loaded = False
+            logging.error(f"Inference worker {os.getpid()} failed to load {name}: {str(error)}")
+    counter = ready_count if loaded else failed_count
+    with counter.get_lock():
+        counter.value += 1
+
+
+def _encode(model, texts):
+    return np.asarray(_worker_models[model].encode(texts), dtype=np.float32)
+
+
+def _ping():
+    return os.getpid()
+
+
+class InferencePool:
+    """ Runs local model inference in a pool of worker processes, each with its own
+    copy of the models, so tokenization and pre and post-processing in one request
+    do not contend for the GIL with the others. Models are loaded in the workers
+    from the safetensors artifacts the parent process prepared, with each worker
+    limited to its share of the CPU threads so the workers do not oversubscribe
+    the cores """
+
+    def __init__(self, processes: int, model_names: List[str], models_path: str,
+                 memory_budget_mb: float = 0, threads_per_process: int = 0):
+        self.processes = max(1, int(processes))
+        self.model_names = model_names
+        self.models_path = models_path
+        self.memory_budget_mb = memory_budget_mb
+        self.threads_per_process = int(threads_per_process) or max(1, (os.cpu_count() or 1) // self.processes)
+        self._context = multiprocessing.get_context("spawn")
+        self._ready_count = self._context.Value("i", 0)
+        self._failed_count = self._context.Value("i", 0)
+        self._preload = []
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def start(self, preload: List[str] = (), timeout_seconds: float = 600):
+        """ Starts the worker processes and waits for each to load the preload models.
+        Raises a RuntimeError if any worker failed to load them """
+        self._preload = list(preload)
+        with self._lock:
+            self._start_executor()
+        deadline = time.monotonic() + timeout_seconds
+        while self._ready_count.value + self._failed_count.value < self.processes and time.monotonic() < deadline:
+            time.sleep(0.5)
+        ready, failed = self._ready_count.value, self._failed_count.value
+        if failed:
+            raise RuntimeError(f"{failed}/{self.processes} inference workers failed to load {', '.join(self._preload)}")
+        logging.info(f"Inference pool started with {ready}/{self.processes} workers ready, "
+                     f"{self.threads_per_process} threads each")
+
+    def encode(self, model: str, texts: List[str]) -> np.ndarray:
+        """ Embeds the texts in a worker process, returning a float32 array with one row per text """
+        executor = self._executor
+        for attempt in (1, 2):
+            try:
+                return executor.submit(_encode, model, texts).result()
+            except BrokenProcessPool:
+                # a worker died, for instance when it ran out of memory. Replace the pool,
+                # unless another call already has, and send the texts to the new pool once
+                with self._lock:
+                    if self._executor is executor:
+                        logging.error("An inference worker process exited unexpectedly, restarting the pool")
+                        self._start_executor()
+                    executor = self._executor
+                if attempt == 2:
+                    raise
+
+    def shutdown(self):
+        """ Stops the worker processes """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def _start_executor(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._ready_count.value = 0
+        self._failed_count.value = 0
+        # spawn rather than fork, as forking a process that already runs threads can deadlock
+        self._executor = ProcessPoolExecutor(max_workers=self.processes,
+                                             mp_context=self._context,
+                                             initializer=_initialize_worker,
+                                             initargs=(self.model_names,
+                                                       self.models_path,
+                                                       self.memory_budget_mb,
+                                                       self.threads_per_process,
+                                                       self._preload,
+                                                       self._ready_count,
+                                                       self._failed_count))
+        # worker processes are launched as tasks arrive, so send one task per process
+        for _ in range(self.processes):
+            self._executor.submit(_ping)
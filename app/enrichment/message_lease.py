@@ -0,0 +1,61 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import logging
+import threading
+
+from azure.storage.queue import QueueClient
+
+
+class MessageLease:
+    """ Keeps a received queue message invisible to other consumers while it is
+    being processed, by extending its visibility timeout on a background thread.
+    The message is only removed from the queue when the work is completed, so if
+    the worker dies the lease lapses and the message is picked up again """
+
+    def __init__(self, queue_client: QueueClient, message, lease_seconds: int):
+        self.queue_client = queue_client
+        self.message_id = message.id
+        self.pop_receipt = message.pop_receipt
+        self.lease_seconds = int(lease_seconds)
+        # renew well before the current lease runs out
+        self.renew_interval = max(1, self.lease_seconds // 3)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._renew,
+                                        name=f"lease-{self.message_id}",
+                                        daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def _renew(self):
+        while not self._stopped.wait(self.renew_interval):
+            with self._lock:
+                if self._stopped.is_set():
+                    return
+                try:
+                    receipt = self.queue_client.update_message(self.message_id,
+                                                               pop_receipt=self.pop_receipt,
+                                                               visibility_timeout=self.lease_seconds)
+                    self.pop_receipt = receipt.pop_receipt
+                    logging.debug(f"Renewed lease on message {self.message_id}")
+                except Exception as error:
+                    # the message will become visible again when the current lease lapses
+                    logging.error(f"Failed to renew lease on message {self.message_id}: {str(error)}")
+
+    def release(self):
+        """ Stops renewing the lease, leaving the message to become visible again
+        when the current visibility timeout expires """
+        with self._lock:
+            self._stopped.set()
+
+    def complete(self):
+        """ Stops renewing the lease and deletes the message from the queue """
+        with self._lock:
+            self._stopped.set()
+            self.queue_client.delete_message(self.message_id, pop_receipt=self.pop_receipt)
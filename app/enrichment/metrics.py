@@ -0,0 +1,129 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+from typing import Callable, List
+
+from prometheus_client import Counter, Gauge, Histogram, REGISTRY
+from prometheus_client.core import GaugeMetricFamily
+
+# Metrics exposed by the /metrics endpoint. Counters and histograms only take a lock
+# and update a few floats, so they are cheap enough to stay on for every chunk
+
+# Buckets for operations that range from a few milliseconds to tens of seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+QUEUE_RECEIVE_SECONDS = Histogram(
+    "enrichment_queue_receive_seconds",
+    "Time taken to receive a batch of messages from the embeddings queue",
+    buckets=LATENCY_BUCKETS)
+QUEUE_MESSAGES_RECEIVED = Counter(
+    "enrichment_queue_messages_received_total",
+    "Messages received from the embeddings queue")
+DOCUMENTS_IN_FLIGHT = Gauge(
+    "enrichment_documents_in_flight",
+    "Documents currently being embedded and indexed")
+DOCUMENTS_PROCESSED = Counter(
+    "enrichment_documents_processed_total",
+    "Documents processed by the embeddings queue worker, by outcome",
+    ["outcome"])
+DOCUMENT_SECONDS = Histogram(
+    "enrichment_document_seconds",
+    "Time taken to embed and index a document",
+    buckets=LATENCY_BUCKETS + (120, 300, 600))
+REQUEUES = Counter(
+    "enrichment_requeues_total",
+    "Documents requeued to the embeddings queue after a failure")
+CHUNKS_PROCESSED = Counter(
+    "enrichment_chunks_processed_total",
+    "Chunks indexed by the embeddings queue worker",
+    ["model"])
+EMBEDDING_BATCH_SIZE = Histogram(
+    "enrichment_embedding_batch_size",
+    "Number of texts sent to the model in a single call",
+    ["model"],
+    buckets=BATCH_SIZE_BUCKETS)
+EMBEDDING_SECONDS = Histogram(
+    "enrichment_embedding_seconds",
+    "Time taken by a single model call",
+    ["model"],
+    buckets=LATENCY_BUCKETS)
+BLOB_OPERATION_SECONDS = Histogram(
+    "enrichment_blob_operation_seconds",
+    "Time taken to fetch or write a chunk or vector sidecar in blob storage",
+    ["operation"],
+    buckets=LATENCY_BUCKETS)
+SEARCH_UPLOAD_SECONDS = Histogram(
+    "enrichment_search_upload_seconds",
+    "Time taken by a single upload of a batch of chunks to the search index",
+    buckets=LATENCY_BUCKETS)
+SEARCH_UPLOAD_DOCUMENTS = Counter(
+    "enrichment_search_upload_documents_total",
+    "Chunks sent to the search index, including retries")
+SEARCH_UPLOAD_FAILURES = Counter(
+    "enrichment_search_upload_failures_total",
+    "Chunks the search index failed to accept on an upload attempt")
+
+AOAI_CONCURRENCY_LIMIT = Gauge(
+    "enrichment_aoai_concurrency_limit",
+    "Azure OpenAI embedding requests allowed in flight by the adaptive controller")
+AOAI_IN_FLIGHT = Gauge(
+    "enrichment_aoai_in_flight",
+    "Azure OpenAI embedding requests currently in flight")
+AOAI_REMAINING_REQUESTS = Gauge(
+    "enrichment_aoai_remaining_requests",
+    "Requests remaining in the Azure OpenAI rate limit window, as last reported")
+AOAI_REMAINING_TOKENS = Gauge(
+    "enrichment_aoai_remaining_tokens",
+    "Tokens remaining in the Azure OpenAI rate limit window, as last reported")
+AOAI_THROTTLES = Counter(
+    "enrichment_aoai_throttles_total",
+    "Azure OpenAI embedding requests throttled with a 429 response")
+AOAI_TOKENS = Counter(
+    "enrichment_aoai_tokens_total",
+    "Estimated tokens sent in successful Azure OpenAI embedding requests")
+AOAI_WAIT_SECONDS = Histogram(
+    "enrichment_aoai_wait_seconds",
+    "Time an Azure OpenAI embedding request waited for the concurrency controller",
+    buckets=LATENCY_BUCKETS)
+
+
+def observe_search_batch(seconds: float, documents: int, failed: int) -> None:
+    """ Records an upload attempt reported by the search index writer """
+    SEARCH_UPLOAD_SECONDS.observe(seconds)
+    SEARCH_UPLOAD_DOCUMENTS.inc(documents)
+    if failed:
+        SEARCH_UPLOAD_FAILURES.inc(failed)
+
+
+class ModelStatusCollector:
+    """ Reports the load time and size of each model from the model registry when
+    metrics are scraped, so nothing is recorded on the load path itself """
+
+    def __init__(self, status_fn: Callable[[], List[dict]]):
+        self.status_fn = status_fn
+
+    def collect(self):
+        loaded = GaugeMetricFamily("enrichment_model_loaded",
+                                   "Whether a model is loaded in memory",
+                                   labels=["model"])
+        load_seconds = GaugeMetricFamily("enrichment_model_load_seconds",
+                                         "Time taken by the last load of a model",
+                                         labels=["model"])
+        size_mb = GaugeMetricFamily("enrichment_model_size_mb",
+                                    "Size on disk of a loaded model",
+                                    labels=["model"])
+        for status in self.status_fn():
+            loaded.add_metric([status["model"]], 1 if status["state"] == "loaded" else 0)
+            if status.get("load_seconds") is not None:
+                load_seconds.add_metric([status["model"]], status["load_seconds"])
+            if status.get("size_mb") is not None:
+                size_mb.add_metric([status["model"]], status["size_mb"])
+        yield loaded
+        yield load_seconds
+        yield size_mb
+
+
+def register_model_collector(status_fn: Callable[[], List[dict]]) -> None:
+    """ Adds the model load metrics, read from status_fn, to the /metrics output """
+    REGISTRY.register(ModelStatusCollector(status_fn))
@@ -1,42 +1,284 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT license.
 
+import hashlib
+import json
 import logging
 import os
 import re
+import threading
+import time
 
 from sentence_transformers import SentenceTransformer
 
+MANIFEST_FILE = "manifest.json"
 
-def load_models():
-    model_names = os.getenv(
-        "TARGET_EMBEDDINGS_MODEL", "all-mpnet-base-v2|paraphrase-multilingual-MiniLM-L12-v2|BAAI/bge-small-en-v1.5"
-    )
-    print("Downloading models: ", model_names)
 
-    models_to_download = model_names.split("|")
+def use_onnx_backend(model_name):
+    """ Returns whether a model is configured to be served by the quantized ONNX backend """
+    onnx_models = os.getenv("ONNX_EMBEDDINGS_MODELS", "")
+    if onnx_models.strip().lower() == "all":
+        return True
+    return model_name in [name.strip() for name in onnx_models.split("|") if name.strip()]
 
-    models_path = "models/"
-    models = {}
-    model_info = {}
 
-    try:
-        for model_name in models_to_download:
-            # Ignore AOAI models as they are downloaded elsewhere
+def load_onnx_model(model, model_path):
+    """ Builds the quantized ONNX version of a loaded model, returning it only if its
+    vectors match the fp32 model closely enough, together with a report of the
+    parity check and the throughput of both backends """
+    # imported here as onnxruntime is only needed when the ONNX backend is enabled
+    from onnx_backend import OnnxEmbeddingModel, compare_throughput, parity_check
+
+    intra_op_threads = int(os.getenv("ONNX_INTRA_OP_THREADS", "0"))
+    parity_threshold = float(os.getenv("ONNX_PARITY_THRESHOLD", "0.99"))
+
+    onnx_model = OnnxEmbeddingModel.from_sentence_transformer(model, os.path.join(model_path, "onnx"), intra_op_threads)
+    report = {"parity": parity_check(model, onnx_model),
+              "throughput": compare_throughput(model, onnx_model)}
+    if report["parity"]["min_cosine"] < parity_threshold:
+        logging.warning(f"ONNX backend for {model_path} failed the parity check {report['parity']}, "
+                        "keeping the fp32 model")
+        return None, report
+    return onnx_model, report
+
+
+def sanitize_model_name(model_name):
+    """ Returns the name a model is stored and served under """
+    return re.sub(r'[^a-zA-Z0-9_\-.]', '_', model_name)
+
+
+def file_checksum(path):
+    """ Returns the SHA-256 of a file, read in blocks to bound memory use """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def model_size_mb(model):
+    """ Estimates the memory held by a loaded model """
+    if hasattr(model, "parameters"):
+        return sum(parameter.numel() * parameter.element_size() for parameter in model.parameters()) / (1024 * 1024)
+    onnx_path = getattr(model, "onnx_path", None)
+    if onnx_path and os.path.exists(onnx_path):
+        return os.path.getsize(onnx_path) / (1024 * 1024)
+    return 0.0
+
+
+class ModelEntry:
+    """ Load state of a single model in the registry """
+
+    def __init__(self, model_name, model_path):
+        self.model_name = model_name
+        self.model_path = model_path
+        self.model = None
+        self.info = None
+        self.state = "not_loaded"
+        self.error = None
+        self.load_seconds = None
+        self.size_mb = 0.0
+        self.last_used = 0.0
+        self.prepared = False
+        self.lock = threading.Lock()
+
+
+class ModelRegistry:
+    """ Loads sentence-transformers models on first use, from a local artifact directory
+    where possible. Each model is saved once as safetensors (memory mapped on load) with
+    a manifest of file checksums that is verified before every load, so the hub is only
+    needed the first time a model is used. When the loaded models exceed the memory
+    budget, the least recently used models are unloaded """
+
+    def __init__(self, model_names, models_path="models/", memory_budget_mb=0, offline=False,
+                 verify_checksums=True, load_in_process=True):
+        self.models_path = models_path
+        # when models are served by worker processes, this registry only prepares their artifacts
+        self.load_in_process = load_in_process
+        self.memory_budget_mb = float(memory_budget_mb)
+        self.offline = offline
+        self.verify_checksums = verify_checksums
+        self._entries = {}
+        self._registered = {}
+        self._registered_info = {}
+        self._lock = threading.Lock()
+        for model_name in model_names:
+            # Ignore AOAI models as they are registered by the caller
             if model_name.startswith("azure-openai"):
                 continue
-            model = SentenceTransformer(model_name)
-            sanitized_model_name = re.sub(r'[^a-zA-Z0-9_\-.]', '_', model_name)
-            model.save(os.path.join(models_path,sanitized_model_name))
-            models[sanitized_model_name] = model
-            logging.debug(f"Loaded model {model_name}")
-
-            model_info_entry = {
-                "model": sanitized_model_name,
-                "vector_size": model.get_sentence_embedding_dimension(),
-            }
-            model_info[sanitized_model_name] = model_info_entry
-    except Exception as error:
-        logging.error(f"Failed to retrieve models - {str(error)}")
-
-    return models, model_info
+            sanitized_model_name = sanitize_model_name(model_name)
+            self._entries[sanitized_model_name] = ModelEntry(model_name,
+                                                             os.path.join(models_path, sanitized_model_name))
+
+    def register(self, name, model, info):
+        """ Adds a model that does not need loading, such as a remote Azure OpenAI deployment """
+        self._registered[name] = model
+        self._registered_info[name] = info
+
+    def __contains__(self, name):
+        return name in self._entries or name in self._registered
+
+    def __getitem__(self, name):
+        if name in self._registered:
+            return self._registered[name]
+        entry = self._entries[name]
+        entry.last_used = time.time()
+        # read the model once, as loading another model can unload this one at any time
+        model = entry.model
+        if model is None:
+            model = self._load(name, entry)
+        return model
+
+    def prepare(self, name):
+        """ Makes sure a verified local artifact, and its ONNX export when configured,
+        exists for a model without keeping the model loaded. Used when the model is
+        served by worker processes that load it from the artifact themselves """
+        if name in self._registered:
+            return
+        entry = self._entries[name]
+        if entry.prepared:
+            return
+        self[name]
+        with entry.lock:
+            entry.model = None
+            entry.state = "prepared"
+            entry.prepared = True
+
+    def names(self):
+        """ Returns the names of every model the registry can serve """
+        return list(self._entries) + list(self._registered)
+
+    def is_loaded(self, name):
+        """ Returns whether a model is ready to serve without loading """
+        return name in self._registered or (name in self._entries and self._entries[name].model is not None)
+
+    def info(self, name):
+        """ Returns the model information, read from the saved manifest when the model
+        is not loaded so that listing models does not load them """
+        if name in self._registered_info:
+            return self._registered_info[name]
+        entry = self._entries[name]
+        if entry.info is None:
+            manifest = self._read_manifest(entry)
+            if manifest is not None:
+                entry.info = {"model": name, "vector_size": manifest["vector_size"],
+                              "backend": "onnx-int8" if use_onnx_backend(entry.model_name) else "pytorch"}
+            elif self.load_in_process:
+                self[name]
+            else:
+                self.prepare(name)
+        return entry.info
+
+    def status(self):
+        """ Returns the load state and load time of each model """
+        statuses = [{"model": name, "state": "loaded", "load_seconds": 0.0, "size_mb": 0.0}
+                    for name in self._registered]
+        for name, entry in self._entries.items():
+            statuses.append({"model": name,
+                             "state": entry.state,
+                             "load_seconds": entry.load_seconds,
+                             "size_mb": entry.size_mb,
+                             "error": entry.error})
+        return statuses
+
+    def _read_manifest(self, entry):
+        manifest_path = os.path.join(entry.model_path, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path, "r", encoding="utf-8") as file:
+            return json.load(file)
+
+    def _local_artifact_valid(self, entry, manifest):
+        if manifest is None:
+            return False
+        if not self.verify_checksums:
+            return True
+        for relative_path, checksum in manifest["files"].items():
+            path = os.path.join(entry.model_path, relative_path)
+            if not os.path.exists(path) or file_checksum(path) != checksum:
+                logging.error(f"Checksum verification failed for {path}")
+                return False
+        return True
+
+    def _save_artifact(self, entry, model):
+        # safetensors weights can be memory mapped when the model is next loaded
+        model.save(entry.model_path, safe_serialization=True)
+        files = {}
+        for root, _, file_names in os.walk(entry.model_path):
+            for file_name in file_names:
+                path = os.path.join(root, file_name)
+                relative_path = os.path.relpath(path, entry.model_path)
+                if relative_path == MANIFEST_FILE or relative_path.startswith("onnx"):
+                    continue
+                files[relative_path] = file_checksum(path)
+        manifest = {"model_name": entry.model_name,
+                    "vector_size": model.get_sentence_embedding_dimension(),
+                    "files": files}
+        with open(os.path.join(entry.model_path, MANIFEST_FILE), "w", encoding="utf-8") as file:
+            json.dump(manifest, file, indent=2)
+
+    def _load(self, name, entry):
+        """ Loads a model, returning it so the caller holds it even if the memory budget
+        unloads it again before the caller uses it """
+        with entry.lock:
+            if entry.model is not None:
+                return entry.model
+            entry.state = "loading"
+            start = time.perf_counter()
+            try:
+                manifest = self._read_manifest(entry)
+                if self._local_artifact_valid(entry, manifest):
+                    model = SentenceTransformer(entry.model_path, device="cpu")
+                elif self.offline:
+                    raise RuntimeError(f"No valid local artifact for {entry.model_name} in {entry.model_path} "
+                                       "and downloads are disabled")
+                else:
+                    model = SentenceTransformer(entry.model_name, device="cpu")
+                    self._save_artifact(entry, model)
+
+                info = {"model": name,
+                        "vector_size": model.get_sentence_embedding_dimension(),
+                        "backend": "pytorch"}
+
+                if use_onnx_backend(entry.model_name):
+                    try:
+                        onnx_model, report = load_onnx_model(model, entry.model_path)
+                        logging.info(f"ONNX backend report for {entry.model_name}: {report}")
+                        info["backend_report"] = report
+                        if onnx_model is not None:
+                            # the fp32 model is released, only the quantized model is kept in memory
+                            model = onnx_model
+                            info["backend"] = "onnx-int8"
+                    except Exception as error:
+                        logging.error(f"Failed to load ONNX backend for {entry.model_name} - {str(error)}")
+
+                entry.model = model
+                entry.info = info
+                entry.size_mb = model_size_mb(model)
+                entry.load_seconds = time.perf_counter() - start
+                entry.state = "loaded"
+                entry.error = None
+                logging.info(f"Loaded model {entry.model_name} in {entry.load_seconds:.1f}s")
+            except Exception as error:
+                entry.state = "failed"
+                entry.error = str(error)
+                logging.error(f"Failed to load model {entry.model_name} - {str(error)}")
+                raise
+        self._enforce_memory_budget(keep=name)
+        return model
+
+    def _enforce_memory_budget(self, keep):
+        if self.memory_budget_mb <= 0:
+            return
+        with self._lock:
+            loaded = [(entry.last_used, name, entry) for name, entry in self._entries.items()
+                      if entry.model is not None and name != keep]
+            total_mb = sum(entry.size_mb for entry in self._entries.values() if entry.model is not None)
+            for _, name, entry in sorted(loaded, key=lambda item: item[0]):
+                if total_mb <= self.memory_budget_mb:
+                    break
+                with entry.lock:
+                    entry.model = None
+                    entry.state = "not_loaded"
+                total_mb -= entry.size_mb
+                logging.info(f"Unloaded idle model {name} to stay within the memory budget")
@@ -0,0 +1,167 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import logging
+import os
+import time
+from typing import List
+
+import numpy as np
+
+# Sentences used to check that a quantized model still produces the same vectors
+# as the fp32 model it was exported from, and to compare their throughput
+PARITY_SAMPLE_TEXTS = [
+    "What is the process for submitting a travel reimbursement claim?",
+    "The committee approved the revised budget for the next fiscal year.",
+    "Table 3 lists the quarterly maintenance schedule for each facility.",
+    "Employees must complete the annual security awareness training by March 31.",
+    "Les demandes de subvention doivent être soumises avant la fin du mois.",
+    "La política de privacidad describe cómo se recopilan y utilizan los datos personales.",
+    "Contact the help desk if you are unable to access your account.",
+    "The environmental assessment identified no significant impact on local wildlife.",
+    "Section 4.2 defines the responsibilities of the contracting officer.",
+    "A short answer.",
+    "Public records requests are processed within twenty business days of receipt, "
+    "unless the request requires review by legal counsel or involves a large volume of documents.",
+    "The quick brown fox jumps over the lazy dog."
+]
+
+
+class OnnxEmbeddingModel:
+    """ Serves a sentence-transformers model through onnxruntime, using a copy of the
+    transformer exported to ONNX with dynamic int8 quantization of its weights.
+    Tokenization, pooling and normalization follow the source model so the vectors
+    keep the same meaning as the fp32 model """
+
+    def __init__(self, onnx_path, tokenizer, pooling_mode, normalize, max_seq_length,
+                 embedding_dimension, intra_op_threads=0):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads > 0:
+            options.intra_op_num_threads = intra_op_threads
+        self.onnx_path = onnx_path
+        self.session = onnxruntime.InferenceSession(onnx_path, sess_options=options,
+                                                    providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.tokenizer = tokenizer
+        self.pooling_mode = pooling_mode
+        self.normalize = normalize
+        self.max_seq_length = max_seq_length
+        self.embedding_dimension = embedding_dimension
+
+    def get_sentence_embedding_dimension(self):
+        """ Returns the size of the vectors produced by the model """
+        return self.embedding_dimension
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        """ Embeds a list of texts, returning one row per text """
+        if isinstance(texts, str):
+            texts = [texts]
+        # like sentence-transformers, batch texts of similar length to limit padding
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        embeddings = np.zeros((len(texts), self.embedding_dimension), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            batch_indices = order[start:start + batch_size]
+            encoded = self.tokenizer([texts[i] for i in batch_indices],
+                                     padding=True,
+                                     truncation=True,
+                                     max_length=self.max_seq_length,
+                                     return_tensors="np")
+            feeds = {name: encoded[name].astype(np.int64) for name in self.input_names}
+            token_embeddings = self.session.run(None, feeds)[0]
+            embeddings[batch_indices] = self._pool(token_embeddings, encoded["attention_mask"])
+        return embeddings
+
+    def _pool(self, token_embeddings, attention_mask):
+        if self.pooling_mode == "cls":
+            pooled = token_embeddings[:, 0]
+        else:
+            mask = attention_mask[..., np.newaxis].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.normalize:
+            pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled
+
+    @classmethod
+    def from_sentence_transformer(cls, st_model, output_dir, intra_op_threads=0):
+        """ Exports the transformer of a loaded sentence-transformers model to ONNX,
+        quantizes it to int8 and loads it. The quantized model is kept in output_dir
+        and reused on subsequent loads """
+        from sentence_transformers.models import Normalize, Pooling
+
+        quantized_path = os.path.join(output_dir, "model_quantized.onnx")
+        if not os.path.exists(quantized_path):
+            export_quantized(st_model, output_dir)
+
+        pooling_mode = "mean"
+        normalize = False
+        for module in st_model:
+            if isinstance(module, Pooling):
+                pooling_mode = "cls" if module.pooling_mode_cls_token else "mean"
+            elif isinstance(module, Normalize):
+                normalize = True
+
+        return cls(quantized_path,
+                   st_model.tokenizer,
+                   pooling_mode,
+                   normalize,
+                   st_model.max_seq_length,
+                   st_model.get_sentence_embedding_dimension(),
+                   intra_op_threads)
+
+
+def export_quantized(st_model, output_dir):
+    """ Writes the fp32 ONNX export of a sentence-transformers model's transformer
+    to output_dir, followed by its dynamically quantized int8 copy """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    os.makedirs(output_dir, exist_ok=True)
+    fp32_path = os.path.join(output_dir, "model.onnx")
+    quantized_path = os.path.join(output_dir, "model_quantized.onnx")
+
+    transformer = st_model[0].auto_model
+    transformer.eval()
+    sample = st_model.tokenizer(["Export sample text"], return_tensors="pt")
+    input_names = list(sample.keys())
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    start = time.perf_counter()
+    with torch.no_grad():
+        torch.onnx.export(transformer,
+                          (dict(sample),),
+                          fp32_path,
+                          input_names=input_names,
+                          output_names=["last_hidden_state"],
+                          dynamic_axes=dynamic_axes,
+                          opset_version=14)
+    quantize_dynamic(fp32_path, quantized_path, weight_type=QuantType.QInt8)
+    logging.info(f"Exported and quantized model to {quantized_path} in {time.perf_counter() - start:.1f}s")
+
+
+def parity_check(reference_model, candidate_model, texts=None):
+    """ Compares the vectors of the candidate model with the reference model,
+    returning the minimum and mean cosine similarity over the sample texts """
+    texts = texts or PARITY_SAMPLE_TEXTS
+    reference = np.asarray(reference_model.encode(texts), dtype=np.float32)
+    candidate = np.asarray(candidate_model.encode(texts), dtype=np.float32)
+    cosine = (reference * candidate).sum(axis=1) / (
+        np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1))
+    return {"min_cosine": float(cosine.min()), "mean_cosine": float(cosine.mean())}
+
+
+def compare_throughput(reference_model, candidate_model, texts=None, repeats=4):
+    """ Measures the texts per second embedded by the reference and candidate models """
+    texts = (texts or PARITY_SAMPLE_TEXTS) * repeats
+    report = {}
+    for name, model in (("reference", reference_model), ("candidate", candidate_model)):
+        # warm up so one-off initialization is not measured
+        model.encode(texts[:2])
+        start = time.perf_counter()
+        model.encode(texts)
+        report[f"{name}_texts_per_second"] = len(texts) / (time.perf_counter() - start)
+    report["speedup"] = report["candidate_texts_per_second"] / report["reference_texts_per_second"]
+    return report
@@ -0,0 +1,221 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from azure.core.exceptions import HttpResponseError, ResourceExistsError, ResourceNotFoundError
+from azure.storage.blob import BlobClient, ContainerClient
+
+from shared_code.chunk_pack import is_pack_index_blob
+from shared_code.vector_sidecar import is_chunk_blob
+
+
+class RateLimiter:
+    """ Spaces out work so that no more than rate items are processed per second,
+    allowing a burst of up to one second of work """
+
+    def __init__(self, rate: float):
+        self.rate = float(rate)
+        self._allowance = self.rate
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, items: int) -> None:
+        """ Blocks until the given number of items may be processed """
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._allowance = min(self.rate, self._allowance + (now - self._last) * self.rate)
+            self._last = now
+            self._allowance -= items
+            delay = -self._allowance / self.rate if self._allowance < 0 else 0
+        if delay > 0:
+            time.sleep(delay)
+
+
+class ReembedJob:
+    """ Walks the content container and re-embeds every chunk whose stored vector was
+    produced by a model other than the target model, one listing page at a time.
+    Progress is checkpointed to a blob after each page, holding a lease on the
+    blob so only one instance runs the job, and a job that did not finish is
+    resumed from the last completed page. process_chunks embeds and indexes the
+    chunks of a page, raising if any of them could not be indexed, and returns
+    the counts to add to the job's progress """
+
+    def __init__(self,
+                 container_client: ContainerClient,
+                 checkpoint_blob: BlobClient,
+                 target_model: str,
+                 target_index: str,
+                 process_chunks: Callable[[List[str]], Dict[str, int]],
+                 page_size: int = 1000,
+                 lease_seconds: int = 60):
+        self.container_client = container_client
+        self.checkpoint_blob = checkpoint_blob
+        self.target_model = target_model
+        self.target_index = target_index
+        self.process_chunks = process_chunks
+        self.page_size = int(page_size)
+        self.lease_seconds = int(lease_seconds)
+        self.checkpoint = None
+        self._lease = None
+        self._stopped = threading.Event()
+        self._finished = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self, restart: bool = False) -> Dict:
+        """ Starts or resumes the job on a background thread, returning its status.
+        restart discards the progress of an earlier run for the same model """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return self.status()
+            checkpoint = self._read_checkpoint()
+            if checkpoint is None:
+                try:
+                    self.checkpoint_blob.upload_blob(json.dumps(self._new_checkpoint()), overwrite=False)
+                except ResourceExistsError:
+                    pass
+                checkpoint = self._read_checkpoint()
+            try:
+                self._lease = self.checkpoint_blob.acquire_lease(lease_duration=self.lease_seconds)
+            except HttpResponseError as error:
+                raise RuntimeError("The re-embedding job is already running on another instance") from error
+
+            if restart or checkpoint is None or checkpoint.get("target_model") != self.target_model \
+                    or checkpoint.get("target_index") != self.target_index:
+                checkpoint = self._new_checkpoint()
+            elif checkpoint["state"] == "complete":
+                self.checkpoint = checkpoint
+                self._release_lease()
+                return self.status()
+            checkpoint["state"] = "running"
+            checkpoint["error"] = None
+            self.checkpoint = checkpoint
+            self._save_checkpoint()
+
+            self._stopped.clear()
+            self._finished.clear()
+            self._thread = threading.Thread(target=self._run, name="reembed-job", daemon=True)
+            self._thread.start()
+            threading.Thread(target=self._renew_lease, name="reembed-lease", daemon=True).start()
+            return self.status()
+
+    def stop(self) -> Dict:
+        """ Asks the job to stop after the page in progress, keeping its checkpoint so it
+        can be resumed. Returns without waiting for the page, with the state stopping
+        until the job has saved its checkpoint """
+        self._stopped.set()
+        status = self.status()
+        if self._thread is not None and self._thread.is_alive():
+            status["state"] = "stopping"
+        return status
+
+    def status(self) -> Dict:
+        """ Returns the progress of the job, read from the checkpoint blob when this
+        instance is not running it """
+        checkpoint = self.checkpoint
+        if checkpoint is None:
+            checkpoint = self._read_checkpoint() or self._new_checkpoint(state="not_started")
+        return {key: value for key, value in checkpoint.items() if key != "continuation_token"}
+
+    def is_unfinished(self) -> bool:
+        """ Returns whether an earlier run of the job for the target model stopped
+        without completing, for instance because the instance running it was restarted """
+        checkpoint = self._read_checkpoint()
+        return checkpoint is not None and checkpoint.get("target_model") == self.target_model \
+            and checkpoint.get("state") == "running"
+
+    def _run(self):
+        checkpoint = self.checkpoint
+        try:
+            pages = self.container_client.list_blobs(results_per_page=self.page_size) \
+                .by_page(continuation_token=checkpoint["continuation_token"])
+            for page in pages:
+                # packed documents are passed by the name of their index
+                chunk_names = [blob.name for blob in page
+                               if is_chunk_blob(blob.name) or is_pack_index_blob(blob.name)]
+                counts = self.process_chunks(chunk_names)
+                # the checkpoint only moves past a page once all of its chunks are indexed,
+                # so a resumed job repeats at most the page that was in progress
+                checkpoint["continuation_token"] = pages.continuation_token
+                checkpoint["pages"] += 1
+                checkpoint["scanned"] += len(chunk_names)
+                for key, value in counts.items():
+                    checkpoint[key] = checkpoint.get(key, 0) + value
+                if pages.continuation_token is None:
+                    # the scan is over, so a stop asked for during the last page completes the
+                    # job, rather than leave a checkpoint that would resume from the first page
+                    break
+                if self._stopped.is_set():
+                    checkpoint["state"] = "stopped"
+                    break
+                self._save_checkpoint()
+            if checkpoint["state"] == "running":
+                checkpoint["state"] = "complete"
+            logging.info(f"Re-embedding job for {self.target_model} {checkpoint['state']} after "
+                         f"{checkpoint['scanned']} chunks, {checkpoint.get('reembedded', 0)} re-embedded")
+        except Exception as error:
+            logging.error(f"Re-embedding job for {self.target_model} failed: {str(error)}")
+            checkpoint["state"] = "failed"
+            checkpoint["error"] = str(error)
+        finally:
+            try:
+                self._save_checkpoint()
+            finally:
+                self._stopped.set()
+                self._finished.set()
+                self._release_lease()
+
+    def _renew_lease(self):
+        # renew well before the lease runs out, as a page can take longer than the lease,
+        # until the job has saved its last checkpoint, including after it is asked to stop
+        while not self._finished.wait(max(1, self.lease_seconds // 3)):
+            lease = self._lease
+            if lease is None:
+                return
+            try:
+                lease.renew()
+            except Exception as error:
+                logging.error(f"Failed to renew the lease on the re-embedding checkpoint: {str(error)}")
+
+    def _release_lease(self):
+        lease, self._lease = self._lease, None
+        if lease is not None:
+            try:
+                lease.release()
+            except Exception as error:
+                logging.warning(f"Failed to release the lease on the re-embedding checkpoint: {str(error)}")
+
+    def _new_checkpoint(self, state: str = "running") -> Dict:
+        return {
+            "target_model": self.target_model,
+            "target_index": self.target_index,
+            "state": state,
+            "continuation_token": None,
+            "pages": 0,
+            "scanned": 0,
+            "reembedded": 0,
+            "indexed": 0,
+            "started": datetime.now(timezone.utc).isoformat(),
+            "updated": None,
+            "error": None
+        }
+
+    def _read_checkpoint(self) -> Optional[Dict]:
+        try:
+            return json.loads(self.checkpoint_blob.download_blob().readall())
+        except ResourceNotFoundError:
+            return None
+        except ValueError:
+            return None
+
+    def _save_checkpoint(self):
+        self.checkpoint["updated"] = datetime.now(timezone.utc).isoformat()
+        self.checkpoint_blob.upload_blob(json.dumps(self.checkpoint), overwrite=True, lease=self._lease)
@@ -6,10 +6,11 @@ import os
 from datetime import datetime, timezone
 from itertools import islice
 import azure.functions as func
-from azure.search.documents import SearchClient
 from azure.storage.blob import BlobServiceClient
 from azure.identity import ManagedIdentityCredential, AzureAuthorityHosts, DefaultAzureCredential, get_bearer_token_provider
 from shared_code.status_log import State, StatusClassification, StatusLog
+from shared_code.clients import get_blob_service_client, get_search_client
+from shared_code.chunk_pack import packed_chunk_names
 
 azure_blob_storage_endpoint = os.environ["BLOB_STORAGE_ACCOUNT_ENDPOINT"]
 blob_storage_account_upload_container_name = os.environ[
@@ -84,11 +85,16 @@ def delete_content_blobs(blob_service_client: BlobServiceClient, deleted_blob: s
     for blob in content_list:
         chunked_blobs_to_delete[blob.name] = None
     logging.debug("Total number of chunked blobs to delete - %s", str(len(chunked_blobs_to_delete)))
+    # Packed chunks have no blob of their own, so read their names from the pack
+    # indexes before the indexes are deleted
+    packed_chunks = packed_chunk_names(content_container_client, chunked_blobs_to_delete)
     # Split the chunked blob dict into chunks of less than 256
     chunked_content_blob_dict = list(chunks(chunked_blobs_to_delete, 255))
     # Delete all of the content blobs that came from a deleted blob in the upload container
     for item in chunked_content_blob_dict:
         content_container_client.delete_blobs(*item)
+    for chunk_name in packed_chunks:
+        chunked_blobs_to_delete[chunk_name] = None
     return chunked_blobs_to_delete
 
 
@@ -96,9 +102,9 @@ def delete_search_entries(deleted_content_blobs: dict) -> None:
     '''Takes a list of content blobs that were deleted in a previous
     step and deletes the corresponding entries in the Azure AI 
     Search index.'''
-    search_client = SearchClient(azure_search_service_endpoint,
-                                 azure_search_index,
-                                 azure_credential)
+    search_client = get_search_client(azure_search_service_endpoint,
+                                      azure_search_index,
+                                      azure_credential)
 
     search_id_list_to_delete = []
     for file_path in deleted_content_blobs.keys():
@@ -130,7 +136,7 @@ def main(mytimer: func.TimerRequest) -> None:
     logging.info('Python timer trigger function ran at %s', utc_timestamp)
 
     # Create Blob Service Client
-    blob_service_client = BlobServiceClient(account_url=azure_blob_storage_endpoint, credential=azure_credential)
+    blob_service_client = get_blob_service_client(account_url=azure_blob_storage_endpoint, credential=azure_credential)
     deleted_blobs = get_deleted_blobs(blob_service_client)
 
 
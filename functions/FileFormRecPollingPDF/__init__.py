@@ -5,14 +5,16 @@ import logging
 import os
 import json
 import random
+import tempfile
 from collections import namedtuple
 import time
 import azure.functions as func
-from azure.storage.queue import QueueClient, TextBase64EncodePolicy
+from azure.storage.queue import TextBase64EncodePolicy
 from azure.identity import ManagedIdentityCredential, AzureAuthorityHosts, DefaultAzureCredential, get_bearer_token_provider
-import requests
 from shared_code.status_log import StatusLog, State, StatusClassification
 from shared_code.utilities import Utilities, MediaType
+from shared_code.clients import get_http_session, get_queue_client
+from shared_code.analyze_result import AnalyzeResultFile, download_to_file
 from requests.exceptions import RequestException
 from tenacity import retry, stop_after_attempt, wait_fixed
 
@@ -68,9 +70,14 @@ else:
     azure_credential = ManagedIdentityCredential(authority=AUTHORITY)
 token_provider = get_bearer_token_provider(azure_credential, f'https://{os.environ["AZURE_AI_CREDENTIAL_DOMAIN"]}/.default')
 
+http_session = get_http_session()
 utilities = Utilities(azure_blob_storage_account, azure_blob_storage_endpoint, azure_blob_drop_storage_container, azure_blob_content_storage_container, azure_credential)
 
 def main(msg: func.QueueMessage) -> None:
+    # the analyze result of a long document is too large to load whole, so it is
+    # streamed to a temporary file and read from there a table or paragraph at a time
+    result_directory = tempfile.TemporaryDirectory()
+    result_file = AnalyzeResultFile(os.path.join(result_directory.name, "analyze_result.json"))
     
     try:
         statusLog = StatusLog(cosmosdb_url, azure_credential, cosmosdb_log_database_name, cosmosdb_log_container_name)
@@ -98,31 +105,30 @@ def main(msg: func.QueueMessage) -> None:
         
         # retry logic to handle 'Connection broken: IncompleteRead' errors, up to n times
      
-        response = durable_get(url, headers, params)   
+        response = durable_get(url, headers, params, result_file.file_path)   
         
         # Check response and process
         if response.status_code == 200:
             # FR processing is complete OR still running- create document map 
-            response_json = response.json()
-            response_status = response_json['status']
+            response_status = result_file.status()
             
             if response_status == "succeeded":
                 # successful, so continue to document map and chunking
                 statusLog.upsert_document(blob_name, f'{function_name} - Form Recognizer has completed processing and the analyze results have been received', StatusClassification.DEBUG)  
-                # build the document map     
+                # build the document map, a window of pages at a time as it is chunked
                 statusLog.upsert_document(blob_name, f'{function_name} - Starting document map build', StatusClassification.DEBUG)  
-                document_map = utilities.build_document_map_pdf(blob_name, blob_uri, response_json["analyzeResult"], azure_blob_log_storage_container, enableDevCode)  
-                statusLog.upsert_document(blob_name, f'{function_name} - Document map build complete', StatusClassification.DEBUG)     
+                document_map = utilities.build_document_map_pdf_stream(blob_name, blob_uri, result_file, azure_blob_log_storage_container, enableDevCode)  
+                statusLog.upsert_document(blob_name, f'{function_name} - Document map layout read', StatusClassification.DEBUG)     
                 # create chunks
                 statusLog.upsert_document(blob_name, f'{function_name} - Starting chunking', StatusClassification.DEBUG)  
                 chunk_count = utilities.build_chunks(document_map, blob_name, blob_uri, CHUNK_TARGET_SIZE)
                 statusLog.upsert_document(blob_name, f'{function_name} - Chunking complete, {chunk_count} chunks created.', StatusClassification.DEBUG)  
                 
                 # submit message to the enrichment queue to continue processing                
-                queue_client = QueueClient(account_url=azure_queue_storage_endpoint,
-                               queue_name=text_enrichment_queue,
-                               credential=azure_credential,
-                               message_encode_policy=TextBase64EncodePolicy())
+                queue_client = get_queue_client(account_url=azure_queue_storage_endpoint,
+                                                queue_name=text_enrichment_queue,
+                                                credential=azure_credential,
+                                                message_encode_policy=TextBase64EncodePolicy())
                 message_json["text_enrichment_queued_count"] = 1
                 message_string = json.dumps(message_json)
                 queue_client.send_message(message_string)
@@ -136,10 +142,10 @@ def main(msg: func.QueueMessage) -> None:
                     queued_count += 1
                     message_json['polling_queue_count'] = queued_count
                     statusLog.upsert_document(blob_name, f"{function_name} - FR has not completed processing, requeuing. Polling back off of attempt {queued_count} of {max_polling_requeue_count} for {backoff} seconds", StatusClassification.DEBUG, State.QUEUED) 
-                    queue_client = QueueClient(account_url=azure_queue_storage_endpoint,
-                               queue_name=pdf_polling_queue,
-                               credential=azure_credential,
-                               message_encode_policy=TextBase64EncodePolicy())
+                    queue_client = get_queue_client(account_url=azure_queue_storage_endpoint,
+                                                    queue_name=pdf_polling_queue,
+                                                    credential=azure_credential,
+                                                    message_encode_policy=TextBase64EncodePolicy())
                     message_json_str = json.dumps(message_json)  
                     queue_client.send_message(message_json_str, visibility_timeout=backoff)
                 else:
@@ -147,11 +153,11 @@ def main(msg: func.QueueMessage) -> None:
             else:
                 # unexpected status returned by FR, such as internal capacity overload, so requeue
                 if submit_queued_count < max_submit_requeue_count:
-                    statusLog.upsert_document(blob_name, f'{function_name} - unhandled response from Form Recognizer- code: {response.status_code} status: {response_status} - text: {response.text}. Document will be resubmitted', StatusClassification.ERROR)                  
-                    queue_client = QueueClient(account_url=azure_queue_storage_endpoint,
-                               queue_name=pdf_submit_queue,
-                               credential=azure_credential,
-                               message_encode_policy=TextBase64EncodePolicy())
+                    statusLog.upsert_document(blob_name, f'{function_name} - unhandled response from Form Recognizer- code: {response.status_code} status: {response_status} - text: {result_file.head()}. Document will be resubmitted', StatusClassification.ERROR)                  
+                    queue_client = get_queue_client(account_url=azure_queue_storage_endpoint,
+                                                    queue_name=pdf_submit_queue,
+                                                    credential=azure_credential,
+                                                    message_encode_policy=TextBase64EncodePolicy())
                     submit_queued_count += 1
                     message_json["submit_queued_count"] = submit_queued_count
                     message_string = json.dumps(message_json)    
@@ -166,12 +172,16 @@ def main(msg: func.QueueMessage) -> None:
     except Exception as e:
         # a general error 
         statusLog.upsert_document(blob_name, f"{function_name} - An error occurred - code: {response.status_code} - {str(e)}", StatusClassification.ERROR, State.ERROR)
+    finally:
+        result_directory.cleanup()
         
     statusLog.save_document(blob_name)
 
 
 @retry(stop=stop_after_attempt(max_read_attempts), wait=wait_fixed(5))
-def durable_get(url, headers, params):
-    response = requests.get(url, headers=headers, params=params)   
+def durable_get(url, headers, params, file_path):
+    response = http_session.get(url, headers=headers, params=params, stream=True)   
     response.raise_for_status()  # Raise stored HTTPError, if one occurred.
+    # the body is read within the retry, as that is where an IncompleteRead is raised
+    download_to_file(response, file_path)
     return response
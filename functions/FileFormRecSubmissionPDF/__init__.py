@@ -6,11 +6,11 @@ import logging
 import os
 import random
 import azure.functions as func
-import requests
-from azure.storage.queue import QueueClient, TextBase64EncodePolicy
+from azure.storage.queue import TextBase64EncodePolicy
 from azure.identity import ManagedIdentityCredential, AzureAuthorityHosts, DefaultAzureCredential, get_bearer_token_provider
 from shared_code.status_log import State, StatusClassification, StatusLog
 from shared_code.utilities import Utilities
+from shared_code.clients import get_http_session, get_queue_client
 
 azure_blob_storage_account = os.environ["BLOB_STORAGE_ACCOUNT"]
 azure_blob_storage_endpoint = os.environ["BLOB_STORAGE_ACCOUNT_ENDPOINT"]
@@ -55,6 +55,7 @@ else:
     azure_credential = ManagedIdentityCredential(authority=AUTHORITY)
 token_provider = get_bearer_token_provider(azure_credential, f'https://{os.environ["AZURE_AI_CREDENTIAL_DOMAIN"]}/.default')
 
+http_session = get_http_session()
 utilities = Utilities(
     azure_blob_storage_account,
     azure_blob_storage_endpoint,
@@ -112,7 +113,7 @@ def main(msg: func.QueueMessage) -> None:
         logging.info(f"Submitting to FR with url: {url}")
 
         # Send the HTTP POST request with headers, query parameters, and request body
-        response = requests.post(url, headers=headers, params=params, json=body)
+        response = http_session.post(url, headers=headers, params=params, json=body)
 
         # Check if the request was successful (status code 200)
         if response.status_code == 202:
@@ -125,10 +126,10 @@ def main(msg: func.QueueMessage) -> None:
             result_id = response.headers.get("apim-request-id")
             message_json["FR_resultId"] = result_id
             message_json["polling_queue_count"] = 1
-            queue_client = QueueClient(account_url=azure_queue_storage_endpoint,
-                               queue_name=pdf_polling_queue,
-                               credential=azure_credential,
-                               message_encode_policy=TextBase64EncodePolicy())
+            queue_client = get_queue_client(account_url=azure_queue_storage_endpoint,
+                                            queue_name=pdf_polling_queue,
+                                            credential=azure_credential,
+                                            message_encode_policy=TextBase64EncodePolicy())
             message_json_str = json.dumps(message_json)
             queue_client.send_message(
                 message_json_str, visibility_timeout=poll_queue_submit_backoff
@@ -155,10 +156,10 @@ def main(msg: func.QueueMessage) -> None:
                     f"{FUNCTION_NAME} - Throttled on PDF submission to FR, requeuing. Back off of {backoff} seconds",
                     StatusClassification.DEBUG,
                 )
-                queue_client = QueueClient(account_url=azure_queue_storage_endpoint,
-                               queue_name=pdf_submit_queue,
-                               credential=azure_credential,
-                               message_encode_policy=TextBase64EncodePolicy())
+                queue_client = get_queue_client(account_url=azure_queue_storage_endpoint,
+                                                queue_name=pdf_submit_queue,
+                                                credential=azure_credential,
+                                                message_encode_policy=TextBase64EncodePolicy())
                 message_json_str = json.dumps(message_json)
                 queue_client.send_message(message_json_str, visibility_timeout=backoff)
                 statusLog.upsert_document(
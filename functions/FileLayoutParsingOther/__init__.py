@@ -8,12 +8,12 @@ from enum import Enum
 from io import BytesIO
 import azure.functions as func
 from azure.storage.blob import generate_blob_sas
-from azure.storage.queue import QueueClient, TextBase64EncodePolicy
+from azure.storage.queue import TextBase64EncodePolicy
 from azure.identity import ManagedIdentityCredential, AzureAuthorityHosts, DefaultAzureCredential, get_bearer_token_provider
 from shared_code.status_log import StatusLog, State, StatusClassification
 from shared_code.utilities import Utilities, MediaType
+from shared_code.clients import get_http_session, get_queue_client
 
-import requests
 
 azure_blob_storage_account = os.environ["BLOB_STORAGE_ACCOUNT"]
 azure_blob_storage_endpoint = os.environ["BLOB_STORAGE_ACCOUNT_ENDPOINT"]
@@ -50,6 +50,7 @@ if local_debug == "true":
 else:
     azure_credential = ManagedIdentityCredential(authority=AUTHORITY)
 
+http_session = get_http_session()
 utilities = Utilities(azure_blob_storage_account, azure_blob_storage_endpoint, azure_blob_drop_storage_container, azure_blob_content_storage_container, azure_credential)
 
 class UnstructuredError(Exception):
@@ -61,7 +62,7 @@ def PartitionFile(file_extension: str, file_url: str):
         elements: A list of available models
     """  
     # Send a GET request to the URL to download the file
-    response = requests.get(file_url)
+    response = http_session.get(file_url)
     bytes_io = BytesIO(response.content)
     response.close()   
     metadata = [] 
@@ -149,7 +150,7 @@ def main(msg: func.QueueMessage) -> None:
 
         file_name, file_extension, file_directory  = utilities.get_filename_and_extension(blob_name)
 
-        response = requests.get(blob_path_plus_sas)
+        response = http_session.get(blob_path_plus_sas)
         response.raise_for_status()
               
         
@@ -182,7 +183,9 @@ def main(msg: func.QueueMessage) -> None:
                 
         subtitle_name = ''
         section_name = ''
-        # Complete and write chunks
+        chunk_sizes = utilities.token_counts([chunk.text for chunk in chunks])
+        # Complete and write chunks, uploading them in the background while the next are built
+        writer = utilities.chunk_writer()
         for i, chunk in enumerate(chunks):      
             if chunk.metadata.page_number == None:
                 page_list = [1]
@@ -197,19 +200,22 @@ def main(msg: func.QueueMessage) -> None:
             chunk_text = metdata_text + chunk_text                    
             utilities.write_chunk(blob_name, blob_uri,
                                 f"{i}",
-                                utilities.token_count(chunk.text),
+                                chunk_sizes[i],
                                 chunk_text, page_list,
                                 section_name, title, subtitle_name,
-                                MediaType.TEXT
+                                MediaType.TEXT,
+                                writer=writer
                                 )
+        # wait for every chunk to be stored before the document moves on to enrichment
+        write_stats = writer.flush()
         
-        statusLog.upsert_document(blob_name, f'{function_name} - chunking stored.', StatusClassification.DEBUG)   
+        statusLog.upsert_document(blob_name, f"{function_name} - chunking stored. {write_stats['chunks_written']} chunks, {write_stats['bytes_written']} bytes written.", StatusClassification.DEBUG)   
         
         # submit message to the text enrichment queue to continue processing                
-        queue_client = QueueClient(account_url=azure_queue_storage_endpoint,
-                               queue_name=text_enrichment_queue,
-                               credential=azure_credential,
-                               message_encode_policy=TextBase64EncodePolicy())
+        queue_client = get_queue_client(account_url=azure_queue_storage_endpoint,
+                                        queue_name=text_enrichment_queue,
+                                        credential=azure_credential,
+                                        message_encode_policy=TextBase64EncodePolicy())
         message_json["text_enrichment_queued_count"] = 1
         message_string = json.dumps(message_json)
         queue_client.send_message(message_string)
@@ -8,11 +8,11 @@ import random
 import time
 from shared_code.status_log import StatusLog, State, StatusClassification
 import azure.functions as func
-from azure.storage.blob import BlobServiceClient
-from azure.storage.queue import QueueClient, TextBase64EncodePolicy
+from azure.storage.queue import TextBase64EncodePolicy
 from azure.identity import ManagedIdentityCredential, AzureAuthorityHosts, DefaultAzureCredential, get_bearer_token_provider
-from azure.search.documents import SearchClient
 from shared_code.utilities_helper import UtilitiesHelper
+from shared_code.clients import get_blob_service_client, get_queue_client, get_search_client
+from shared_code.chunk_pack import is_pack_index_blob, packed_chunk_names
 from urllib.parse import unquote
 
 
@@ -121,8 +121,8 @@ def main(myblob: func.InputStream):
         }        
         message_string = json.dumps(message)
         
-        blob_client = BlobServiceClient(azure_blob_endpoint,
-                                        credential=azure_credential)
+        blob_client = get_blob_service_client(azure_blob_endpoint,
+                                              credential=azure_credential)
         myblob_filename = myblob.name.split("/", 1)[1]
 
         # Check if the blob has been marked as 'do not process' and abort if so
@@ -150,13 +150,17 @@ def main(myblob: func.InputStream):
         blobs = blob_container.list_blobs(name_starts_with=myblob_filename)
         
         # instantiate the search sdk elements
-        search_client = SearchClient(azure_search_service_endpoint,
-                                azure_search_service_index,
-                                azure_credential)
+        search_client = get_search_client(azure_search_service_endpoint,
+                                          azure_search_service_index,
+                                          azure_credential)
         search_id_list_to_delete = []
         
         # Iterate through the blobs and delete each one from blob and the search index
         for blob in blobs:
+            if is_pack_index_blob(blob.name):
+                # packed chunks are indexed by their own names, held in the pack index
+                for chunk_name in packed_chunk_names(blob_container, [blob.name]):
+                    search_id_list_to_delete.append({"id": statusLog.encode_document_id(chunk_name)})
             blob_client.get_blob_client(container=azure_blob_content_container, blob=blob.name).delete_blob()
             search_id_list_to_delete.append({"id": statusLog.encode_document_id(blob.name)})
         
@@ -167,15 +171,15 @@ def main(myblob: func.InputStream):
             logging.debug("No items to delete from AI Search index.")        
             
         # write tags to cosmos db once per file/message
-        blob_service_client = BlobServiceClient(azure_blob_endpoint, credential=azure_credential)
+        blob_service_client = get_blob_service_client(azure_blob_endpoint, credential=azure_credential)
         upload_container_client = blob_service_client.get_container_client(azure_blob_upload_container)
         get_tags_and_upload_to_cosmos(upload_container_client, myblob.name)
         
         # Queue message with a random backoff so as not to put the next function under unnecessary load
-        queue_client = QueueClient(account_url=azure_queue_endpoint,
-                               queue_name=queue_name,
-                               credential=azure_credential,
-                               message_encode_policy=TextBase64EncodePolicy())
+        queue_client = get_queue_client(account_url=azure_queue_endpoint,
+                                        queue_name=queue_name,
+                                        credential=azure_credential,
+                                        message_encode_policy=TextBase64EncodePolicy())
         backoff =  random.randint(1, max_seconds_hide_on_upload)        
         queue_client.send_message(message_string, visibility_timeout = backoff)  
         statusLog.upsert_document(myblob.name, f'{function_name} - {file_extension} file sent to submit queue. Visible in {backoff} seconds', StatusClassification.DEBUG, State.QUEUED)          
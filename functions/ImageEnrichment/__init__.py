@@ -4,12 +4,12 @@ import os
 
 import azure.functions as func
 import requests
-from azure.storage.blob import BlobServiceClient
 from azure.core.credentials import AzureKeyCredential
 from azure.identity import ManagedIdentityCredential, DefaultAzureCredential, get_bearer_token_provider, AzureAuthorityHosts
 from shared_code.status_log import State, StatusClassification, StatusLog
 from shared_code.utilities import Utilities, MediaType
-from azure.search.documents import SearchClient
+from shared_code.search_index_writer import SearchIndexWriter
+from shared_code.clients import get_blob_service_client, get_http_session, get_search_client
 from datetime import datetime
 
 azure_blob_storage_account = os.environ["BLOB_STORAGE_ACCOUNT"]
@@ -101,6 +101,7 @@ vision_api_headers = {
 
 FUNCTION_NAME = "ImageEnrichment"
 
+http_session = get_http_session()
 utilities = Utilities(
     azure_blob_storage_account=azure_blob_storage_account,
     azure_blob_storage_endpoint=azure_blob_storage_endpoint,
@@ -123,7 +124,7 @@ def detect_language(text):
         }
     } 
 
-    response = requests.post(
+    response = http_session.post(
         API_DETECT_ENDPOINT, headers=translator_api_headers, json=data
     )
     if response.status_code == 200:
@@ -138,7 +139,7 @@ def translate_text(text, target_language):
     data = [{"text": text}]
     params = {"to": target_language}
 
-    response = requests.post(
+    response = http_session.post(
         API_TRANSLATE_ENDPOINT, headers=translator_api_headers, json=data, params=params
     )
     if response.status_code == 200:
@@ -178,15 +179,15 @@ def main(msg: func.QueueMessage) -> None:
             blob_path)
         path = blob_path.split("/", 1)[1]
 
-        blob_service_client = BlobServiceClient(account_url=azure_blob_storage_endpoint,
-                                                    credential=azure_credential)
+        blob_service_client = get_blob_service_client(account_url=azure_blob_storage_endpoint,
+                                                      credential=azure_credential)
         blob_client = blob_service_client.get_blob_client(container=azure_blob_drop_storage_container,
                                                               blob=path)
         image_data = blob_client.download_blob().readall()
         files = {"file": image_data}
-        response = requests.post(VISION_ENDPOINT, 
-                                 headers=vision_api_headers, 
-                                 data=image_data)
+        response = http_session.post(VISION_ENDPOINT, 
+                                     headers=vision_api_headers, 
+                                     data=image_data)
     
         if response.status_code == 200:
             result = response.json()
@@ -313,7 +314,7 @@ def main(msg: func.QueueMessage) -> None:
 
         # Get the tags from metadata on the blob
         path = file_directory + file_name + file_extension
-        blob_service_client = BlobServiceClient(
+        blob_service_client = get_blob_service_client(
             account_url=azure_blob_storage_endpoint, credential=azure_credential)
         blob_client = blob_service_client.get_blob_client(
             container=azure_blob_drop_storage_container, blob=path)
@@ -358,7 +359,6 @@ def index_section(index_content, file_name, file_directory, chunk_id, chunk_file
     """
 
     index_chunk = {}
-    batch = []
     index_chunk['id'] = chunk_id
     azure_datetime = datetime.now().astimezone().isoformat()
     index_chunk['processed_datetime'] = azure_datetime
@@ -371,10 +371,12 @@ def index_section(index_content, file_name, file_directory, chunk_id, chunk_file
     index_chunk['chunk_file'] = chunk_file
     index_chunk['file_class'] = MediaType.IMAGE
     index_chunk['tags'] = tags
-    batch.append(index_chunk)
 
-    search_client = SearchClient(endpoint=AZURE_SEARCH_SERVICE_ENDPOINT,
-                                 index_name=AZURE_SEARCH_INDEX,
-                                 credential=azure_credential)
-
-    search_client.upload_documents(documents=batch)
+    search_client = get_search_client(AZURE_SEARCH_SERVICE_ENDPOINT,
+                                      AZURE_SEARCH_INDEX,
+                                      azure_credential)
+    index_writer = SearchIndexWriter(search_client, max_concurrency=1)
+    index_writer.add(index_chunk)
+    failed = index_writer.close()
+    if failed:
+        raise Exception(f"Failed to index {chunk_id}: {failed[chunk_id]}")
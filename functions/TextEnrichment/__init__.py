@@ -1,15 +1,16 @@
 import logging
 import azure.functions as func
-from azure.storage.queue import QueueClient, TextBase64EncodePolicy
+from azure.storage.queue import TextBase64EncodePolicy
 from azure.identity import ManagedIdentityCredential, AzureAuthorityHosts, DefaultAzureCredential, get_bearer_token_provider
-from azure.storage.blob import BlobServiceClient
 from shared_code.utilities import Utilities
 import os
 import json
-import requests
 import random
 import re
 from shared_code.status_log import State, StatusClassification, StatusLog
+from shared_code.vector_sidecar import is_chunk_blob
+from shared_code.chunk_pack import PackedChunks
+from shared_code.clients import get_blob_service_client, get_http_session, get_queue_client
 from shared_code.utilities import Utilities
 from tenacity import retry, stop_after_attempt, wait_fixed
 
@@ -60,6 +61,7 @@ else:
     azure_credential = ManagedIdentityCredential(authority=AUTHORITY)
 token_provider = get_bearer_token_provider(azure_credential, f'https://{azure_ai_credential_domain}/.default')
 
+http_session = get_http_session()
 utilities = Utilities(
     azure_blob_storage_account,
     azure_blob_storage_endpoint,
@@ -101,20 +103,16 @@ def main(msg: func.QueueMessage) -> None:
         
         # Detect language of the document
         chunk_content = ''        
-        blob_service_client = BlobServiceClient(
+        blob_service_client = get_blob_service_client(
             account_url=azure_blob_storage_endpoint,
             credential=azure_credential,
         )
         container_client = blob_service_client.get_container_client(azure_blob_content_storage_container)
+        # the chunks of a packed document are all read with a single request, and written back with one
+        packed_chunks = PackedChunks.open(container_client, chunk_folder_path)
         # Iterate over the chunks in the container, retrieving up to the max number of chars required
-        chunk_list = container_client.list_blobs(name_starts_with=chunk_folder_path)
         chunk_content = ''
-        for i, chunk in enumerate(chunk_list):
-            # open the file and extract the content
-            blob_path_plus_sas = utilities.get_blob_and_sas(azure_blob_content_storage_container + '/' + chunk.name)
-            response = requests.get(blob_path_plus_sas)
-            response.raise_for_status()
-            chunk_dict = json.loads(response.text)   
+        for i, (chunk_name, chunk_dict) in enumerate(read_chunks(container_client, chunk_folder_path, packed_chunks)):
             if len(chunk_content) + len(chunk_dict["content"]) <= MAX_CHARS_FOR_DETECTION:
                  chunk_content = chunk_content + " " + chunk_dict["content"]
             else:
@@ -142,7 +140,7 @@ def main(msg: func.QueueMessage) -> None:
             }
         } 
 
-        response = requests.post(apiLanguageEndpoint, headers=headers, json=data)      
+        response = http_session.post(apiLanguageEndpoint, headers=headers, json=data)      
         if response.status_code == 200:
             detected_language = response.json()["results"]["documents"][0]["detectedLanguage"]["iso6391Name"]
             statusLog.upsert_document(
@@ -167,13 +165,7 @@ def main(msg: func.QueueMessage) -> None:
             )      
                
         # regenerate the iterator to reset it to the first chunk
-        chunk_list = container_client.list_blobs(name_starts_with=chunk_folder_path)
-        for i, chunk in enumerate(chunk_list):
-            # open the file and extract the content
-            blob_path_plus_sas = utilities.get_blob_and_sas(azure_blob_content_storage_container + '/' + chunk.name)
-            # exported to a def to allow retry if error encountered in getting response
-            response = get_chunk_blob(blob_path_plus_sas)            
-            chunk_dict = json.loads(response.text)
+        for i, (chunk_name, chunk_dict) in enumerate(read_chunks(container_client, chunk_folder_path, packed_chunks)):
             params = {'to': targetTranslationLanguage}              
 
             # Translate content, title, subtitle, and section if required
@@ -198,7 +190,7 @@ def main(msg: func.QueueMessage) -> None:
                     ]
                 }
             }                
-            response = requests.post(apiLanguageEndpoint, headers=headers, json=enrich_data, params=params)
+            response = http_session.post(apiLanguageEndpoint, headers=headers, json=enrich_data, params=params)
             try:
                 entities = response.json()['results']['documents'][0]['entities']
             except:
@@ -225,23 +217,29 @@ def main(msg: func.QueueMessage) -> None:
                     ]
                 }
             }                
-            response = requests.post(apiLanguageEndpoint, headers=headers, json=enrich_data, params=params)
+            response = http_session.post(apiLanguageEndpoint, headers=headers, json=enrich_data, params=params)
             try:
                 key_phrases = response.json()['results']['documents'][0]['keyPhrases']
             except:
                 key_phrases = []
             chunk_dict[f"key_phrases"] = key_phrases           
                                             
-            # Get path and file name minus the root container
-            json_str = json.dumps(chunk_dict, indent=2, ensure_ascii=False)
-            block_blob_client = blob_service_client.get_blob_client(container=azure_blob_content_storage_container, blob=chunk.name)
-            block_blob_client.upload_blob(json_str, overwrite=True)
+            if packed_chunks is not None:
+                packed_chunks.update(chunk_name, chunk_dict)
+            else:
+                # Get path and file name minus the root container
+                json_str = json.dumps(chunk_dict, indent=2, ensure_ascii=False)
+                block_blob_client = blob_service_client.get_blob_client(container=azure_blob_content_storage_container, blob=chunk_name)
+                block_blob_client.upload_blob(json_str, overwrite=True)
+
+        if packed_chunks is not None:
+            packed_chunks.commit()
                 
         # Queue message to embeddings queue for downstream processing
-        queue_client = QueueClient(account_url=azure_queue_storage_endpoint,
-                               queue_name=queueName,
-                               credential=azure_credential,
-                               message_encode_policy=TextBase64EncodePolicy())
+        queue_client = get_queue_client(account_url=azure_queue_storage_endpoint,
+                                        queue_name=queueName,
+                                        credential=azure_credential,
+                                        message_encode_policy=TextBase64EncodePolicy())
         embeddings_queue_backoff =  random.randint(1, 60)
         message_string = json.dumps(message_json)
         queue_client.send_message(message_string, visibility_timeout = embeddings_queue_backoff)
@@ -267,7 +265,7 @@ def translate_and_set(field_name, chunk_dict, headers, params, message_json, det
     '''Translate text if it is not in target language'''
     if detected_language != targetTranslationLanguage:
         data = [{"text": chunk_dict[field_name]}]
-        response = requests.post(apiTranslateEndpoint, headers=headers, json=data, params=params)
+        response = http_session.post(apiTranslateEndpoint, headers=headers, json=data, params=params)
         
         if response.status_code == 200:
             translated_content = response.json()[0]['translations'][0]['text']
@@ -311,10 +309,10 @@ def requeue(response, message_json):
             )
             queued_count += 1
             message_json["text_enrichment_queued_count"] = queued_count
-            queue_client = QueueClient(account_url=azure_queue_storage_endpoint,
-                               queue_name=text_enrichment_queue,
-                               credential=azure_credential,
-                               message_encode_policy=TextBase64EncodePolicy())
+            queue_client = get_queue_client(account_url=azure_queue_storage_endpoint,
+                                            queue_name=text_enrichment_queue,
+                                            credential=azure_credential,
+                                            message_encode_policy=TextBase64EncodePolicy())
             message_json_str = json.dumps(message_json)
             queue_client.send_message(message_json_str, visibility_timeout=backoff)
             statusLog.upsert_document(
@@ -333,10 +331,26 @@ def requeue(response, message_json):
         )     
         
 
+def read_chunks(container_client, chunk_folder_path, packed_chunks):
+    '''Yields the name and content of each chunk of a document, from its pack if the
+    chunks are packed, or from the chunk blobs otherwise'''
+    if packed_chunks is not None:
+        yield from packed_chunks.read_all().items()
+        return
+    for chunk in container_client.list_blobs(name_starts_with=chunk_folder_path):
+        if not is_chunk_blob(chunk.name):
+            continue
+        # open the file and extract the content
+        blob_path_plus_sas = utilities.get_blob_and_sas(azure_blob_content_storage_container + '/' + chunk.name)
+        # exported to a def to allow retry if error encountered in getting response
+        response = get_chunk_blob(blob_path_plus_sas)
+        yield chunk.name, json.loads(response.text)
+
+
 @retry(stop=stop_after_attempt(5), wait=wait_fixed(1))
 def get_chunk_blob(blob_path_plus_sas):
     '''This function wraps retrieving a blob from storage to allow 
     retries if throttled or error occurs'''
-    response = requests.get(blob_path_plus_sas)
+    response = http_session.get(blob_path_plus_sas)
     response.raise_for_status()
     return response
\ No newline at end of file
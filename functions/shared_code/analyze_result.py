@@ -0,0 +1,114 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import os
+import shutil
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import ijson
+
+from shared_code.document_map import (DocumentLayout, iter_document_structure, iter_page_windows,
+                                      paragraph_span, table_interval)
+
+# The analyze result of a long PDF runs to hundreds of MB, most of it the words, lines
+# and polygons of its pages, which the document map does not use. Rather than loading
+# the whole result, the response is streamed to a file and the content, tables and
+# paragraphs are read from it with an iterative parser, one table or paragraph at a
+# time. Only the content, a byte per character of it and the spans of the tables and
+# paragraphs are held for the whole document. The elements of the document map are
+# built, and chunked, DOCUMENT_MAP_WINDOW_PAGES pages at a time, and each table is read
+# from the file again when the window it falls in is built
+DOCUMENT_MAP_WINDOW_PAGES = int(os.environ.get("DOCUMENT_MAP_WINDOW_PAGES", "50"))
+RESPONSE_CHUNK_SIZE = 1024 * 1024
+
+
+def download_to_file(response, file_path: str) -> int:
+    """ Streams the body of a response, requested with stream=True, to a file and
+    returns the number of bytes written """
+    written = 0
+    with open(file_path, "wb") as result_file:
+        for data in response.iter_content(chunk_size=RESPONSE_CHUNK_SIZE):
+            result_file.write(data)
+            written += len(data)
+    return written
+
+
+class AnalyzeResultFile:
+    """ An analyze response of Form Recognizer stored in a file, read a value at a time """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+
+    def _first(self, prefix: str, default=None):
+        with open(self.file_path, "rb") as result_file:
+            return next(ijson.items(result_file, prefix, use_float=True), default)
+
+    def iter_items(self, prefix: str) -> Iterator[Dict]:
+        """ Yields the items of an array of the response one at a time """
+        with open(self.file_path, "rb") as result_file:
+            yield from ijson.items(result_file, f"{prefix}.item", use_float=True)
+
+    def status(self) -> Optional[str]:
+        """ The status of the analysis, which comes before the result in the response """
+        return self._first("status")
+
+    def content(self) -> str:
+        return self._first("analyzeResult.content", "")
+
+    def iter_tables(self) -> Iterator[Dict]:
+        return self.iter_items("analyzeResult.tables")
+
+    def iter_paragraphs(self) -> Iterator[Dict]:
+        return self.iter_items("analyzeResult.paragraphs")
+
+    def head(self, size: int = 4096) -> str:
+        """ The start of the response, for messages about a response that is not a result """
+        with open(self.file_path, "rb") as result_file:
+            return result_file.read(size).decode("utf-8", errors="replace")
+
+    def copy_to(self, output_file) -> None:
+        """ Copies the response to a file object, such as for the dev code logs """
+        with open(self.file_path, "rb") as result_file:
+            shutil.copyfileobj(result_file, output_file, RESPONSE_CHUNK_SIZE)
+
+
+class TableReader:
+    """ Reads the tables of a response by index. The tables are listed in content order,
+    as they are reached when the document map is built, so they are read in a single
+    pass over the file, which is only started again for a table already passed """
+
+    def __init__(self, result_file: AnalyzeResultFile):
+        self.result_file = result_file
+        self._tables = None
+        self._next_index = 0
+        self.passes = 0
+
+    def get(self, index: int) -> Dict:
+        if self._tables is None or index < self._next_index:
+            self._tables = self.result_file.iter_tables()
+            self._next_index = 0
+            self.passes += 1
+        for table in self._tables:
+            self._next_index += 1
+            if self._next_index - 1 == index:
+                return table
+        raise IndexError(f"Table {index} not found in the analyze result")
+
+
+def read_layout(result_file: AnalyzeResultFile, content: str) -> DocumentLayout:
+    """ Paints the layout of a document from the spans of its tables and paragraphs """
+    return DocumentLayout(len(content),
+                          (table_interval(table) for table in result_file.iter_tables()),
+                          (paragraph_span(paragraph) for paragraph in result_file.iter_paragraphs()))
+
+
+def iter_structure_windows(result_file: AnalyzeResultFile, table_to_html,
+                           window_pages: int = DOCUMENT_MAP_WINDOW_PAGES) -> Tuple[str, Iterator[List[Dict]]]:
+    """ Returns the content of a response and an iterator over the elements of its
+    document map in windows of window_pages pages. table_to_html is called with each
+    table as its element is built """
+    content = result_file.content()
+    layout = read_layout(result_file, content)
+    tables = TableReader(result_file)
+    elements = iter_document_structure(content, layout, lambda index: table_to_html(tables.get(index)))
+    return content, iter_page_windows(elements, window_pages)
@@ -0,0 +1,251 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import json
+import logging
+import os
+import posixpath
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from azure.core.exceptions import ResourceNotFoundError
+from azure.storage.blob import ContainerClient
+
+# In the packed layout the chunks of a document are stored in a single blob, one
+# compact JSON object per line, rather than one blob per chunk, next to a small index
+# of the name, byte offset and length of each chunk:
+#   <document folder>/chunks-<id>.jsonl
+#   <document folder>/chunks.idx
+# The chunks keep the names they have in the per-chunk layout, and those names are
+# what the search index refers to, so a stage can read the whole document in one
+# request, or a single chunk with a range read, without knowing how it was written.
+# Every write goes to a pack of a new name and the index is switched to it last, so a
+# reader never finds an index pointing into a pack that has changed since
+CHUNK_LAYOUT = os.environ.get("CHUNK_LAYOUT", "files")
+PACKED_LAYOUT = "packed"
+PACK_PREFIX = "chunks-"
+PACK_EXTENSION = ".jsonl"
+PACK_INDEX_NAME = "chunks.idx"
+PACK_VERSION = 1
+PACK_INDEX_CACHE_SIZE = int(os.environ.get("PACK_INDEX_CACHE_SIZE", "256"))
+
+
+def pack_index_name(folder: str) -> str:
+    """ Returns the name of the index blob of a document folder """
+    return f"{folder.rstrip('/')}/{PACK_INDEX_NAME}"
+
+
+def is_pack_index_blob(blob_name: str) -> bool:
+    """ Returns True for the index blob of a packed document """
+    return posixpath.basename(blob_name) == PACK_INDEX_NAME
+
+
+def new_pack_name(folder: str, extension: str = PACK_EXTENSION) -> str:
+    """ Returns an unused name for a pack, or another blob written with it, in a
+    document folder """
+    return f"{folder.rstrip('/')}/{PACK_PREFIX}{uuid.uuid4().hex}{extension}"
+
+
+def is_pack_blob(blob_name: str) -> bool:
+    """ Returns True for the blobs written by the packed layout, the packs, their
+    vector sidecars and the index """
+    base_name = posixpath.basename(blob_name)
+    return base_name.startswith(PACK_PREFIX) or base_name == PACK_INDEX_NAME
+
+
+def pack_chunks(chunks: Iterable[Tuple[str, Dict]]) -> Tuple[bytes, List[Dict]]:
+    """ Serializes named chunks into a pack, returning the pack and the index entry
+    of each chunk. An entry covers the JSON of its chunk without the line break """
+    lines = []
+    entries = []
+    offset = 0
+    for chunk_name, chunk_dict in chunks:
+        line = json.dumps(chunk_dict, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        entries.append({"name": chunk_name, "offset": offset, "length": len(line)})
+        lines.append(line)
+        offset += len(line) + 1
+    return b"".join(line + b"\n" for line in lines), entries
+
+
+def build_pack_index(pack_name: str, entries: List[Dict]) -> Dict:
+    """ Returns the index of a pack """
+    return {"version": PACK_VERSION, "pack": pack_name, "chunks": entries}
+
+
+def unpack_chunks(data: bytes, index: Dict) -> "OrderedDict[str, Dict]":
+    """ Parses the chunks of a pack, in the order of the index """
+    chunks = OrderedDict()
+    for entry in index["chunks"]:
+        chunks[entry["name"]] = json.loads(data[entry["offset"]:entry["offset"] + entry["length"]])
+    return chunks
+
+
+def read_pack_index(container_client: ContainerClient, folder: str) -> Optional[Dict]:
+    """ Returns the index of a document folder, or None if its chunks are not packed """
+    try:
+        data = container_client.get_blob_client(pack_index_name(folder)).download_blob().readall()
+    except ResourceNotFoundError:
+        return None
+    index = json.loads(data)
+    if index.get("version") != PACK_VERSION:
+        raise ValueError(f"Unsupported chunk pack version {index.get('version')} in {folder}")
+    return index
+
+
+def write_pack(write_blob, folder: str, chunks: Iterable[Tuple[str, Dict]]) -> Dict:
+    """ Writes named chunks as the pack of a document folder through write_blob,
+    called with a blob name and its bytes, the pack first and then the index.
+    Returns the index """
+    data, entries = pack_chunks(chunks)
+    pack_name = new_pack_name(folder)
+    write_blob(pack_name, data)
+    index = build_pack_index(pack_name, entries)
+    write_blob(pack_index_name(folder), json.dumps(index, separators=(",", ":")).encode("utf-8"))
+    return index
+
+
+def packed_chunk_names(container_client: ContainerClient, blob_names: Iterable[str]) -> List[str]:
+    """ Returns the names of the chunks held in the packs of the index blobs among
+    blob_names. The search index refers to these names rather than to the blobs that
+    hold them, so they are read before the blobs of a document are deleted """
+    chunk_names = []
+    for blob_name in blob_names:
+        if is_pack_index_blob(blob_name):
+            index = read_pack_index(container_client, posixpath.dirname(blob_name))
+            if index is not None:
+                chunk_names.extend(entry["name"] for entry in index["chunks"])
+    return chunk_names
+
+
+class PackedChunks:
+    """ The chunks of a document stored in the packed layout. All the chunks are read
+    with a single request the first time any is needed, updated in memory, and
+    written back as a new pack with a single request by commit() """
+
+    def __init__(self, container_client: ContainerClient, folder: str, index: Dict):
+        self.container_client = container_client
+        self.folder = folder.rstrip("/")
+        self.index = index
+        self._chunks = None
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, container_client: ContainerClient, folder: str) -> Optional["PackedChunks"]:
+        """ Returns the packed chunks of a document folder, or None if the chunks of
+        the document are stored one per blob """
+        index = read_pack_index(container_client, folder)
+        if index is None:
+            return None
+        return cls(container_client, folder, index)
+
+    @property
+    def names(self) -> List[str]:
+        """ The names of the chunks, in the order they were written """
+        return [entry["name"] for entry in self.index["chunks"]]
+
+    @property
+    def dirty(self) -> bool:
+        """ Whether any chunk has been updated since the pack was read """
+        return self._dirty
+
+    def read_all(self) -> "OrderedDict[str, Dict]":
+        """ Returns every chunk of the document, keyed by name """
+        with self._lock:
+            if self._chunks is None:
+                data = self.container_client.get_blob_client(self.index["pack"]).download_blob().readall()
+                self._chunks = unpack_chunks(data, self.index)
+            return self._chunks
+
+    def read_chunk(self, chunk_name: str) -> Dict:
+        """ Returns a chunk of the document """
+        return self.read_all()[chunk_name]
+
+    def update(self, chunk_name: str, chunk_dict: Dict) -> None:
+        """ Replaces a chunk in memory, to be written by commit() """
+        chunks = self.read_all()
+        with self._lock:
+            chunks[chunk_name] = chunk_dict
+            self._dirty = True
+
+    def commit(self) -> bool:
+        """ Writes the chunks back as a new pack if any has been updated, and removes
+        the pack it replaces. Returns True if the chunks were written """
+        if not self._dirty:
+            return False
+        previous_pack = self.index["pack"]
+
+        def write_blob(blob_name, data):
+            self.container_client.upload_blob(blob_name, data, overwrite=True)
+
+        self.index = write_pack(write_blob, self.folder, self._chunks.items())
+        self._dirty = False
+        delete_blob_quietly(self.container_client, previous_pack)
+        return True
+
+
+def delete_blob_quietly(container_client: ContainerClient, blob_name: str) -> None:
+    """ Deletes a blob that has been replaced, logging rather than raising a failure,
+    as the blob is no longer referenced """
+    try:
+        container_client.delete_blob(blob_name)
+    except ResourceNotFoundError:
+        pass
+    except Exception as error:
+        logging.warning(f"Failed to delete the replaced blob {blob_name}: {error}")
+
+
+class PackIndexCache:
+    """ A bounded cache of the indexes of document folders, for readers that look up
+    single chunks, such as citations. A folder whose chunks are not packed is cached
+    as None """
+
+    def __init__(self, max_entries: int = PACK_INDEX_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, container_client: ContainerClient, folder: str, refresh: bool = False) -> Optional[Dict]:
+        """ Returns the index of a folder, reading it on a miss or when refresh is set """
+        with self._lock:
+            if not refresh and folder in self._entries:
+                self._entries.move_to_end(folder)
+                return self._entries[folder]
+        index = read_pack_index(container_client, folder)
+        if index is not None:
+            # look chunks up by name rather than scanning the entries
+            index = dict(index, entries={entry["name"]: entry for entry in index["chunks"]})
+        with self._lock:
+            self._entries[folder] = index
+            self._entries.move_to_end(folder)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return index
+
+
+def read_chunk(container_client: ContainerClient, chunk_name: str,
+               index_cache: PackIndexCache) -> Dict:
+    """ Reads a single chunk by name, with a range read of its pack if its document
+    is packed, or from its own blob otherwise. A cached index that no longer matches
+    the stored chunks is read again once """
+    folder = posixpath.dirname(chunk_name)
+    for refresh in (False, True):
+        index = index_cache.get(container_client, folder, refresh)
+        try:
+            if index is None:
+                data = container_client.get_blob_client(chunk_name).download_blob().readall()
+            else:
+                entry = index["entries"].get(chunk_name)
+                if entry is None:
+                    if refresh:
+                        raise ResourceNotFoundError(f"Chunk {chunk_name} not found in {index['pack']}")
+                    continue
+                data = container_client.get_blob_client(index["pack"]).download_blob(
+                    offset=entry["offset"], length=entry["length"]).readall()
+            return json.loads(data)
+        except ResourceNotFoundError:
+            if refresh:
+                raise
+    raise ResourceNotFoundError(f"Chunk {chunk_name} not found")
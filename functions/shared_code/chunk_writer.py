@@ -0,0 +1,177 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import json
+import logging
+import os
+import posixpath
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+from azure.storage.blob import BlobServiceClient
+
+from shared_code.chunk_pack import write_pack
+
+# The chunking functions produce chunks faster than they can be uploaded one at a
+# time, so chunks are handed to a writer that uploads up to CHUNK_WRITE_CONCURRENCY
+# of them at once while chunking carries on. The upload threads are shared by every
+# writer in the process, and each writer limits its own uploads in flight
+CHUNK_WRITE_CONCURRENCY = int(os.environ.get("CHUNK_WRITE_CONCURRENCY", "8"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_chunk_write_pool() -> ThreadPoolExecutor:
+    """ Returns the process wide pool of chunk upload threads """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=max(1, CHUNK_WRITE_CONCURRENCY),
+                                           thread_name_prefix="chunk-writer")
+    return _pool
+
+
+class BlobChunkSink:
+    """ Writes chunks to a container of blob storage """
+
+    def __init__(self, blob_service_client: BlobServiceClient, container_name: str):
+        self.container_client = blob_service_client.get_container_client(container_name)
+
+    def write(self, path: str, data: bytes) -> None:
+        self.container_client.upload_blob(path, data, overwrite=True)
+
+
+class LocalChunkSink:
+    """ Writes chunks to a local directory, laid out as they are in the content
+    container, for offline runs and tests """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def write(self, path: str, data: bytes) -> None:
+        file_path = os.path.join(self.root, *path.split("/"))
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "wb") as chunk_file:
+            chunk_file.write(data)
+
+
+class ChunkWriter:
+    """ Uploads chunks to a sink in the background, with at most max_concurrency
+    uploads in flight. add() only blocks while that many uploads are in flight, and
+    flush() waits for every upload and raises the first error of any that failed,
+    so a document is not passed on with chunks missing """
+
+    def __init__(self, sink, max_concurrency: int = CHUNK_WRITE_CONCURRENCY,
+                 executor: ThreadPoolExecutor = None):
+        self.sink = sink
+        self.max_concurrency = max(1, int(max_concurrency))
+        self._executor = executor or get_chunk_write_pool()
+        self._in_flight = threading.BoundedSemaphore(self.max_concurrency)
+        self._lock = threading.Lock()
+        self._futures = []
+        self._error = None
+        self.chunks_written = 0
+        self.bytes_written = 0
+        self.failed = 0
+        self._started = time.perf_counter()
+
+    def add(self, path: str, content: str) -> None:
+        """ Queues a chunk for upload to path """
+        if self._error is not None:
+            # stop producing chunks for a document that can no longer be completed
+            raise self._error
+        data = content.encode("utf-8")
+        # block the producer while max_concurrency uploads are already in flight
+        self._in_flight.acquire()
+        try:
+            future = self._executor.submit(self._write, path, data)
+        except Exception:
+            self._in_flight.release()
+            raise
+        future.add_done_callback(lambda _: self._in_flight.release())
+        self._futures.append(future)
+
+    def flush(self) -> Dict[str, float]:
+        """ Waits for every queued chunk to be uploaded and returns the writer's
+        counts. Raises the first upload error, if any upload failed """
+        futures, self._futures = self._futures, []
+        for future in futures:
+            future.exception()
+        if self._error is not None:
+            raise self._error
+        return self.stats()
+
+    def stats(self) -> Dict[str, float]:
+        """ Returns the number of chunks and bytes written so far """
+        with self._lock:
+            return {
+                "chunks_written": self.chunks_written,
+                "bytes_written": self.bytes_written,
+                "failed": self.failed,
+                "seconds": time.perf_counter() - self._started
+            }
+
+    def _write(self, path, data):
+        try:
+            self.sink.write(path, data)
+        except Exception as error:
+            logging.error(f"Failed to write chunk {path}: {error}")
+            with self._lock:
+                self.failed += 1
+                if self._error is None:
+                    self._error = error
+            return
+        with self._lock:
+            self.chunks_written += 1
+            self.bytes_written += len(data)
+
+
+class ChunkPackWriter:
+    """ Collects the chunks of a document and writes them in the packed layout, as
+    a single pack and its index per document folder, when flushed. It takes the
+    same calls as ChunkWriter, so the chunkers do not depend on the layout """
+
+    def __init__(self, sink):
+        self.sink = sink
+        self._folders = OrderedDict()
+        self.chunks_written = 0
+        self.bytes_written = 0
+        self.failed = 0
+        self._started = time.perf_counter()
+
+    def add(self, path: str, content: str) -> None:
+        """ Holds a chunk until the writer is flushed. A chunk added again under the
+        same path replaces the earlier one, as it would overwrite its blob """
+        chunks = self._folders.setdefault(posixpath.dirname(path), OrderedDict())
+        chunks[path] = json.loads(content)
+
+    def flush(self) -> Dict[str, float]:
+        """ Writes the pack and the index of each folder and returns the writer's counts """
+        folders, self._folders = self._folders, OrderedDict()
+
+        def write_blob(blob_name, data):
+            try:
+                self.sink.write(blob_name, data)
+            except Exception:
+                self.failed += 1
+                raise
+            self.bytes_written += len(data)
+
+        for folder, chunks in folders.items():
+            write_pack(write_blob, folder, chunks.items())
+            self.chunks_written += len(chunks)
+        return self.stats()
+
+    def stats(self) -> Dict[str, float]:
+        """ Returns the number of chunks and bytes written so far """
+        return {
+            "chunks_written": self.chunks_written,
+            "bytes_written": self.bytes_written,
+            "failed": self.failed,
+            "seconds": time.perf_counter() - self._started
+        }
@@ -0,0 +1,101 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import os
+import threading
+from typing import TYPE_CHECKING, Callable, Dict, Hashable, Optional, TypeVar
+
+import requests
+from requests.adapters import HTTPAdapter
+from azure.core.pipeline.transport import RequestsTransport
+from azure.cosmos import CosmosClient
+from azure.search.documents import SearchClient
+from azure.storage.blob import BlobServiceClient
+
+if TYPE_CHECKING:
+    from azure.storage.queue import QueueClient
+
+# Process wide clients for Azure Storage, AI Search and Cosmos DB, and for plain HTTP
+# calls. Creating a client per call repeats the TLS handshake and, as each client
+# caches its own access token, a token request as well, so the clients are created on
+# first use and shared by every caller in the process. The SDK clients are thread safe,
+# and each gets its own connection pool of HTTP_CONNECTION_POOL_SIZE keep-alive
+# connections, sized for the concurrent workers of the enrichment app
+HTTP_CONNECTION_POOL_SIZE = int(os.environ.get("HTTP_CONNECTION_POOL_SIZE", "32"))
+
+T = TypeVar("T")
+
+_clients: Dict[Hashable, object] = {}
+_lock = threading.Lock()
+
+
+def _get_or_create(key: Hashable, factory: Callable[[], T]) -> T:
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = factory()
+                _clients[key] = client
+    return client
+
+
+def _new_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_CONNECTION_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _transport() -> RequestsTransport:
+    # the SDKs default to a pool of 10 connections, too few for the concurrent workers
+    return RequestsTransport(session=_new_session(), session_owner=True)
+
+
+def get_http_session() -> requests.Session:
+    """ Returns the pooled session for plain HTTP calls, such as downloads through a
+    SAS URL and calls to the Cognitive Services and enrichment REST APIs """
+    return _get_or_create(("http",), _new_session)
+
+
+def get_blob_service_client(account_url: str, credential) -> BlobServiceClient:
+    """ Returns the shared client for a storage account """
+    return _get_or_create(("blob", account_url, id(credential)),
+                          lambda: BlobServiceClient(account_url, credential=credential,
+                                                    transport=_transport()))
+
+
+def get_queue_client(account_url: str, queue_name: str, credential,
+                     message_encode_policy=None) -> "QueueClient":
+    """ Returns the shared client for a storage queue. Clients that encode messages
+    differently are kept apart """
+    # imported here, as the backend shares this module but has no queue dependency
+    from azure.storage.queue import QueueClient
+    policy_name = type(message_encode_policy).__name__ if message_encode_policy is not None else None
+    return _get_or_create(("queue", account_url, queue_name, id(credential), policy_name),
+                          lambda: QueueClient(account_url=account_url,
+                                              queue_name=queue_name,
+                                              credential=credential,
+                                              message_encode_policy=message_encode_policy,
+                                              transport=_transport()))
+
+
+def get_search_client(endpoint: str, index_name: str, credential,
+                      audience: Optional[str] = None) -> SearchClient:
+    """ Returns the shared client for a search index """
+    def create():
+        if audience:
+            return SearchClient(endpoint=endpoint, index_name=index_name, credential=credential,
+                                audience=audience, transport=_transport())
+        return SearchClient(endpoint=endpoint, index_name=index_name, credential=credential,
+                            transport=_transport())
+    return _get_or_create(("search", endpoint, index_name, id(credential), audience), create)
+
+
+def get_cosmos_client(url: str, credential, consistency_level: str = "Session") -> CosmosClient:
+    """ Returns the shared client for a Cosmos DB account """
+    return _get_or_create(("cosmos", url, id(credential), consistency_level),
+                          lambda: CosmosClient(url=url, credential=credential,
+                                               consistency_level=consistency_level,
+                                               transport=_transport()))
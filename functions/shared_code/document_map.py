@@ -0,0 +1,271 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import html
+from enum import IntEnum
+
+import numpy as np
+
+# The document map of a PDF is built from the content string of the Form Recognizer
+# result, as its paragraphs do not distinguish a table from a text paragraph. Every
+# character is classed by the table or paragraph span that covers it, tables first
+# and then paragraphs, with later spans overwriting earlier ones and a paragraph
+# skipped when its first character is already classed. Only the first and last
+# characters of a span start or end an element of the map, so the spans are painted
+# onto a one byte per character mask with slice assignments and the map is then
+# built from the start and end positions alone, rather than by visiting every character
+
+
+class ContentType(IntEnum):
+    """ Enum to define the types for various content chars returned from FR """
+    NOT_PROCESSED           = 0
+    TITLE_START             = 1
+    TITLE_CHAR              = 2
+    TITLE_END               = 3
+    SECTIONHEADING_START    = 4
+    SECTIONHEADING_CHAR     = 5
+    SECTIONHEADING_END      = 6
+    TEXT_START              = 7
+    TEXT_CHAR               = 8
+    TEXT_END                = 9
+    TABLE_START             = 10
+    TABLE_CHAR              = 11
+    TABLE_END               = 12
+
+
+# the start, char and end types a paragraph is painted with, by its role. Paragraphs
+# with other roles, such as page headers and footers, are left out of the map
+TEXT_TYPES = (ContentType.TEXT_START, ContentType.TEXT_CHAR, ContentType.TEXT_END)
+PARAGRAPH_TYPES = {
+    'title': (ContentType.TITLE_START, ContentType.TITLE_CHAR, ContentType.TITLE_END),
+    'sectionHeading': (ContentType.SECTIONHEADING_START, ContentType.SECTIONHEADING_CHAR,
+                       ContentType.SECTIONHEADING_END)
+}
+
+_START_TYPES = (ContentType.TITLE_START, ContentType.SECTIONHEADING_START,
+                ContentType.TEXT_START, ContentType.TABLE_START)
+_END_TYPES = (ContentType.TITLE_END, ContentType.SECTIONHEADING_END,
+              ContentType.TEXT_END, ContentType.TABLE_END)
+
+
+class RenderedTable:
+    """ The HTML of a Form Recognizer table, rendered a row at a time. The cells are
+    grouped by row in a single pass and each row is rendered once. The leading rows
+    with column headers make up the header, which is repeated at the top of each
+    chunk when a large table is split across chunks. Besides the HTML of the
+    document map, each row is also rendered as it appears in table chunks, with
+    quoted lower case attributes and without escaping quotes """
+
+    def __init__(self, rows_html, chunk_rows_html, header_row_count):
+        self.rows_html = rows_html
+        self.chunk_rows_html = chunk_rows_html
+        # the number of leading rows that are header rows
+        self.header_row_count = header_row_count
+
+    @classmethod
+    def from_table(cls, table):
+        """ Renders a table of the Form Recognizer result """
+        rows = [[] for _ in range(table["rowCount"])]
+        for cell in sorted(table["cells"], key=lambda cell: cell["columnIndex"]):
+            if 0 <= cell["rowIndex"] < table["rowCount"]:
+                rows[cell["rowIndex"]].append(cell)
+        rows_html = []
+        chunk_rows_html = []
+        header_row_count = 0
+        header_rows_only = True
+        for row_cells in rows:
+            is_row_a_header = False
+            row_html = "<tr>"
+            chunk_row_html = "<tr>"
+            for cell in row_cells:
+                tag = "td"
+                if 'kind' in cell:
+                    if (cell["kind"] == "columnHeader" or cell["kind"] == "rowHeader"):
+                        tag = "th"
+                    if (cell["kind"] == "columnHeader"):
+                        is_row_a_header = True
+                cell_spans = ""
+                chunk_cell_spans = ""
+                if 'columnSpan' in cell:
+                    if cell["columnSpan"] > 1:
+                        cell_spans += f" colSpan={cell['columnSpan']}"
+                        chunk_cell_spans += f' colspan="{cell["columnSpan"]}"'
+                if 'rowSpan' in cell:
+                    if cell["rowSpan"] > 1:
+                        cell_spans += f" rowSpan={cell['rowSpan']}"
+                        chunk_cell_spans += f' rowspan="{cell["rowSpan"]}"'
+                row_html += f"<{tag}{cell_spans}>{html.escape(cell['content'])}</{tag}>"
+                chunk_row_html += f"<{tag}{chunk_cell_spans}>{html.escape(cell['content'], quote=False)}</{tag}>"
+            rows_html.append(row_html + "</tr>")
+            chunk_rows_html.append(chunk_row_html + "</tr>")
+            header_rows_only = header_rows_only and is_row_a_header
+            if header_rows_only:
+                header_row_count += 1
+        return cls(rows_html, chunk_rows_html, header_row_count)
+
+    @property
+    def html(self) -> str:
+        """ The HTML of the table in the document map """
+        if not self.header_row_count:
+            return "<table>" + "".join(self.rows_html) + "</table>"
+        # the thead is left open when every row is a header row
+        closing = "</thead>" if self.header_row_count < len(self.rows_html) else ""
+        return ("<table><thead>" + "".join(self.rows_html[:self.header_row_count]) + closing
+                + "".join(self.rows_html[self.header_row_count:]) + "</table>")
+
+    @property
+    def header_html(self) -> str:
+        """ The header rows as they appear in table chunks, or an empty string when
+        the table has no header """
+        return "".join(self.chunk_rows_html[:self.header_row_count])
+
+    @property
+    def body_rows_html(self) -> list:
+        """ The rows after the header as they appear in table chunks """
+        return self.chunk_rows_html[self.header_row_count:]
+
+
+def table_to_html(table):
+    """ Function to take an output FR table json structure and convert to HTML """
+    return RenderedTable.from_table(table).html
+
+
+def table_interval(table):
+    """ Returns the first and last character of a table in the content. The end is
+    the end of the first span extended by the length of the later spans, less the
+    line break Form Recognizer counts in each """
+    start_char = table["spans"][0]["offset"]
+    end_char = start_char + table["spans"][0]["length"] - 1
+    for span in table["spans"][1:]:
+        start_char = min(start_char, span["offset"])
+        end_char += span["length"] - 1
+    return start_char, end_char
+
+
+def _paint(content_type, start_char, end_char, start_type, char_type, end_type):
+    content_type[start_char] = start_type
+    if end_char > start_char + 1:
+        content_type[start_char + 1:end_char] = char_type
+    content_type[end_char] = end_type
+
+
+def paragraph_types(paragraph):
+    """ Returns the start, char and end types a paragraph is painted with, or None if
+    it is left out of the map """
+    return PARAGRAPH_TYPES.get(paragraph['role']) if 'role' in paragraph else TEXT_TYPES
+
+
+def paragraph_span(paragraph):
+    """ Returns the first and last character of a paragraph in the content, its paint
+    types and its page, which is all the map needs of a paragraph """
+    start_char = paragraph["spans"][0]["offset"]
+    end_char = start_char + paragraph["spans"][0]["length"] - 1
+    return start_char, end_char, paragraph_types(paragraph), paragraph["boundingRegions"][0]["pageNumber"]
+
+
+class DocumentLayout:
+    """ The classes of the characters of a document, painted from the intervals of its
+    tables and paragraphs alone, in the order the Form Recognizer result lists them """
+
+    def __init__(self, content_length, table_intervals, paragraph_spans):
+        self.content_length = content_length
+        self.table_count = 0
+        self.content_type = np.zeros(content_length, dtype=np.int8)
+        # the table each table end belongs to, the last table painted winning
+        self.table_index = {}
+
+        for index, (start_char, end_char) in enumerate(table_intervals):
+            _paint(self.content_type, start_char, end_char,
+                   ContentType.TABLE_START, ContentType.TABLE_CHAR, ContentType.TABLE_END)
+            self.table_index[end_char if end_char >= 0 else end_char + content_length] = index
+            self.table_count += 1
+
+        # titles, section headings and regular content, skipping paragraphs that start
+        # inside a table or an earlier paragraph, such as the paragraphs of table cells
+        page_number_by_paragraph = {}
+        for start_char, end_char, types, page_number in paragraph_spans:
+            if self.content_type[start_char] == ContentType.NOT_PROCESSED:
+                if types is not None:
+                    _paint(self.content_type, start_char, end_char, *types)
+            page_number_by_paragraph[start_char] = page_number
+
+        # the page of an element is that of the last paragraph starting at or before its end
+        self.paragraph_starts = np.array(sorted(page_number_by_paragraph), dtype=np.int64)
+        self.paragraph_pages = [page_number_by_paragraph[start] for start in self.paragraph_starts.tolist()]
+
+    def table_at(self, end_char):
+        """ Returns the index of the table that ends at a character """
+        return self.table_index.get(end_char, self.table_count - 1)
+
+
+def iter_document_structure(content, layout, table_html):
+    """ Yields the text and table elements of a document, in content order, each
+    tagged with the title, subtitle, section and page it falls in. table_html is
+    called with the index of a table when its element is reached """
+    positions = np.flatnonzero(np.isin(layout.content_type, _START_TYPES + _END_TYPES))
+    types = layout.content_type[positions].tolist()
+    pages = np.searchsorted(layout.paragraph_starts, positions, side='right').tolist()
+    paragraph_pages = layout.paragraph_pages
+
+    main_title = ''
+    current_title = ''
+    current_section = ''
+    start_position = 0
+    for index, item, page_slot in zip(positions.tolist(), types, pages):
+        page_number = paragraph_pages[page_slot - 1] if page_slot else 0
+        if item in _START_TYPES:
+            start_position = index
+        elif item == ContentType.TITLE_END:
+            current_title = content[start_position:index+1]
+            # set the main title from any title elements on the first page concatenated
+            if main_title == '':
+                main_title = current_title
+            elif page_number == 1:
+                main_title = main_title + "; " + current_title
+        elif item == ContentType.SECTIONHEADING_END:
+            current_section = content[start_position:index+1]
+        else:
+            if item == ContentType.TEXT_END:
+                property_type = 'text'
+                output_text = content[start_position:index+1]
+            else:
+                # write out the table the content of which ends here as html
+                property_type = 'table'
+                output_text = table_html(layout.table_at(index))
+            yield {
+                'offset': start_position,
+                'text': output_text,
+                'type': property_type,
+                'title': main_title,
+                'subtitle': current_title,
+                'section': current_section,
+                'page_number': page_number
+            }
+
+
+def iter_page_windows(elements, window_pages):
+    """ Groups elements into lists that each cover up to window_pages pages, so that a
+    long document can be processed a window at a time """
+    window = []
+    window_start = None
+    for element in elements:
+        if window_start is None:
+            window_start = element['page_number']
+        elif element['page_number'] >= window_start + window_pages:
+            yield window
+            window = []
+            window_start = element['page_number']
+        window.append(element)
+    if window:
+        yield window
+
+
+def build_document_structure(result, table_to_html=table_to_html):
+    """ Builds the list of text and table elements of a Form Recognizer result, in
+    content order, each tagged with the title, subtitle, section and page it falls in """
+    tables = result["tables"]
+    layout = DocumentLayout(len(result["content"]),
+                            [table_interval(table) for table in tables],
+                            [paragraph_span(paragraph) for paragraph in result["paragraphs"]])
+    return list(iter_document_structure(result["content"], layout,
+                                        lambda index: table_to_html(tables[index])))
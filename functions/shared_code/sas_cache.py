@@ -0,0 +1,122 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Hashable, Tuple, Union
+
+from azure.storage.blob import BlobSasPermissions, BlobServiceClient, UserDelegationKey, generate_blob_sas
+
+# SAS URLs are signed with a user delegation key, and getting a key is a request to
+# the storage service, so a key is kept for each account until it is close to expiry
+# rather than requested for every SAS. The SAS of a blob is signed locally, but the
+# same chunks and files are signed over and over, so the SAS of each blob is kept
+# too and reused while it has more than SAS_REFRESH_MARGIN of its lifetime left. A
+# key is replaced while it still outlives any SAS signed with it
+USER_DELEGATION_KEY_LIFETIME = timedelta(hours=12)
+SAS_LIFETIME = timedelta(hours=1)
+SAS_REFRESH_MARGIN = timedelta(minutes=15)
+SAS_CACHE_SIZE = int(os.environ.get("SAS_CACHE_SIZE", "10000"))
+
+_caches: Dict[Hashable, "BlobSasCache"] = {}
+_caches_lock = threading.Lock()
+
+
+def _utcnow() -> datetime:
+    return datetime.utcnow()
+
+
+class UserDelegationKeyCache:
+    """ Holds the user delegation key of a storage account, requesting a new key
+    once the current one has less than refresh_margin left """
+
+    def __init__(self, blob_service_client: BlobServiceClient,
+                 lifetime: timedelta = USER_DELEGATION_KEY_LIFETIME,
+                 refresh_margin: timedelta = SAS_LIFETIME + SAS_REFRESH_MARGIN):
+        self.blob_service_client = blob_service_client
+        self.lifetime = lifetime
+        self.refresh_margin = refresh_margin
+        self._key = None
+        self._expiry = None
+        self._lock = threading.Lock()
+        self.requests = 0
+
+    def get(self) -> Tuple[UserDelegationKey, datetime]:
+        """ Returns a key that is valid for at least refresh_margin, with its expiry """
+        key, expiry = self._key, self._expiry
+        if key is None or expiry - _utcnow() <= self.refresh_margin:
+            with self._lock:
+                # another thread may have replaced the key while this one waited
+                if self._key is None or self._expiry - _utcnow() <= self.refresh_margin:
+                    start = _utcnow()
+                    expiry = start + self.lifetime
+                    self._key = self.blob_service_client.get_user_delegation_key(
+                        key_start_time=start, key_expiry_time=expiry)
+                    self._expiry = expiry
+                    self.requests += 1
+                key, expiry = self._key, self._expiry
+        return key, expiry
+
+
+class BlobSasCache:
+    """ Signs read SAS tokens for the blobs of a storage account, reusing the token of
+    a blob and permission while it has more than refresh_margin left. At most
+    max_entries tokens are kept, the least recently used are dropped first """
+
+    def __init__(self, blob_service_client: BlobServiceClient,
+                 sas_lifetime: timedelta = SAS_LIFETIME,
+                 refresh_margin: timedelta = SAS_REFRESH_MARGIN,
+                 max_entries: int = SAS_CACHE_SIZE):
+        self.account_name = blob_service_client.account_name
+        self.sas_lifetime = sas_lifetime
+        self.refresh_margin = refresh_margin
+        self.max_entries = max_entries
+        self.key_cache = UserDelegationKeyCache(blob_service_client,
+                                                refresh_margin=sas_lifetime + refresh_margin)
+        self._tokens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_sas(self, container_name: str, blob_name: str,
+                permission: Union[BlobSasPermissions, str] = "r") -> str:
+        """ Returns a SAS token for a blob that is valid for at least refresh_margin """
+        cache_key = (container_name, blob_name, str(permission))
+        now = _utcnow()
+        with self._lock:
+            entry = self._tokens.get(cache_key)
+            if entry is not None and entry[1] - now > self.refresh_margin:
+                self._tokens.move_to_end(cache_key)
+                return entry[0]
+        user_delegation_key, key_expiry = self.key_cache.get()
+        # a SAS signed with a user delegation key stops working when the key expires
+        expiry = min(now + self.sas_lifetime, key_expiry)
+        sas_token = generate_blob_sas(
+            account_name=self.account_name,
+            container_name=container_name,
+            blob_name=blob_name,
+            user_delegation_key=user_delegation_key,
+            permission=permission,
+            expiry=expiry
+        )
+        if self.max_entries > 0:
+            with self._lock:
+                self._tokens[cache_key] = (sas_token, expiry)
+                self._tokens.move_to_end(cache_key)
+                while len(self._tokens) > self.max_entries:
+                    self._tokens.popitem(last=False)
+        return sas_token
+
+
+def get_blob_sas_cache(blob_service_client: BlobServiceClient) -> BlobSasCache:
+    """ Returns the process wide SAS cache of a blob service client """
+    # the cache holds on to the client, so its id is not reused by another client
+    cache_key = id(blob_service_client)
+    cache = _caches.get(cache_key)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(cache_key)
+            if cache is None:
+                cache = BlobSasCache(blob_service_client)
+                _caches[cache_key] = cache
+    return cache
@@ -0,0 +1,192 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+from azure.core.exceptions import HttpResponseError
+from azure.search.documents import SearchClient
+
+# Azure AI Search rejects indexing requests over 16 MB or 1000 documents. Batches are
+# sized from the compact JSON of the documents, so leave headroom for the SDK's encoding
+DEFAULT_MAX_BATCH_BYTES = 8 * 1024 * 1024
+MAX_BATCH_DOCUMENTS = 1000
+
+# Per document status codes that the service documents as transient
+RETRYABLE_STATUS_CODES = {409, 422, 429, 503}
+
+
+class SearchIndexWriter:
+    """ Buffers documents for a search index and uploads them in batches sized by
+    their serialized bytes, with several batches in flight at once. Documents the
+    service fails to index with a transient status are retried by key with an
+    exponential backoff, and documents that still fail are reported by flush() """
+
+    def __init__(self,
+                 search_client: SearchClient,
+                 max_batch_bytes: int = DEFAULT_MAX_BATCH_BYTES,
+                 max_concurrency: int = 4,
+                 max_retries: int = 5,
+                 backoff_seconds: float = 1.0,
+                 key_field: str = "id",
+                 executor: ThreadPoolExecutor = None,
+                 on_batch: Callable[[float, int, int], None] = None):
+        self.search_client = search_client
+        self.max_batch_bytes = int(max_batch_bytes)
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.max_retries = int(max_retries)
+        self.backoff_seconds = float(backoff_seconds)
+        self.key_field = key_field
+        # called with the latency, document count and failure count of every upload attempt
+        self.on_batch = on_batch
+        # the executor may be shared by several writers, the in flight limit stays per writer
+        self._owns_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                                        thread_name_prefix="index-writer")
+        self._in_flight = threading.BoundedSemaphore(self.max_concurrency)
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._futures = []
+        self._failed = {}
+        self._batch_seconds = []
+        self.batches = 0
+        self.succeeded = 0
+        self.retries = 0
+        self.bytes_sent = 0
+
+    def add(self, document: Dict) -> None:
+        """ Buffers a document, sending the buffer as a batch once adding the
+        document would take it over the byte or document limit """
+        size = len(json.dumps(document, separators=(",", ":"), default=str).encode("utf-8"))
+        if self._buffer and (self._buffer_bytes + size > self.max_batch_bytes
+                             or len(self._buffer) >= MAX_BATCH_DOCUMENTS):
+            self._send_buffer()
+        self._buffer.append(document)
+        self._buffer_bytes += size
+
+    def add_many(self, documents: List[Dict]) -> None:
+        """ Buffers a list of documents """
+        for document in documents:
+            self.add(document)
+
+    def flush(self) -> Dict[str, str]:
+        """ Sends any buffered documents and waits for every batch to complete.
+        Returns the documents that could not be indexed, keyed by document key """
+        if self._buffer:
+            self._send_buffer()
+        futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+        with self._lock:
+            return dict(self._failed)
+
+    def close(self) -> Dict[str, str]:
+        """ Flushes the writer and shuts down its executor if it owns it """
+        failed = self.flush()
+        if self._owns_executor:
+            self._executor.shutdown(wait=True)
+        return failed
+
+    def stats(self):
+        """ Returns the document counts and batch latencies of the writer """
+        with self._lock:
+            latencies = sorted(self._batch_seconds)
+            return {
+                "batches": self.batches,
+                "succeeded": self.succeeded,
+                "failed": len(self._failed),
+                "retries": self.retries,
+                "bytes_sent": self.bytes_sent,
+                "p50_batch_seconds": _percentile(latencies, 0.50),
+                "p99_batch_seconds": _percentile(latencies, 0.99),
+                "max_batch_seconds": latencies[-1] if latencies else 0.0
+            }
+
+    def _send_buffer(self):
+        batch, batch_bytes = self._buffer, self._buffer_bytes
+        self._buffer, self._buffer_bytes = [], 0
+        # block the producer while max_concurrency batches are already in flight
+        self._in_flight.acquire()
+        try:
+            future = self._executor.submit(self._write_batch, batch, batch_bytes)
+        except Exception:
+            self._in_flight.release()
+            raise
+        future.add_done_callback(lambda _: self._in_flight.release())
+        self._futures.append(future)
+
+    def _write_batch(self, documents, batch_bytes):
+        pending = {document[self.key_field]: document for document in documents}
+        attempt = 0
+        while pending:
+            attempted = len(pending)
+            start = time.perf_counter()
+            errors = {}
+            try:
+                results = self.search_client.upload_documents(documents=list(pending.values()))
+            except HttpResponseError as error:
+                if error.status_code == 413 and len(pending) > 1:
+                    # the estimate was too low for this batch, split it and try each half
+                    items = list(pending.values())
+                    middle = len(items) // 2
+                    self._write_batch(items[:middle], batch_bytes // 2)
+                    self._write_batch(items[middle:], batch_bytes - batch_bytes // 2)
+                    return
+                retryable = error.status_code is None or error.status_code in RETRYABLE_STATUS_CODES \
+                    or error.status_code >= 500
+                errors = {key: (retryable, str(error)) for key in pending}
+                results = []
+            except Exception as error:
+                errors = {key: (True, str(error)) for key in pending}
+                results = []
+            seconds = time.perf_counter() - start
+
+            succeeded = 0
+            for result in results:
+                if result.succeeded:
+                    succeeded += 1
+                    pending.pop(result.key, None)
+                else:
+                    errors[result.key] = (result.status_code in RETRYABLE_STATUS_CODES,
+                                          f"{result.status_code}: {result.error_message}")
+            with self._lock:
+                self.batches += 1
+                self.succeeded += succeeded
+                if attempt == 0:
+                    self.bytes_sent += batch_bytes
+                self._batch_seconds.append(seconds)
+            logging.debug(f"Indexed batch of {attempted} documents "
+                          f"({batch_bytes} bytes) in {seconds:.2f}s, {len(errors)} failed")
+            if self.on_batch is not None:
+                self.on_batch(seconds, attempted, len(errors))
+
+            retry_keys = [key for key, (retryable, _) in errors.items() if retryable]
+            final_keys = [key for key, (retryable, _) in errors.items() if not retryable]
+            if attempt >= self.max_retries:
+                final_keys.extend(retry_keys)
+                retry_keys = []
+            with self._lock:
+                for key in final_keys:
+                    self._failed[key] = errors[key][1]
+            for key in final_keys:
+                pending.pop(key, None)
+            # only the documents that failed are sent again
+            pending = {key: pending[key] for key in retry_keys if key in pending}
+            if pending:
+                attempt += 1
+                with self._lock:
+                    self.retries += len(pending)
+                delay = self.backoff_seconds * (2 ** (attempt - 1))
+                time.sleep(delay + random.uniform(0, delay))
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
@@ -7,7 +7,8 @@ from datetime import datetime, timedelta
 import base64
 from enum import Enum
 import logging
-from azure.cosmos import CosmosClient, PartitionKey, exceptions
+from azure.cosmos import PartitionKey, exceptions
+from shared_code.clients import get_cosmos_client
 import traceback, sys
 
 class State(Enum):
@@ -44,7 +45,7 @@ class StatusLog:
         self.azure_credential = azure_credential
         self._database_name = database_name
         self._container_name = container_name
-        self.cosmos_client = CosmosClient(url=self._url, credential=self.azure_credential, consistency_level='Session')
+        self.cosmos_client = get_cosmos_client(self._url, self.azure_credential)
         self._log_document = {}
 
         # Select a database (will create it if it doesn't exist)
@@ -0,0 +1,79 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+from typing import List
+
+from bs4 import BeautifulSoup
+
+from shared_code.document_map import RenderedTable
+from shared_code.token_counter import count_tokens, count_tokens_batch
+
+
+def table_from_html(table_html: str) -> RenderedTable:
+    """ Splits the HTML of a table into its header and body rows, for a document map
+    that does not hold the rendered tables, such as one read back from storage """
+    soup = BeautifulSoup(table_html, 'html.parser')
+    rows = soup.find_all('tr')
+    header_rows = [str(row) for row in rows if row.parent.name == "thead"]
+    body_rows = [str(row) for row in rows if row.parent.name != "thead"]
+    chunk_rows_html = header_rows + body_rows
+    return RenderedTable(chunk_rows_html, chunk_rows_html, len(header_rows))
+
+
+def chunk_table(prefix_text: str, table: RenderedTable, standard_chunk_target_size: int,
+                carried_header: str = "") -> List[str]:
+    """ Splits a table that is larger than the chunk target into chunks of whole rows.
+    The first chunk continues prefix_text, the chunk in progress, and every later
+    chunk starts with the header rows. carried_header holds the header rows of an
+    earlier table that this table continues, such as a table split over pages, and
+    is put in front of the table's own header rows """
+    header = carried_header + table.header_html
+    thead = "<thead>" + header + "</thead>" if header else ""
+    rows = table.body_rows_html
+    chunks = []
+
+    def add_current_table_chunk(parts):
+        # Close the table tag for the current chunk and add it to the chunks list
+        chunk = "".join(parts)
+        if chunk.strip() and not chunk.endswith("<table>"):
+            chunks.append('<table>' + chunk + '</table>')
+
+    if not rows:
+        add_current_table_chunk([prefix_text])
+        return chunks
+
+    # A chunk that ends with a closing tag, as every chunk does after its first row,
+    # ends with a '>' that is encoded together with the '<' a row starts with, while
+    # the text before it is unaffected by the row. So the tokens a row adds to such a
+    # chunk are the same wherever it is added, and are counted once for every row
+    tag_end = count_tokens(">")
+    row_tokens = [count - tag_end for count in
+                  count_tokens_batch([">" + row for row in rows], memoize=False)]
+    thead_tokens = count_tokens(thead)
+
+    # set the target size of the first chunk
+    chunk_target_size = standard_chunk_target_size - count_tokens(prefix_text)
+    parts = [prefix_text]
+    chunk_tokens = 0
+    for i, row_html in enumerate(rows):
+        if i == 0:
+            tokens_with_row = count_tokens(prefix_text + row_html)
+        else:
+            tokens_with_row = chunk_tokens + row_tokens[i]
+
+        # If adding this row to the current chunk exceeds the target size, start a new chunk
+        # with the header
+        if tokens_with_row > chunk_target_size:
+            add_current_table_chunk(parts)
+            parts = [thead]
+            chunk_target_size = standard_chunk_target_size
+            chunk_tokens = thead_tokens + row_tokens[i] if thead else count_tokens(row_html)
+        else:
+            chunk_tokens = tokens_with_row
+
+        # Add the current row to the chunk
+        parts.append(row_html)
+
+    # Add the final chunk if there's any content left
+    add_current_table_chunk(parts)
+    return chunks
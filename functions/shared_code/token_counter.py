@@ -0,0 +1,180 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Tuple
+
+import regex
+import tiktoken
+
+# Token counting for the chunkers. The chunkers count the same paragraphs, rows and
+# sentences many times over, and often count a chunk again each time it grows by a
+# sentence or a row, so the encoders are loaded once per process, recent counts are
+# memoized and a growing text can be counted incrementally. For gpt-4, gpt-3.5-turbo
+# and text-embedding-ada-002 the encoding is cl100k_base
+DEFAULT_ENCODING = "cl100k_base"
+TOKEN_COUNT_MEMO_SIZE = int(os.environ.get("TOKEN_COUNT_MEMO_SIZE", "4096"))
+
+_encodings = {}
+_encodings_lock = threading.Lock()
+_memo = OrderedDict()
+_memo_lock = threading.Lock()
+
+
+def get_encoding(encoding_name: str = DEFAULT_ENCODING) -> tiktoken.Encoding:
+    """ Returns the process wide encoder for an encoding """
+    encoding = _encodings.get(encoding_name)
+    if encoding is None:
+        with _encodings_lock:
+            encoding = _encodings.get(encoding_name)
+            if encoding is None:
+                encoding = tiktoken.get_encoding(encoding_name)
+                _encodings[encoding_name] = encoding
+    return encoding
+
+
+def _memo_key(text: str, encoding_name: str):
+    # the hash of a str is computed once and kept on the object, and the memo holds
+    # the key rather than the text, so long texts are not kept alive by the memo
+    return (encoding_name, len(text), hash(text))
+
+
+def _memo_get(key):
+    with _memo_lock:
+        count = _memo.get(key)
+        if count is not None:
+            _memo.move_to_end(key)
+        return count
+
+
+def _memo_put(key, count: int):
+    if TOKEN_COUNT_MEMO_SIZE <= 0:
+        return
+    with _memo_lock:
+        _memo[key] = count
+        _memo.move_to_end(key)
+        while len(_memo) > TOKEN_COUNT_MEMO_SIZE:
+            _memo.popitem(last=False)
+
+
+def count_tokens(text: str, encoding_name: str = DEFAULT_ENCODING) -> int:
+    """ Returns the number of tokens in a text string """
+    key = _memo_key(text, encoding_name)
+    count = _memo_get(key)
+    if count is None:
+        count = len(get_encoding(encoding_name).encode_ordinary(text))
+        _memo_put(key, count)
+    return count
+
+
+def count_tokens_batch(texts: List[str], encoding_name: str = DEFAULT_ENCODING,
+                       memoize: bool = True) -> List[int]:
+    """ Returns the number of tokens in each of a list of strings, encoding those
+    not in the memo in a single batch. Counts of texts that will not be counted
+    again, such as the rows of a large table, are better left out of the memo """
+    if not memoize:
+        return [len(tokens) for tokens in get_encoding(encoding_name).encode_ordinary_batch(texts)]
+    keys = [_memo_key(text, encoding_name) for text in texts]
+    counts = [_memo_get(key) for key in keys]
+    missing = [i for i, count in enumerate(counts) if count is None]
+    if missing:
+        encoded = get_encoding(encoding_name).encode_ordinary_batch([texts[i] for i in missing])
+        for i, tokens in zip(missing, encoded):
+            counts[i] = len(tokens)
+            _memo_put(keys[i], counts[i])
+    return counts
+
+
+class RunningTokenCount:
+    """ Counts the tokens of a text that is built up by appending to it, without
+    encoding the whole text again after each append. The encoders split a text
+    into pieces, such as words and runs of whitespace or digits, with a regular
+    expression and encode each piece on its own, so appending to a text can only
+    change how its last pieces are split and encoded. Only those pieces, kept as
+    the tail, are encoded again together with the appended text """
+
+    # the number of trailing pieces an append can change. A run of whitespace at the
+    # end of a text is split in two, up to its last line break and the spaces after
+    # it, and becomes a single piece if a line break is appended
+    TAIL_PIECES = 2
+
+    def __init__(self, text: str = "", encoding_name: str = DEFAULT_ENCODING):
+        self._encoding = get_encoding(encoding_name)
+        self._pattern = regex.compile(self._encoding._pat_str)
+        self._count = 0
+        self._tail = ""
+        self._tail_count = 0
+        self._length = 0
+        # the last text counted by count_with and the count, so that appending
+        # it next does not encode it again
+        self._pending = None
+        if text:
+            self.append(text)
+
+    @property
+    def count(self) -> int:
+        """ The number of tokens in the text appended so far """
+        return self._count
+
+    @property
+    def text_length(self) -> int:
+        """ The number of characters appended so far """
+        return self._length
+
+    def count_with(self, text: str) -> int:
+        """ Returns the number of tokens the text would have with text appended,
+        without appending it """
+        count = self._count_with(text)
+        self._pending = (text, count)
+        return count
+
+    def append(self, text: str) -> int:
+        """ Appends text and returns the new number of tokens """
+        if not text:
+            return self._count
+        pending, self._pending = self._pending, None
+        # only a count left by count_with is reused, never one this method worked out itself
+        count = pending[1] if pending is not None and pending[0] is text else self._count_with(text)
+        tail = self._tail + text
+        starts = [match.start() for match in self._pattern.finditer(tail)]
+        if len(starts) > self.TAIL_PIECES:
+            # the pieces before the new tail are settled and counted for good
+            tail = tail[starts[-self.TAIL_PIECES]:]
+        self._tail = tail
+        self._tail_count = len(self._encoding.encode_ordinary(tail))
+        self._count = count
+        self._length += len(text)
+        return self._count
+
+    def _count_with(self, text: str) -> int:
+        if not text:
+            return self._count
+        return self._count - self._tail_count + len(self._encoding.encode_ordinary(self._tail + text))
+
+
+def pack_sentences(sentences: List[str], max_tokens: int, separator: str = " ",
+                   encoding_name: str = DEFAULT_ENCODING) -> List[Tuple[str, int]]:
+    """ Packs sentences, in order, into chunks of at most max_tokens tokens joined by
+    the separator, returning each chunk with its number of tokens. A chunk is closed
+    when the next sentence would take it over max_tokens, so a sentence longer than
+    max_tokens makes a chunk of its own, and if it is the first sentence it is
+    preceded by an empty chunk. Each sentence is encoded once together with the end
+    of the chunk it joins, and again only when it starts a new chunk """
+    chunks = []
+    # the chunk is kept as a list of parts, joined once it is closed
+    parts = []
+    counter = RunningTokenCount(encoding_name=encoding_name)
+    for sentence in sentences:
+        addition = separator + sentence if counter.text_length else sentence
+        if counter.count_with(addition) <= max_tokens:
+            counter.append(addition)
+            parts.append(addition)
+        else:
+            chunks.append(("".join(parts), counter.count))
+            parts = [sentence]
+            counter = RunningTokenCount(sentence, encoding_name)
+    if counter.text_length:
+        chunks.append(("".join(parts), counter.count))
+    return chunks
@@ -3,19 +3,24 @@
 
 import logging
 import json
-import html
 from datetime import datetime
 from enum import Enum
+from itertools import chain
+import tempfile
 import zipfile
 import os
-from azure.storage.blob import BlobServiceClient
+from shared_code.clients import get_blob_service_client
+from shared_code.chunk_writer import BlobChunkSink, ChunkPackWriter, ChunkWriter
+from shared_code.chunk_pack import CHUNK_LAYOUT, PACKED_LAYOUT
 from shared_code.utilities_helper import UtilitiesHelper
+from shared_code.document_map import RenderedTable, build_document_structure, table_to_html
+from shared_code.analyze_result import DOCUMENT_MAP_WINDOW_PAGES, iter_structure_windows
+from shared_code.token_counter import count_tokens, count_tokens_batch, pack_sentences
+from shared_code.table_chunker import chunk_table, table_from_html
 from nltk.tokenize import sent_tokenize
-import tiktoken
 import nltk
 # Try to download using nltk.download
 nltk.download('punkt')
-from bs4 import BeautifulSoup
 
 punkt_dir = os.path.join(nltk.data.path[0], 'tokenizers/punkt')
 
@@ -40,22 +45,6 @@ class ParagraphRoles(Enum):
     PAGE_FOOTER      = 6
     PAGE_NUMBER      = 7
 
-class ContentType(Enum):
-    """ Enum to define the types for various content chars returned from FR """
-    NOT_PROCESSED           = 0
-    TITLE_START             = 1
-    TITLE_CHAR              = 2
-    TITLE_END               = 3
-    SECTIONHEADING_START    = 4
-    SECTIONHEADING_CHAR     = 5
-    SECTIONHEADING_END      = 6
-    TEXT_START              = 7
-    TEXT_CHAR               = 8
-    TEXT_END                = 9
-    TABLE_START             = 10
-    TABLE_CHAR              = 11
-    TABLE_END               = 12
-
 class MediaType:
     """ Helper class for standard media values"""
     TEXT = "text"
@@ -70,13 +59,21 @@ class Utilities:
                  azure_blob_storage_endpoint,
                  azure_blob_drop_storage_container,
                  azure_blob_content_storage_container,
-                 azure_credential
+                 azure_credential,
+                 chunk_sink=None,
+                 chunk_layout=CHUNK_LAYOUT
                  ):
         self.azure_blob_storage_account = azure_blob_storage_account
         self.azure_blob_storage_endpoint = azure_blob_storage_endpoint
         self.azure_blob_drop_storage_container = azure_blob_drop_storage_container
         self.azure_blob_content_storage_container = azure_blob_content_storage_container
         self.azure_credential = azure_credential
+        # where chunks are written, the content container unless a sink such as a
+        # LocalChunkSink is given for offline runs
+        self.chunk_sink = chunk_sink
+        # "files" writes each chunk to its own blob, "packed" the chunks of a
+        # document to a single pack blob with an index
+        self.chunk_layout = chunk_layout
         self.utilities_helper = UtilitiesHelper(azure_blob_storage_account,
                                                 azure_blob_storage_endpoint,
                                                 azure_credential)
@@ -85,10 +82,8 @@ class Utilities:
         """ Function to write a generic blob """
         # folder_set should be in the format of "<my_folder_name>/"
         # Get path and file name minus the root container
-        blob_service_client = BlobServiceClient(
-            self.azure_blob_storage_endpoint,
-            credential=self.azure_credential
-            )
+        blob_service_client = get_blob_service_client(self.azure_blob_storage_endpoint,
+                                                      self.azure_credential)
         block_blob_client = blob_service_client.get_blob_client(
             container=output_container, blob=f'{folder_set}{output_filename}')
         block_blob_client.upload_blob(content, overwrite=True)
@@ -110,50 +105,7 @@ class Utilities:
 
     def table_to_html(self, table):
         """ Function to take an output FR table json structure and convert to HTML """
-        table_html = "<table>"
-        rows = [sorted([cell for cell in table["cells"] if cell["rowIndex"] == i],
-                       key=lambda cell: cell["columnIndex"]) for i in range(table["rowCount"])]
-        thead_open_added = False
-        thead_closed_added = False 
-
-        for i, row_cells in enumerate(rows):
-            is_row_a_header = False
-            row_html = "<tr>"
-            for cell in row_cells:
-                tag = "td"
-                if 'kind' in cell:                      
-                    if (cell["kind"] == "columnHeader" or cell["kind"] == "rowHeader"):
-                        tag = "th"
-                    if (cell["kind"] == "columnHeader"):
-                        is_row_a_header = True
-                cell_spans = ""
-                if 'columnSpan' in cell:
-                    if cell["columnSpan"] > 1:
-                        cell_spans += f" colSpan={cell['columnSpan']}"
-                if 'rowSpan' in cell:
-                    if cell["rowSpan"] > 1:
-                        cell_spans += f" rowSpan={cell['rowSpan']}"
-                row_html += f"<{tag}{cell_spans}>{html.escape(cell['content'])}</{tag}>"
-            row_html += "</tr>"
-            
-            # add the opening thead if this is the first row and the first header row encountered
-            if is_row_a_header and i == 0 and not thead_open_added:
-                row_html = "<thead>" + row_html 
-                thead_open_added = True 
-                            
-            # add the closing thead if we have added an opening thead and if this is not a header row
-            if not is_row_a_header and thead_open_added and not thead_closed_added:
-                row_html = "</thead>" + row_html                 
-                thead_closed_added = True
-                
-            table_html += row_html
-        table_html += "</table>"
-        return table_html
-
-
-
-
-
+        return table_to_html(table)
 
     def build_document_map_pdf(self, myblob_name, myblob_uri, result, azure_blob_log_storage_container, enable_dev_code):
         """ Function to build a json structure representing the paragraphs in a document, 
@@ -161,124 +113,22 @@ class Utilities:
         We construct this map from the Content key/value output of FR, because the paragraphs 
         value does not distinguish between a table and a text paragraph"""
 
+        # keep the rows of each table as rendered, so that large tables can be split
+        # into chunks without parsing their HTML again
+        rendered_tables = {}
+
+        def render_table(table):
+            rendered = RenderedTable.from_table(table)
+            table_html = rendered.html
+            rendered_tables[table_html] = rendered
+            return table_html
+
         document_map = {
             'file_name': myblob_name,
             'file_uri': myblob_uri,
             'content': result["content"],
-            "structure": [],
-            "content_type": [],
-            "table_index": []
+            "structure": build_document_structure(result, render_table)
         }
-        document_map['content_type'].extend([ContentType.NOT_PROCESSED] * len(result['content']))
-        document_map['table_index'].extend([-1] * len(result["content"]))
-
-        # update content_type array where spans are tables
-        for index, table in enumerate(result["tables"]):
-            # initialize start_char and end_char based on the first span
-            start_char = table["spans"][0]["offset"]
-            end_char = start_char + table["spans"][0]["length"] - 1
-            
-            # iterate over the remaining spans
-            for span in table["spans"][1:]:
-                span_start = span["offset"]
-                # update start_char to the minimum offset
-                start_char = min(start_char, span_start)
-                # update total_length by adding the length of the current span
-                end_char += span["length"] -1
-            
-            # update the content_type array
-            document_map['content_type'][start_char] = ContentType.TABLE_START
-            for i in range(start_char + 1, end_char):
-                document_map['content_type'][i] = ContentType.TABLE_CHAR
-            document_map['content_type'][end_char] = ContentType.TABLE_END
-            # tag the end point in content of a table with the index of which table this is
-            document_map['table_index'][end_char] = index
-
-
-        # update content_type array where spans are titles, section headings or regular content,
-        # BUT skip over the table paragraphs
-        for paragraph in result["paragraphs"]:
-            start_char = paragraph["spans"][0]["offset"]
-            end_char = start_char + paragraph["spans"][0]["length"] - 1
-
-            # if this span has already been identified as a non textual paragraph
-            # such as a table, then skip over it
-            if document_map['content_type'][start_char] == ContentType.NOT_PROCESSED:
-                #if not hasattr(paragraph, 'role'):
-                if 'role' not in paragraph:
-                    # no assigned role
-                    document_map['content_type'][start_char] = ContentType.TEXT_START
-                    for i in range(start_char+1, end_char):
-                        document_map['content_type'][i] = ContentType.TEXT_CHAR
-                    document_map['content_type'][end_char] = ContentType.TEXT_END
-
-                elif paragraph['role'] == 'title':
-                    document_map['content_type'][start_char] = ContentType.TITLE_START
-                    for i in range(start_char+1, end_char):
-                        document_map['content_type'][i] = ContentType.TITLE_CHAR
-                    document_map['content_type'][end_char] = ContentType.TITLE_END
-
-                elif paragraph['role'] == 'sectionHeading':
-                    document_map['content_type'][start_char] = ContentType.SECTIONHEADING_START
-                    for i in range(start_char+1, end_char):
-                        document_map['content_type'][i] = ContentType.SECTIONHEADING_CHAR
-                    document_map['content_type'][end_char] = ContentType.SECTIONHEADING_END
-
-        # store page number metadata by paragraph object
-        page_number_by_paragraph = {}
-        for _, paragraph in enumerate(result["paragraphs"]):
-            start_char = paragraph["spans"][0]["offset"]
-            page_number_by_paragraph[start_char] = paragraph["boundingRegions"][0]["pageNumber"]
-
-        # iterate through the content_type and build the document paragraph catalog of content
-        # tagging paragraphs with title and section
-        main_title = ''
-        current_title = ''
-        current_section = ''
-        start_position = 0
-        page_number = 0
-        for index, item in enumerate(document_map['content_type']):
-
-            # collect page number metadata
-            page_number = page_number_by_paragraph.get(index, page_number)
-
-            match item:
-                case ContentType.TITLE_START | ContentType.SECTIONHEADING_START | ContentType.TEXT_START | ContentType.TABLE_START:
-                    start_position = index
-                case ContentType.TITLE_END:
-                    current_title =  document_map['content'][start_position:index+1]
-                    # set the main title from any title elemnts on the first page concatenated
-                    if main_title == '':
-                        main_title = current_title
-                    elif page_number == 1:
-                        main_title = main_title + "; " + current_title
-                case ContentType.SECTIONHEADING_END:
-                    current_section = document_map['content'][start_position:index+1]
-                case ContentType.TEXT_END | ContentType.TABLE_END:
-                    if item == ContentType.TEXT_END:
-                        property_type = 'text'
-                        output_text = document_map['content'][start_position:index+1]
-                    elif item == ContentType.TABLE_END:
-                        # now we have reached the end of the table in the content dictionary,
-                        # write out the table text to the output json document map
-                        property_type = 'table'
-                        table_index = document_map['table_index'][index]
-                        table_json = result["tables"][table_index]
-                        output_text = self.table_to_html(table_json)
-                    else:
-                        property_type = 'unknown'
-                    document_map["structure"].append({
-                        'offset': start_position,
-                        'text': output_text,
-                        'type': property_type,
-                        'title': main_title,
-                        'subtitle': current_title,
-                        'section': current_section,
-                        'page_number': page_number
-                    })
-
-        del document_map['content_type']
-        del document_map['table_index']
 
         if enable_dev_code:
             # Output document map to log container
@@ -292,25 +142,96 @@ class Utilities:
             output_filename =  file_name + '_FR_Result' + file_extension + ".json"
             self.write_blob(azure_blob_log_storage_container, json_str, output_filename, file_directory)
 
+        document_map['rendered_tables'] = rendered_tables
+        return document_map
+
+    def build_document_map_pdf_stream(self, myblob_name, myblob_uri, result_file, azure_blob_log_storage_container,
+                                      enable_dev_code, window_pages=DOCUMENT_MAP_WINDOW_PAGES):
+        """ Function to build the document map of a PDF from an analyze response stored in
+        a file, as an AnalyzeResultFile. The structure is not built up front but given as
+        'structure_windows', an iterator over the paragraphs a window of pages at a time,
+        which build_chunks consumes as it goes, so that only a window of the document is
+        held in memory at once"""
+
+        # the rendered rows of each table, for chunking, are kept until its window is chunked
+        rendered_tables = {}
+
+        def render_table(table):
+            rendered = RenderedTable.from_table(table)
+            table_html = rendered.html
+            rendered_tables[table_html] = rendered
+            return table_html
+
+        content, structure_windows = iter_structure_windows(result_file, render_table, window_pages)
+        document_map = {
+            'file_name': myblob_name,
+            'file_uri': myblob_uri,
+            'content': content,
+            'structure_windows': structure_windows,
+            'rendered_tables': rendered_tables
+        }
+
+        if enable_dev_code:
+            file_name, file_extension, file_directory  = self.get_filename_and_extension(myblob_name)
+            # Output FR result to log container, as returned by the service
+            with tempfile.TemporaryFile() as result_copy:
+                result_file.copy_to(result_copy)
+                result_copy.seek(0)
+                output_filename =  file_name + '_FR_Result' + file_extension + ".json"
+                self.write_blob(azure_blob_log_storage_container, result_copy, output_filename, file_directory)
+            # Output document map to log container once every window has been chunked
+            output_filename =  file_name + "_Document_Map" + file_extension + ".json"
+            document_map['structure_windows'] = self.log_document_map_windows(
+                document_map, structure_windows, azure_blob_log_storage_container, output_filename, file_directory)
+
         return document_map
 
+    def log_document_map_windows(self, document_map, structure_windows, output_container, output_filename, folder_set):
+        """ Function to pass the windows of a document map through, writing the map to the
+        log container in the layout of json.dumps(document_map, indent=2) once they are done"""
+        with tempfile.TemporaryFile(mode="w+b") as map_file:
+            header = {key: document_map[key] for key in ('file_name', 'file_uri', 'content')}
+            map_file.write(json.dumps(header, indent=2)[:-2].encode("utf-8") + b',\n  "structure": [')
+            element_count = 0
+            for window in structure_windows:
+                for element in window:
+                    element_json = json.dumps(element, indent=2).replace("\n", "\n    ")
+                    map_file.write(("," if element_count else "").encode("utf-8")
+                                   + b"\n    " + element_json.encode("utf-8"))
+                    element_count += 1
+                yield window
+            map_file.write(b"\n  ]\n}" if element_count else b"]\n}")
+            map_file.seek(0)
+            self.write_blob(output_container, map_file, output_filename, folder_set)
+
     def num_tokens_from_string(self, string: str, encoding_name: str) -> int:
         """ Function to return the number of tokens in a text string"""
-        encoding = tiktoken.get_encoding(encoding_name)
-        num_tokens = len(encoding.encode(string))
-        return num_tokens
+        return count_tokens(string, encoding_name)
 
     def token_count(self, input_text):
         """ Function to return the number of tokens in a text string"""
-        # calc token count
-        # For gpt-4, gpt-3.5-turbo, text-embedding-ada-002, you need to use cl100k_base
-        encoding = "cl100k_base"
-        token_count = self.num_tokens_from_string(input_text, encoding)
-        return token_count
+        # For gpt-4, gpt-3.5-turbo, text-embedding-ada-002, the shared counter uses cl100k_base
+        return count_tokens(input_text)
+
+    def token_counts(self, input_texts):
+        """ Function to return the number of tokens in each of a list of text strings"""
+        return count_tokens_batch(input_texts)
+
+    def chunk_writer(self):
+        """ Function to return a writer that uploads chunks in the background, or
+        packs them when the packed chunk layout is used"""
+        sink = self.chunk_sink
+        if sink is None:
+            sink = BlobChunkSink(get_blob_service_client(self.azure_blob_storage_endpoint,
+                                                         self.azure_credential),
+                                 self.azure_blob_content_storage_container)
+        if self.chunk_layout == PACKED_LAYOUT:
+            return ChunkPackWriter(sink)
+        return ChunkWriter(sink)
 
     def write_chunk(self, myblob_name, myblob_uri, file_number, chunk_size, chunk_text, page_list, 
-                    section_name, title_name, subtitle_name, file_class):
-        """ Function to write a json chunk to blob"""
+                    section_name, title_name, subtitle_name, file_class, writer=None):
+        """ Function to write a json chunk to blob, or to queue it on a chunk writer"""
         chunk_output = {
             'file_name': myblob_name,
             'file_uri': myblob_uri,
@@ -325,72 +246,40 @@ class Utilities:
         }
         # Get path and file name minus the root container
         file_name, file_extension, file_directory = self.get_filename_and_extension(myblob_name)
-        blob_service_client = BlobServiceClient(
-            self.azure_blob_storage_endpoint,
-            credential=self.azure_credential)
         json_str = json.dumps(chunk_output, indent=2, ensure_ascii=False)
+        chunk_path = self.build_chunk_filepath(file_directory, file_name, file_extension, file_number)
+        if writer is not None:
+            writer.add(chunk_path, json_str)
+            return
+        if self.chunk_sink is not None:
+            self.chunk_sink.write(chunk_path, json_str.encode("utf-8"))
+            return
+        blob_service_client = get_blob_service_client(self.azure_blob_storage_endpoint,
+                                                      self.azure_credential)
         block_blob_client = blob_service_client.get_blob_client(
             container=self.azure_blob_content_storage_container,
-            blob=self.build_chunk_filepath(file_directory, file_name, file_extension, file_number))
+            blob=chunk_path)
         block_blob_client.upload_blob(json_str, overwrite=True)
 
+    def sized_paragraphs(self, structure_windows):
+        """ Function to yield each paragraph of the document map with its number of tokens,
+        counted in one batch per window, and whether it is the last paragraph"""
+        previous = None
+        for window in structure_windows:
+            paragraph_sizes = count_tokens_batch([paragraph_element["text"] for paragraph_element in window])
+            for paragraph_element, paragraph_size in zip(window, paragraph_sizes):
+                if previous is not None:
+                    yield previous + (False,)
+                previous = (paragraph_element, paragraph_size)
+        if previous is not None:
+            yield previous + (True,)
+
     def build_chunk_filepath (self, file_directory, file_name, file_extension, file_number):
         """ Get the folders and filename to use when creating the new file chunks """
         folder_set = file_directory + file_name + file_extension + "/"
         output_filename = file_name + f'-{file_number}' + '.json'
         return f'{folder_set}{output_filename}'
     
-    previous_table_header = ""
-    
-    def chunk_table_with_headers(self, prefix_text, table_html, standard_chunk_target_size, 
-                                 previous_paragraph_element_is_a_table):
-        soup = BeautifulSoup(table_html, 'html.parser')
-        thead = str(soup.find('thead'))
-          
-        # check if this table is a continuation of a table on a previous page. 
-        # If yes then apply the header row from the previous table
-        if previous_paragraph_element_is_a_table:
-            if thead != "":
-                # update thead to include the main table header
-                thead = thead.replace("<thead>", "<thead>"+self.previous_table_header)
-            
-            else:
-                # just use the previoud thead
-                thead = "<thead>"+self.previous_table_header+"</thead>"    
-
-        def add_current_table_chunk(chunk):
-            # Close the table tag for the current chunk and add it to the chunks list
-            if chunk.strip() and not chunk.endswith("<table>"):
-                chunk = '<table>' + chunk + '</table>'
-                chunks.append(chunk)
-                # Start a new chunk with header if it exists                
-        
-        # Initialize chunks list
-        chunks = []
-        current_chunk = prefix_text
-        # set the target size of the first chunk 
-        chunk_target_size = standard_chunk_target_size - self.token_count(prefix_text)
-        rows = soup.find_all('tr')
-        # Filter out rows that are part of thead block
-        filtered_rows = [row for row in rows if row.parent.name != "thead"] 
-               
-        for i, row in enumerate(filtered_rows):
-            row_html = str(row)
-
-            # If adding this row to the current chunk exceeds the target size, start a new chunk
-            if self.token_count(current_chunk + row_html) > chunk_target_size:
-                add_current_table_chunk(current_chunk)    
-                current_chunk = thead
-                chunk_target_size = standard_chunk_target_size                
-
-            # Add the current row to the chunk
-            current_chunk += row_html
-
-        # Add the final chunk if there's any content left
-        add_current_table_chunk(current_chunk)      
-
-        return chunks
-    
     def build_chunks(self, document_map, myblob_name, myblob_uri, chunk_target_size):
         """ Function to build chunk outputs based on the document map """
 
@@ -398,21 +287,38 @@ class Utilities:
         chunk_size = 0
         file_number = 0
         page_number = 0
-        previous_section_name = document_map['structure'][0]['section']
-        previous_title_name = document_map['structure'][0]["title"]
-        previous_subtitle_name = document_map['structure'][0]["subtitle"]
+        # the paragraphs of a streamed document map come a window of pages at a time
+        structure_windows = document_map.get('structure_windows')
+        if structure_windows is None:
+            structure_windows = [document_map['structure']]
+        paragraphs = self.sized_paragraphs(structure_windows)
+        first_paragraph = next(paragraphs, None)
+        if first_paragraph is None:
+            raise ValueError(f"The document map of {myblob_name} has no paragraphs to chunk")
+        previous_section_name = first_paragraph[0]['section']
+        previous_title_name = first_paragraph[0]["title"]
+        previous_subtitle_name = first_paragraph[0]["subtitle"]
         page_list = []
         chunk_count = 0
         previous_paragraph_element_is_a_table = False
+        # the header rows of the first table of a run of tables, such as a table split
+        # over pages, to apply to the tables that continue it
+        carried_table_header = ""
+        rendered_tables = document_map.get('rendered_tables', {})
+        # chunks are uploaded in the background while the next ones are built
+        writer = self.chunk_writer()
 
         # iterate over the paragraphs and build a chuck based on a section
         # and/or title of the document
-        for index, paragraph_element in enumerate(document_map['structure']):
-            paragraph_size = self.token_count(paragraph_element["text"])
+        for paragraph_element, paragraph_size, is_last_paragraph in chain([first_paragraph], paragraphs):
             paragraph_text = paragraph_element["text"]
             section_name = paragraph_element["section"]
             title_name = paragraph_element["title"]
             subtitle_name = paragraph_element["subtitle"]
+            table = None
+            if paragraph_element["type"] == "table":
+                # the rendered rows are only needed here, so release them with the window
+                table = rendered_tables.pop(paragraph_text, None) or table_from_html(paragraph_text)
 
             #if the collected tokens in the current in-memory chunk + the next paragraph
             # will be larger than the allowed chunk size prepare to write out the total chunk
@@ -428,10 +334,10 @@ class Utilities:
                     # our target chunk size                    
                     if paragraph_element["type"] == "table":
                         # table processing & splitting
-                        table_chunks = self.chunk_table_with_headers(chunk_text, 
-                                                                     paragraph_text, 
-                                                                     chunk_target_size,
-                                                                     previous_paragraph_element_is_a_table)
+                        table_chunks = chunk_table(chunk_text,
+                                                   table,
+                                                   chunk_target_size,
+                                                   carried_table_header if previous_paragraph_element_is_a_table else "")
                         
                         for i, table_chunk in enumerate(table_chunks):
                                                    
@@ -444,7 +350,7 @@ class Utilities:
                                                 self.token_count(table_chunk),
                                                 table_chunk, page_list,
                                                 previous_section_name, previous_title_name, previous_subtitle_name, 
-                                                MediaType.TEXT)
+                                                MediaType.TEXT, writer=writer)
                                 chunk_count += 1      
                             else:
                                 # Reset the paragraph token count to just the tokens left in the last
@@ -459,38 +365,29 @@ class Utilities:
                         # text processing & splitting
                         # start by keeping the existing in-memory chunk in front of the large paragraph
                         # and begin to process it on sentence boundaries to break it down into
-                        # sub-chunks that are below the CHUNK_TARGET_SIZE
+                        # sub-chunks that are below the CHUNK_TARGET_SIZE, in a single pass that
+                        # counts each sentence as it joins a sub-chunk rather than the whole sub-chunk
                         sentences = sent_tokenize(chunk_text + paragraph_text)
-                        chunks = []
-                        chunk = ""
-                        for sentence in sentences:
-                            temp_chunk = chunk + " " + sentence if chunk else sentence
-                            if self.token_count(temp_chunk) <= chunk_target_size:
-                                chunk = temp_chunk
-                            else:
-                                chunks.append(chunk)
-                                chunk = sentence
-                        if chunk:
-                            chunks.append(chunk)
+                        chunks = pack_sentences(sentences, chunk_target_size)
 
                         # Now write out each chunk, apart from the last, as this will be less than or
                         # equal to CHUNK_TARGET_SIZE the last chunk will be processed like
                         # a regular paragraph
-                        for i, chunk_text_p in enumerate(chunks):
+                        for i, (chunk_text_p, chunk_size_p) in enumerate(chunks):
                             if i < len(chunks) - 1:
                                 # Process all but the last chunk in this large para
                                 self.write_chunk(myblob_name, myblob_uri,
                                                 f"{file_number}.{i}",
-                                                self.token_count(chunk_text_p),
+                                                chunk_size_p,
                                                 chunk_text_p, page_list,
                                                 previous_section_name, previous_title_name, previous_subtitle_name, 
-                                                MediaType.TEXT)
+                                                MediaType.TEXT, writer=writer)
                                 chunk_count += 1
                             else:
                                 # Reset the paragraph token count to just the tokens left in the last
                                 # chunk and leave the remaining text from the large paragraph to be
                                 # combined with the next in the outer loop
-                                paragraph_size = self.token_count(chunk_text_p)
+                                paragraph_size = chunk_size_p
                                 paragraph_text = chunk_text_p
                                 chunk_text = ''
                                 file_number += 1
@@ -500,7 +397,7 @@ class Utilities:
                     self.write_chunk(myblob_name, myblob_uri, file_number,
                                      chunk_size, chunk_text, page_list,
                                      previous_section_name, previous_title_name, previous_subtitle_name,
-                                     MediaType.TEXT)
+                                     MediaType.TEXT, writer=writer)
                     chunk_count += 1
 
                     # reset chunk specific variables
@@ -524,27 +421,27 @@ class Utilities:
 
             if paragraph_element["type"] == "table":
                 previous_paragraph_element_is_a_table = True
-                if self.previous_table_header == "":
+                if carried_table_header == "":
                     # Stash the current tables heading to apply to subsequent page tables if they are missing column headings,
                     # but only for the first page of the multi-page table
-                    soup = BeautifulSoup(paragraph_text, 'html.parser')
-                    # Extract the thead and strip the thead wrapper to just leave the header cells
-                    self.previous_table_header = str(soup.find('thead'))
-                    self.previous_table_header = self.previous_table_header.replace("<thead>", "").replace("</thead>", "")
+                    carried_table_header = table.header_html
             else:
                 previous_paragraph_element_is_a_table = False
-                self.previous_table_header = ""
+                carried_table_header = ""
             
             # If this is the last paragraph then write the chunk
-            if index == len(document_map['structure'])-1:
+            if is_last_paragraph:
                 self.write_chunk(myblob_name, myblob_uri, file_number, chunk_size,
                                  chunk_text, page_list, section_name, title_name, previous_subtitle_name,
-                                 MediaType.TEXT)
+                                 MediaType.TEXT, writer=writer)
                 chunk_count += 1
 
             previous_section_name = section_name
             previous_title_name = title_name
             previous_subtitle_name = subtitle_name
 
-        logging.info("Chunking is complete \n")
+        # wait for the chunks still being uploaded
+        write_stats = writer.flush()
+        logging.info(f"Chunking is complete, {write_stats['chunks_written']} chunks "
+                     f"({write_stats['bytes_written']} bytes) written in {write_stats['seconds']:.2f}s \n")
         return chunk_count
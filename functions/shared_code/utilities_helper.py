@@ -4,8 +4,9 @@
 import os
 import logging
 import urllib.parse
-from datetime import datetime, timedelta
-from azure.storage.blob import generate_blob_sas, BlobSasPermissions, BlobServiceClient
+from azure.storage.blob import BlobSasPermissions
+from shared_code.clients import get_blob_service_client
+from shared_code.sas_cache import get_blob_sas_cache
 
 class UtilitiesHelper:
     """ Helper class for utility functions"""
@@ -16,7 +17,7 @@ class UtilitiesHelper:
                  ):
         self.azure_blob_storage_account = azure_blob_storage_account
         self.azure_blob_storage_endpoint = azure_blob_storage_endpoint
-        self.blob_service_client = BlobServiceClient(azure_blob_storage_endpoint, credential=credential)
+        self.blob_service_client = get_blob_service_client(azure_blob_storage_endpoint, credential)
         
     def get_filename_and_extension(self, path):
             """ Function to return the file name & type"""
@@ -40,17 +41,11 @@ class UtilitiesHelper:
         container_name = separator.join(
             blob_path.split(separator)[0:1])
 
-        # Obtain the user delegation key
-        user_delegation_key = self.blob_service_client.get_user_delegation_key(key_start_time=datetime.utcnow(), key_expiry_time=datetime.utcnow() + timedelta(hours=12))
-
-        # Gen SAS token
-        sas_token = generate_blob_sas(
-            account_name=self.azure_blob_storage_account,
-            container_name=container_name,
-            blob_name=file_path_w_name_no_cont,
-            user_delegation_key=user_delegation_key,
-            permission=BlobSasPermissions(read=True),
-            expiry=datetime.utcnow() + timedelta(hours=1)
+        # Gen SAS token, reusing the delegation key and any unexpired token of the blob
+        sas_token = get_blob_sas_cache(self.blob_service_client).get_sas(
+            container_name,
+            file_path_w_name_no_cont,
+            BlobSasPermissions(read=True)
         )
         blob_path = urllib.parse.quote(blob_path)
         source_blob_path = f'{self.azure_blob_storage_endpoint}{blob_path}?{sas_token}'
@@ -0,0 +1,242 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import io
+import logging
+import threading
+from typing import Optional
+
+import numpy as np
+
+# Vectors sent to the search index can be compressed to cut the memory and storage of
+# the vector index. The dimension can be reduced, either by keeping the leading
+# dimensions, which suits Matryoshka trained models such as text-embedding-3, or by
+# projecting onto the principal components of a corpus sample, which suits any model.
+# The reduced vectors can then be scalar quantized to int8 with a scale and offset per
+# dimension, calibrated on the same sample. The calibration is stored as an .npz blob
+# next to the chunks, named after the index it applies to, and the same transform is
+# applied to query vectors so that they can be compared with the stored vectors
+COMPRESSION_MODES = ("none", "int8")
+REDUCTION_METHODS = ("truncate", "pca")
+CALIBRATION_FOLDER = "vector-compression"
+_FORMAT_VERSION = 1
+
+
+def calibration_blob_name(index_name: str) -> str:
+    """ Returns the name of the blob holding the calibration for a search index """
+    return f"{CALIBRATION_FOLDER}/{index_name}.npz"
+
+
+def field_type_for(mode: str) -> str:
+    """ Returns the search index type of a vector field storing vectors of a compression mode """
+    return "Collection(Edm.SByte)" if mode == "int8" else "Collection(Edm.Single)"
+
+
+def check_calibration(compressor: Optional["VectorCompressor"], index_name: str,
+                      mode: str, dimensions: int) -> None:
+    """ Raises a ValueError when the calibration of an index, or its absence, does not
+    match the vector field the index was deployed with, EMBEDDING_COMPRESSION_MODE and
+    EMBEDDING_COMPRESSION_DIMENSIONS, as the index rejects vectors of another type or size """
+    if mode not in COMPRESSION_MODES:
+        raise ValueError(f"Unsupported vector compression mode {mode}")
+    dimensions = int(dimensions or 0)
+    field = field_type_for(mode) + (f" of {dimensions} dimensions" if dimensions else "")
+    if compressor is None:
+        if mode != "none" or dimensions:
+            raise ValueError(f"The contentVector field of {index_name} is {field}, but no calibration exists "
+                             f"at {calibration_blob_name(index_name)}. Run scripts/vector-compression.py "
+                             f"calibrate --index {index_name} before indexing content")
+        return
+    matches_dimensions = compressor.output_dimensions == dimensions if dimensions else not compressor.dimensions
+    if compressor.field_type != field_type_for(mode) or not matches_dimensions:
+        if mode == "none" and not dimensions:
+            remedy = f"Delete {calibration_blob_name(index_name)}"
+        else:
+            remedy = (f"Run scripts/vector-compression.py calibrate --index {index_name} again with "
+                      f"--mode {mode} --dimensions {dimensions}")
+        raise ValueError(f"The calibration of {index_name} produces {compressor.field_type} vectors of "
+                         f"{compressor.output_dimensions} dimensions, but the contentVector field is {field}. "
+                         f"{remedy}")
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class VectorCompressor:
+    """ Reduces and quantizes embeddings before they are indexed, and transforms query
+    embeddings to match. Vectors are normalized, after any reduction, so cosine
+    similarity still applies. Quantized vectors are stored as int8 codes c,
+    approximating a reduced vector v as c * scale + offset, and are searched with
+    the dot product: for a query q, q . v = (q * scale) . c + q . offset, where the
+    last term is the same for every document, so ranking the codes by
+    (q * scale) . c ranks the documents by q . v """
+
+    def __init__(self, mode: str = "none", dimensions: int = 0, method: str = "truncate",
+                 source_dimensions: int = 0, model: str = "",
+                 mean: Optional[np.ndarray] = None, components: Optional[np.ndarray] = None,
+                 scale: Optional[np.ndarray] = None, offset: Optional[np.ndarray] = None):
+        if mode not in COMPRESSION_MODES:
+            raise ValueError(f"Unsupported vector compression mode {mode}")
+        if method not in REDUCTION_METHODS:
+            raise ValueError(f"Unsupported dimension reduction method {method}")
+        self.mode = mode
+        self.dimensions = int(dimensions)
+        self.method = method
+        self.source_dimensions = int(source_dimensions)
+        self.model = model
+        self.mean = mean
+        self.components = components
+        self.scale = scale
+        self.offset = offset
+
+    @property
+    def output_dimensions(self) -> int:
+        """ The dimension of the vectors sent to the index """
+        return self.dimensions or self.source_dimensions
+
+    @property
+    def field_type(self) -> str:
+        """ The search index type of the vector field the compressed vectors are stored in """
+        return field_type_for(self.mode)
+
+    @property
+    def metric(self) -> str:
+        """ The similarity metric the vector field should be searched with """
+        return "dotProduct" if self.mode == "int8" else "cosine"
+
+    @classmethod
+    def fit(cls, sample, mode: str, dimensions: int = 0, method: str = "truncate",
+            clip_percentile: float = 0.1, model: str = "") -> "VectorCompressor":
+        """ Calibrates a compressor on a sample of full size vectors from the corpus.
+        The int8 range of each dimension covers the values between clip_percentile
+        and 100 - clip_percentile, so a few outliers do not cost the others precision """
+        sample = np.atleast_2d(np.asarray(sample, dtype=np.float32))
+        source_dimensions = sample.shape[1]
+        dimensions = int(dimensions)
+        if dimensions >= source_dimensions:
+            dimensions = 0
+        compressor = cls(mode, dimensions, method, source_dimensions, model)
+        if dimensions and method == "pca":
+            mean = sample.mean(axis=0)
+            # the right singular vectors are the principal axes, strongest first
+            _, _, vt = np.linalg.svd(sample - mean, full_matrices=False)
+            compressor.mean = mean.astype(np.float32)
+            compressor.components = vt[:dimensions].astype(np.float32)
+        if mode == "int8":
+            reduced = compressor.reduce(sample)
+            low = np.percentile(reduced, clip_percentile, axis=0)
+            high = np.percentile(reduced, 100 - clip_percentile, axis=0)
+            scale = np.maximum(high - low, 1e-6) / 255
+            compressor.scale = scale.astype(np.float32)
+            compressor.offset = (low + 128 * scale).astype(np.float32)
+        return compressor
+
+    def reduce(self, vectors) -> np.ndarray:
+        """ Applies the dimension reduction, returning float32 rows of unit length so
+        that the dot product of the rows is the cosine similarity of the vectors """
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        if self.source_dimensions and vectors.shape[1] != self.source_dimensions:
+            raise ValueError(f"Expected vectors of dimension {self.source_dimensions}, "
+                             f"got {vectors.shape[1]}")
+        if not self.dimensions:
+            return _normalize(vectors)
+        if self.components is not None:
+            return _normalize((vectors - self.mean) @ self.components.T)
+        return _normalize(vectors[:, :self.dimensions])
+
+    def compress(self, vectors) -> np.ndarray:
+        """ Returns the vectors to index, as int8 codes or reduced float32 rows """
+        reduced = self.reduce(vectors)
+        if self.mode != "int8":
+            return reduced
+        codes = np.rint((reduced - self.offset) / self.scale)
+        return np.clip(codes, -128, 127).astype(np.int8)
+
+    def decompress(self, codes) -> np.ndarray:
+        """ Returns the reduced vectors that compressed codes approximate """
+        codes = np.atleast_2d(np.asarray(codes))
+        if self.mode != "int8":
+            return codes.astype(np.float32)
+        return codes.astype(np.float32) * self.scale + self.offset
+
+    def compress_document_vector(self, vector) -> list:
+        """ Compresses a single embedding for an index document """
+        return self.compress(vector)[0].tolist()
+
+    def transform_query(self, vector) -> list:
+        """ Transforms a query embedding so it can be searched against the compressed
+        vectors. For int8 the query is weighted by the scale of each dimension and
+        quantized too, as the index expects query vectors of the field's type, which
+        scales every score by the same factor and so keeps the ranking """
+        reduced = self.reduce(vector)[0]
+        if self.mode != "int8":
+            return reduced.tolist()
+        weighted = reduced * self.scale
+        peak = float(np.max(np.abs(weighted))) or 1.0
+        return np.rint(weighted * (127 / peak)).astype(np.int8).tolist()
+
+    def to_bytes(self) -> bytes:
+        """ Serializes the calibration as an .npz file """
+        arrays = {"version": np.array(_FORMAT_VERSION),
+                  "mode": np.array(self.mode),
+                  "dimensions": np.array(self.dimensions),
+                  "method": np.array(self.method),
+                  "source_dimensions": np.array(self.source_dimensions),
+                  "model": np.array(self.model)}
+        for name in ("mean", "components", "scale", "offset"):
+            if getattr(self, name) is not None:
+                arrays[name] = getattr(self, name)
+        buffer = io.BytesIO()
+        np.savez(buffer, **arrays)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "VectorCompressor":
+        """ Loads a calibration written by to_bytes """
+        with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+            if int(arrays["version"]) != _FORMAT_VERSION:
+                raise ValueError(f"Unsupported vector compression calibration version {int(arrays['version'])}")
+            return cls(str(arrays["mode"]), int(arrays["dimensions"]), str(arrays["method"]),
+                       int(arrays["source_dimensions"]), str(arrays["model"]),
+                       **{name: arrays[name] for name in ("mean", "components", "scale", "offset")
+                          if name in arrays.files})
+
+
+class IndexCalibration:
+    """ The compression calibrated for a search index, read from the content container
+    on first use. When mode and dimensions, the compression the index was deployed
+    with, are given, get raises rather than return a calibration, or no calibration,
+    that does not match them. Only a matching calibration is kept, so calibrating an
+    index takes effect without a restart, while recalibrating one already in use
+    needs the service to be restarted """
+
+    def __init__(self, container_client, index_name: str,
+                 mode: Optional[str] = None, dimensions: int = 0):
+        self.blob_client = container_client.get_blob_client(calibration_blob_name(index_name))
+        self.index_name = index_name
+        self.mode = mode
+        self.dimensions = int(dimensions or 0)
+        self._compressor = None
+        # an index deployed without compression needs no calibration, so none is read again
+        self._uncompressed = False
+        self._lock = threading.Lock()
+
+    def get(self) -> Optional[VectorCompressor]:
+        """ Returns the compressor for the index, or None when it stores full vectors """
+        if self._compressor is not None or self._uncompressed:
+            return self._compressor
+        with self._lock:
+            if self._compressor is None and not self._uncompressed:
+                compressor = None
+                if self.blob_client.exists():
+                    compressor = VectorCompressor.from_bytes(self.blob_client.download_blob().readall())
+                if self.mode is not None:
+                    check_calibration(compressor, self.index_name, self.mode, self.dimensions)
+                    self._uncompressed = compressor is None
+                if compressor is not None:
+                    logging.info(f"Search index {self.index_name} stores {compressor.mode} vectors "
+                                 f"of {compressor.output_dimensions} dimensions")
+                self._compressor = compressor
+            return self._compressor
@@ -0,0 +1,102 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import os
+import struct
+from typing import Callable, NamedTuple, Optional
+
+import numpy as np
+
+# Embeddings are stored next to their chunk as "<chunk name>.vec" rather than as a
+# JSON list of floats inside the chunk. The file is a fixed little-endian header
+#   magic "IAVC" | version u8 | dtype u8 | model name length u16 | dimension u32 | count u32
+# followed by the UTF-8 model name, padding to an 8 byte boundary and then count rows
+# of dimension little-endian floats
+CHUNK_EXTENSION = ".json"
+SIDECAR_EXTENSION = ".vec"
+SIDECAR_MAGIC = b"IAVC"
+SIDECAR_VERSION = 1
+
+_HEADER = struct.Struct("<4sBBHII")
+_DTYPE_CODES = {"float32": 1, "float16": 2}
+_NUMPY_DTYPES = {1: np.dtype("<f4"), 2: np.dtype("<f2")}
+
+
+class VectorSidecar(NamedTuple):
+    """ The decoded contents of a vector sidecar """
+    model: str
+    dimension: int
+    dtype: str
+    vectors: np.ndarray
+
+
+def is_chunk_blob(blob_name: str) -> bool:
+    """ Returns True for chunk JSON blobs, as opposed to their vector sidecars """
+    return blob_name.endswith(CHUNK_EXTENSION)
+
+
+def sidecar_name(chunk_name: str) -> str:
+    """ Returns the name of the vector sidecar blob for a chunk blob """
+    return os.path.splitext(chunk_name)[0] + SIDECAR_EXTENSION
+
+
+def encode_vectors(vectors, model: str, dtype: str = "float32") -> bytes:
+    """ Serializes one or more vectors of the same dimension, embedded with the
+    given model, into the sidecar format """
+    if dtype not in _DTYPE_CODES:
+        raise ValueError(f"Unsupported vector sidecar dtype {dtype}")
+    code = _DTYPE_CODES[dtype]
+    rows = np.atleast_2d(np.asarray(vectors, dtype=_NUMPY_DTYPES[code]))
+    model_bytes = model.encode("utf-8")
+    header = _HEADER.pack(SIDECAR_MAGIC, SIDECAR_VERSION, code, len(model_bytes),
+                          rows.shape[1], rows.shape[0]) + model_bytes
+    padding = b"\0" * (-len(header) % 8)
+    return header + padding + rows.tobytes()
+
+
+def decode_vectors(data: bytes) -> VectorSidecar:
+    """ Parses a sidecar. The vectors are a read only view over data, not a copy """
+    magic, version, code, model_length, dimension, count = _HEADER.unpack_from(data, 0)
+    if magic != SIDECAR_MAGIC:
+        raise ValueError("Not a vector sidecar")
+    if version != SIDECAR_VERSION or code not in _NUMPY_DTYPES:
+        raise ValueError(f"Unsupported vector sidecar version {version} with dtype {code}")
+    model = bytes(data[_HEADER.size:_HEADER.size + model_length]).decode("utf-8")
+    offset = _HEADER.size + model_length
+    offset += -offset % 8
+    vectors = np.frombuffer(data, dtype=_NUMPY_DTYPES[code], count=count * dimension, offset=offset)
+    return VectorSidecar(model, dimension, _NUMPY_DTYPES[code].name, vectors.reshape(count, dimension))
+
+
+def sidecar_reference(chunk_name: str, model: str, dimension: int, dtype: str) -> dict:
+    """ Returns the contentVectorRef entry that points a chunk at its sidecar """
+    return {
+        "blob": sidecar_name(chunk_name),
+        "model": model,
+        "dimension": dimension,
+        "dtype": dtype
+    }
+
+
+def sidecar_row_reference(sidecar_blob: str, row: int, model: str, dimension: int, dtype: str) -> dict:
+    """ Returns the contentVectorRef entry that points a chunk at its row of a sidecar
+    holding the vectors of every chunk of a document, as written for packed chunks """
+    return {
+        "blob": sidecar_blob,
+        "row": row,
+        "model": model,
+        "dimension": dimension,
+        "dtype": dtype
+    }
+
+
+def read_chunk_vector(chunk_dict: dict, read_blob: Callable[[str], bytes]) -> Optional[np.ndarray]:
+    """ Returns the embedding of a chunk, loading it from the sidecar referenced by
+    contentVectorRef through read_blob, or from an inline contentVector list as
+    written by earlier versions. Returns None if the chunk has not been embedded """
+    reference = chunk_dict.get("contentVectorRef")
+    if reference is not None:
+        return decode_vectors(read_blob(reference["blob"])).vectors[reference.get("row", 0)]
+    if "contentVector" in chunk_dict:
+        return np.asarray(chunk_dict["contentVector"], dtype=np.float32)
+    return None
@@ -154,6 +154,9 @@ resource "azurerm_linux_function_app" "function_app" {
     BLOB_STORAGE_ACCOUNT_LOG_CONTAINER_NAME     = var.blobStorageAccountLogContainerName
     AZURE_QUEUE_STORAGE_ENDPOINT                = var.queueStorageAccountEndpoint
     CHUNK_TARGET_SIZE                           = var.chunkTargetSize
+    CHUNK_WRITE_CONCURRENCY                     = 8
+    CHUNK_LAYOUT                                = "files"
+    DOCUMENT_MAP_WINDOW_PAGES                   = 50
     TARGET_PAGES                                = var.targetPages
     FR_API_VERSION                              = var.formRecognizerApiVersion
     AZURE_FORM_RECOGNIZER_ENDPOINT              = var.formRecognizerEndpoint
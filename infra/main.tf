@@ -304,6 +304,40 @@ module "enrichmentApp" {
     EMBEDDINGS_QUEUE                        = var.embeddingsQueue
     LOG_LEVEL                               = "DEBUG"
     DEQUEUE_MESSAGE_BATCH_SIZE              = 1
+    MAX_EMBEDDING_BATCH_SIZE                = 32
+    EMBEDDING_MICRO_BATCH_MAX_SIZE          = 32
+    EMBEDDING_MICRO_BATCH_WAIT_MS           = 5
+    EMBEDDING_CACHE_PATH                    = "/tmp/cache/embeddings.db"
+    EMBEDDING_CACHE_MAX_ENTRIES             = 200000
+    EMBEDDING_CACHE_SNAPSHOT_PATH           = "/home/cache/embeddings.db"
+    EMBEDDING_CACHE_SNAPSHOT_MINUTES        = 15
+    CHUNK_IO_CONCURRENCY                    = 8
+    EMBEDDING_PIPELINE_QUEUE_SIZE           = 2
+    EMBEDDING_MESSAGE_WORKERS               = 3
+    EMBEDDING_MESSAGE_LEASE_SECONDS         = 300
+    EMBEDDING_INFERENCE_PROCESSES           = 0
+    EMBEDDING_INFERENCE_THREADS_PER_PROCESS = 0
+    SEARCH_INDEX_MAX_BATCH_BYTES            = 8388608
+    SEARCH_INDEX_WRITE_CONCURRENCY          = 4
+    SEARCH_INDEX_MAX_RETRIES                = 5
+    EMBEDDING_VECTOR_DTYPE                  = "float32"
+    EMBEDDING_COMPRESSION_MODE              = var.embeddingCompressionMode
+    EMBEDDING_COMPRESSION_DIMENSIONS        = var.embeddingCompressionDimensions
+    AZURE_OPENAI_EMBEDDING_INITIAL_CONCURRENCY = 4
+    AZURE_OPENAI_EMBEDDING_MAX_CONCURRENCY     = 16
+    AZURE_OPENAI_EMBEDDING_MAX_ATTEMPTS        = 5
+    REEMBED_TARGET_INDEX                    = ""
+    REEMBED_MAX_CHUNKS_PER_SECOND           = 20
+    REEMBED_PAGE_SIZE                       = 1000
+    REEMBED_AUTO_RESUME                     = "true"
+    HTTP_CONNECTION_POOL_SIZE               = 32
+    ONNX_EMBEDDINGS_MODELS                  = ""
+    ONNX_INTRA_OP_THREADS                   = 0
+    ONNX_PARITY_THRESHOLD                   = 0.99
+    EMBEDDINGS_MODELS_PATH                  = "/home/models/"
+    EMBEDDINGS_MODELS_OFFLINE               = "false"
+    EMBEDDINGS_MODEL_MEMORY_BUDGET_MB       = 0
+    EMBEDDINGS_MODEL_VERIFY_CHECKSUMS       = "true"
     AZURE_BLOB_STORAGE_ACCOUNT              = module.storage.name
     AZURE_BLOB_STORAGE_CONTAINER            = var.contentContainerName
     AZURE_BLOB_STORAGE_UPLOAD_CONTAINER     = var.uploadContainerName
@@ -399,6 +433,8 @@ module "webapp" {
     CHAT_WARNING_BANNER_TEXT                = var.chatWarningBannerText
     TARGET_EMBEDDINGS_MODEL                 = var.useAzureOpenAIEmbeddings ? "azure-openai_${var.azureOpenAIEmbeddingDeploymentName}" : var.sentenceTransformersModelName
     ENRICHMENT_APPSERVICE_URL               = module.enrichmentApp.uri
+    EMBEDDING_COMPRESSION_MODE              = var.embeddingCompressionMode
+    EMBEDDING_COMPRESSION_DIMENSIONS        = var.embeddingCompressionDimensions
     AZURE_AI_ENDPOINT                       = module.cognitiveServices.cognitiveServiceEndpoint
     AZURE_AI_LOCATION                       = var.location
     APPLICATION_TITLE                       = var.applicationtitle == "" ? "Information Assistant, built with Azure OpenAI" : var.applicationtitle
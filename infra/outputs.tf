@@ -127,6 +127,14 @@ output "EMBEDDING_VECTOR_SIZE" {
   value = var.useAzureOpenAIEmbeddings ? "1536" : var.sentenceTransformerEmbeddingVectorSize
 }
 
+output "EMBEDDING_COMPRESSION_MODE" {
+  value = var.embeddingCompressionMode
+}
+
+output "EMBEDDING_COMPRESSION_DIMENSIONS" {
+  value = var.embeddingCompressionDimensions
+}
+
 output "TARGET_EMBEDDINGS_MODEL" {
   value = var.useAzureOpenAIEmbeddings ? "azure-openai_${var.azureOpenAIEmbeddingDeploymentName}" : var.sentenceTransformersModelName
 }
@@ -268,6 +268,16 @@ variable "sentenceTransformerEmbeddingVectorSize" {
   default = "384"
 }
 
+variable "embeddingCompressionMode" {
+  type    = string
+  default = "none"
+}
+
+variable "embeddingCompressionDimensions" {
+  type    = string
+  default = "0"
+}
+
 variable "embeddingsDeploymentCapacity" {
   type    = number
   default = 240
@@ -33,6 +33,10 @@ cd ../backend
 mkdir -p ./shared_code
 cp  -u ../../functions/shared_code/status_log.py ./shared_code
 cp  -u ../../functions/shared_code/__init__.py ./shared_code
+cp  -u ../../functions/shared_code/vector_compression.py ./shared_code
+cp  -u ../../functions/shared_code/clients.py ./shared_code
+cp  -u ../../functions/shared_code/chunk_pack.py ./shared_code
+cp  -u ../../functions/shared_code/sas_cache.py ./shared_code
 cd $DIR
 
 # zip the enrichment app content from app/enrichments to the .artifacts folders
@@ -40,5 +44,11 @@ cd ${ENRICHMENT_ROOT_PATH}
 mkdir -p ./shared_code
 cp  -u ../../functions/shared_code/status_log.py ./shared_code
 cp  -u ../../functions/shared_code/utilities_helper.py ./shared_code
+cp  -u ../../functions/shared_code/search_index_writer.py ./shared_code
+cp  -u ../../functions/shared_code/vector_sidecar.py ./shared_code
+cp  -u ../../functions/shared_code/vector_compression.py ./shared_code
+cp  -u ../../functions/shared_code/clients.py ./shared_code
+cp  -u ../../functions/shared_code/chunk_pack.py ./shared_code
+cp  -u ../../functions/shared_code/sas_cache.py ./shared_code
 echo "Successfully prepared enrichment app code"
 echo -e "\n"
\ No newline at end of file
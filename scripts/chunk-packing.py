@@ -0,0 +1,133 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+# This script converts the chunks already stored in the content container between the
+# per-chunk layout, one blob per chunk, and the packed layout, one pack and index per
+# document, written by the chunking functions when CHUNK_LAYOUT is packed.
+#
+#   python scripts/chunk-packing.py pack --prefix upload/
+#   python scripts/chunk-packing.py unpack --prefix upload/ --delete_source
+#
+# Both use the settings in scripts/environments/infrastructure.env. The chunk names,
+# and so the search index, are the same in both layouts, and the vector sidecars of
+# the chunks are left where they are, so neither needs the content to be indexed or
+# embedded again. The source blobs are only deleted with --delete_source, once the
+# converted document has been written
+
+import argparse
+import json
+import os
+import posixpath
+import sys
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from azure.identity import DefaultAzureCredential
+from azure.storage.blob import BlobServiceClient
+
+# the pack format lives with the function app code
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'functions'))
+from shared_code.chunk_pack import PackedChunks, is_pack_blob, pack_index_name, write_pack
+
+
+def get_container_client():
+    """ Returns a client for the content container of the deployment """
+    blob_service_client = BlobServiceClient(os.environ["BLOB_STORAGE_ACCOUNT_ENDPOINT"],
+                                            credential=DefaultAzureCredential())
+    return blob_service_client.get_container_client(os.environ["AZURE_BLOB_STORAGE_CONTAINER"])
+
+
+def list_documents(container_client, prefix):
+    """ Returns each document folder under the prefix with the names of its chunk
+    blobs and whether it is packed """
+    documents = OrderedDict()
+    for blob in container_client.list_blobs(name_starts_with=prefix):
+        folder = posixpath.dirname(blob.name)
+        chunk_names, packed = documents.get(folder, ([], False))
+        if blob.name == pack_index_name(folder):
+            packed = True
+        elif blob.name.endswith(".json") and not is_pack_blob(blob.name):
+            chunk_names.append(blob.name)
+        documents[folder] = (chunk_names, packed)
+    return [(folder, chunk_names, packed) for folder, (chunk_names, packed) in documents.items()]
+
+
+def pack(args):
+    """ Writes the chunk blobs of each document as a pack """
+    container_client = get_container_client()
+
+    def write_blob(blob_name, data):
+        container_client.upload_blob(blob_name, data, overwrite=True)
+
+    def read(chunk_name):
+        return chunk_name, json.loads(container_client.get_blob_client(chunk_name).download_blob().readall())
+
+    documents = chunks = 0
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for folder, chunk_names, packed in list_documents(container_client, args.prefix):
+            if packed or not chunk_names:
+                continue
+            # the chunks are numbered in the order they were written, so keep that order
+            chunk_names.sort(key=chunk_sort_key)
+            write_pack(write_blob, folder, OrderedDict(executor.map(read, chunk_names)).items())
+            if args.delete_source:
+                list(executor.map(container_client.delete_blob, chunk_names))
+            documents += 1
+            chunks += len(chunk_names)
+            print(f"Packed {len(chunk_names)} chunks of {folder}")
+    print(f"Packed {chunks} chunks of {documents} documents")
+
+
+def unpack(args):
+    """ Writes the chunks of each packed document back as a blob per chunk """
+    container_client = get_container_client()
+
+    def write(chunk):
+        chunk_name, chunk_dict = chunk
+        container_client.upload_blob(chunk_name, json.dumps(chunk_dict, indent=2, ensure_ascii=False), overwrite=True)
+
+    documents = chunks = 0
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for folder, _, packed in list_documents(container_client, args.prefix):
+            if not packed:
+                continue
+            packed_chunks = PackedChunks.open(container_client, folder)
+            document_chunks = packed_chunks.read_all()
+            list(executor.map(write, document_chunks.items()))
+            if args.delete_source:
+                # remove the index first, so readers fall back to the chunk blobs
+                container_client.delete_blob(pack_index_name(folder))
+                container_client.delete_blob(packed_chunks.index["pack"])
+            documents += 1
+            chunks += len(document_chunks)
+            print(f"Unpacked {len(document_chunks)} chunks of {folder}")
+    print(f"Unpacked {chunks} chunks of {documents} documents")
+
+
+def chunk_sort_key(chunk_name):
+    """ Orders the chunk blobs of a document by the number that ends their names """
+    stem = posixpath.splitext(posixpath.basename(chunk_name))[0]
+    number = stem.rsplit("-", 1)[-1]
+    return (int(number), stem) if number.isdigit() else (-1, stem)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert stored chunks between the per-chunk and packed layouts")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in (("pack", "Write the chunk blobs of each document as a pack"),
+                            ("unpack", "Write the chunks of each packed document back as a blob per chunk")):
+        subparser = subparsers.add_parser(name, help=help_text)
+        subparser.add_argument("--prefix", default="", help="Only convert the documents under this prefix")
+        subparser.add_argument("--delete_source", action="store_true",
+                               help="Delete the blobs of the previous layout once a document is converted")
+        subparser.add_argument("--concurrency", type=int, default=16, help="Blob requests in flight at once")
+    args = parser.parse_args()
+
+    if args.command == "pack":
+        pack(args)
+    else:
+        unpack(args)
+
+
+if __name__ == "__main__":
+    main()
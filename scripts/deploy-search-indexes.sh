@@ -27,6 +27,20 @@ search_url="${AZURE_SEARCH_SERVICE_ENDPOINT}"
 # Obtain an access token for Azure Search
 access_token=$(az account get-access-token --resource $TF_VAR_azure_search_scope --query accessToken -o tsv)
 
+# Vectors compressed to int8 are stored as bytes and searched with the dot product,
+# and reduced vectors have EMBEDDING_COMPRESSION_DIMENSIONS dimensions
+export SEARCH_VECTOR_DIMENSIONS=$EMBEDDING_VECTOR_SIZE
+if [[ -n "${EMBEDDING_COMPRESSION_DIMENSIONS}" ]] && [[ "${EMBEDDING_COMPRESSION_DIMENSIONS}" != "0" ]]; then
+    export SEARCH_VECTOR_DIMENSIONS=$EMBEDDING_COMPRESSION_DIMENSIONS
+fi
+if [[ "${EMBEDDING_COMPRESSION_MODE}" == "int8" ]]; then
+    export SEARCH_VECTOR_FIELD_TYPE="Collection(Edm.SByte)"
+    export SEARCH_VECTOR_METRIC="dotProduct"
+else
+    export SEARCH_VECTOR_FIELD_TYPE="Collection(Edm.Single)"
+    export SEARCH_VECTOR_METRIC="cosine"
+fi
+
 # Fetch existing index definition if it exists
 index_vector_json=$(cat ${DIR}/../azure_search/create_vector_index.json | envsubst | tr -d "\n" | tr -d "\r")
 index_vector_name=$(echo $index_vector_json | jq -r .name )
@@ -34,10 +48,11 @@ existing_index=$(curl -s --header "Authorization: Bearer $access_token" $search_
 
 if [[ "$existing_index" != *"No index with the name"* ]]; then
     existing_dimensions=$(echo "$existing_index" | jq -r '.fields | map(select(.name == "contentVector")) | .[0].dimensions')
+    existing_type=$(echo "$existing_index" | jq -r '.fields | map(select(.name == "contentVector")) | .[0].type')
     existing_index_name=$(echo "$existing_index" | jq -r '.name')
-    # Compare existing dimensions with current $EMBEDDING_VECTOR_SIZE
-    if [[ -n "$existing_dimensions" ]] && [[ "$existing_dimensions" != "$EMBEDDING_VECTOR_SIZE" ]]; then
-        echo "Dimensions mismatch: Existing dimensions: $existing_dimensions, Current dimensions: $EMBEDDING_VECTOR_SIZE"
+    # Compare existing dimensions and type with current $SEARCH_VECTOR_DIMENSIONS and $SEARCH_VECTOR_FIELD_TYPE
+    if [[ -n "$existing_dimensions" ]] && { [[ "$existing_dimensions" != "$SEARCH_VECTOR_DIMENSIONS" ]] || [[ "$existing_type" != "$SEARCH_VECTOR_FIELD_TYPE" ]]; }; then
+        echo "Vector field mismatch: Existing field: $existing_type with $existing_dimensions dimensions, Current field: $SEARCH_VECTOR_FIELD_TYPE with $SEARCH_VECTOR_DIMENSIONS dimensions"
         read -p "Do you want to continue? This will delete the existing index and data! (y/n) " -n 1 -r
         echo
         if [[ ! $REPLY =~ ^[Yy]$ ]]; then
@@ -18,6 +18,10 @@ from azure.storage.blob import generate_container_sas, ContainerSasPermissions
 from datetime import datetime, timedelta
 import urllib.parse
 
+# the shared search index writer lives with the function app code
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'functions'))
+from shared_code.search_index_writer import SearchIndexWriter
+
 
 skip_search_index = False
 skip_cosmos_db = False
@@ -40,25 +44,20 @@ def get_keyvault_url(keyvault_name, resource_group=None):
     return vault_url
 
 
-search_item_succeeded_count = 0
-search_item_failed_count = 0
+search_item_indexed_count = 0
 
 # Send multiple docs to index
 def index_sections(chunks):
-    """ Pushes a batch of content to the search index
+    """ Adds a batch of content to the buffered search index writer
     """        
-    global search_item_succeeded_count
-    global search_item_failed_count
-    
-    results = new_search_client.upload_documents(documents=chunks)
-    succeeded = sum([1 for r in results if r.succeeded])
-    failed = sum([1 for r in results if not r.succeeded])   
-    search_item_succeeded_count = search_item_succeeded_count + succeeded
-    search_item_failed_count = search_item_failed_count + failed
+    global search_item_indexed_count
     
-    print(f"\tIndexed {search_item_succeeded_count + search_item_failed_count} chunks, {search_item_failed_count} failures")
+    index_writer.add_many(chunks)
+    search_item_indexed_count = search_item_indexed_count + len(chunks)
     
+    print(f"\tQueued {search_item_indexed_count} chunks for indexing")
     
+
 def check_azcopy_installed():
     """Check if AzCopy is already installed."""
     try:
@@ -171,6 +170,7 @@ index_name = 'vector-index'
 
 old_search_client = SearchClient(endpoint=old_search_endpoint, index_name=index_name, credential=credential)
 new_search_client = SearchClient(endpoint=new_search_endpoint, index_name=index_name, credential=credential)
+index_writer = SearchIndexWriter(new_search_client, max_concurrency=8)
 
 error_guidance = 'If you re-run the process, you can skip sections that completed successfully by setting the corresponding skip flag to True. Read more details her' 
 
@@ -191,6 +191,9 @@ if skip_search_index == False:
         missing_index_entries = 0
         failed_searches = []
         for blob in blob_list:
+            if not blob.name.endswith('.json'):
+                # vector sidecars are copied with the content container, only chunks are indexed
+                continue
             
             # retrieve all chunk entries in the search index for this blob
             escaped_blob_name = blob.name.replace('\'', '\\\'')
@@ -251,9 +254,15 @@ if skip_search_index == False:
                 index_chunks = []
                 i = 0
 
-        # push remainder chunks content to index
+        # push remainder chunks content to index and wait for every batch to complete
         if len(index_chunks) > 0:
             index_sections(index_chunks)
+        failed_index_entries = index_writer.close()
+        index_stats = index_writer.stats()
+        print(f"\tIndexed {index_stats['succeeded']} chunks in {index_stats['batches']} batches, "
+              f"{index_stats['retries']} retries, {len(failed_index_entries)} failures")
+        for key, error in failed_index_entries.items():
+            print(f"\tFailed to index {key}: {error}")
             
         # Highlight chunks and associated files in upload that were not pushed to index
         if len(chunks_misisng_from_index) > 0:
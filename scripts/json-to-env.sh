@@ -94,6 +94,14 @@ jq -r  '
             "path": "EMBEDDING_VECTOR_SIZE",
             "env_var": "EMBEDDING_VECTOR_SIZE"
         },
+        {
+            "path": "EMBEDDING_COMPRESSION_MODE",
+            "env_var": "EMBEDDING_COMPRESSION_MODE"
+        },
+        {
+            "path": "EMBEDDING_COMPRESSION_DIMENSIONS",
+            "env_var": "EMBEDDING_COMPRESSION_DIMENSIONS"
+        },
         {
             "path": "BLOB_STORAGE_ACCOUNT_ENDPOINT",
             "env_var": "BLOB_STORAGE_ACCOUNT_ENDPOINT"
@@ -100,6 +100,14 @@ jq -r  '
             "path": "EMBEDDING_VECTOR_SIZE",
             "env_var": "EMBEDDING_VECTOR_SIZE"
         },
+        {
+            "path": "EMBEDDING_COMPRESSION_MODE",
+            "env_var": "EMBEDDING_COMPRESSION_MODE"
+        },
+        {
+            "path": "EMBEDDING_COMPRESSION_DIMENSIONS",
+            "env_var": "EMBEDDING_COMPRESSION_DIMENSIONS"
+        },
         {
             "path": "AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME",
             "env_var": "AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME"
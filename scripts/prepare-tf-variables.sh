@@ -22,6 +22,8 @@ export TF_VAR_azureOpenAIEmbeddingsModelName=$AZURE_OPENAI_EMBEDDINGS_MODEL_NAME
 export TF_VAR_azureOpenAIEmbeddingsModelVersion=$AZURE_OPENAI_EMBEDDINGS_MODEL_VERSION
 export TF_VAR_sentenceTransformersModelName=$OPEN_SOURCE_EMBEDDING_MODEL
 export TF_VAR_sentenceTransformerEmbeddingVectorSize=$OPEN_SOURCE_EMBEDDING_MODEL_VECTOR_SIZE
+export TF_VAR_embeddingCompressionMode=$EMBEDDING_COMPRESSION_MODE
+export TF_VAR_embeddingCompressionDimensions=$EMBEDDING_COMPRESSION_DIMENSIONS
 export TF_VAR_requireWebsiteSecurityMembership=$REQUIRE_WEBSITE_SECURITY_MEMBERSHIP
 export TF_VAR_queryTermLanguage=$PROMPT_QUERYTERM_LANGUAGE
 export TF_VAR_targetTranslationLanguage=$TARGET_TRANSLATION_LANGUAGE
@@ -0,0 +1,169 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+# This script calibrates the compression of the vectors stored in the search index, and
+# evaluates how much recall compressed vectors lose against the full vectors.
+#
+#   python scripts/vector-compression.py calibrate --index vector-index
+#   python scripts/vector-compression.py evaluate --configs int8:0:truncate,int8:256:pca
+#
+# Both read a random sample of the embeddings stored in the vector sidecars of the
+# content container, using the settings in scripts/environments/infrastructure.env.
+# evaluate can also read the sample from a .npy file, written with --save_sample
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from azure.identity import DefaultAzureCredential
+from azure.storage.blob import BlobServiceClient
+
+# the compression and sidecar formats live with the function app code
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'functions'))
+from shared_code.vector_compression import VectorCompressor, calibration_blob_name
+from shared_code.vector_sidecar import SIDECAR_EXTENSION, decode_vectors
+
+
+def get_container_client():
+    """ Returns a client for the content container of the deployment """
+    blob_service_client = BlobServiceClient(os.environ["BLOB_STORAGE_ACCOUNT_ENDPOINT"],
+                                            credential=DefaultAzureCredential())
+    return blob_service_client.get_container_client(os.environ["AZURE_BLOB_STORAGE_CONTAINER"])
+
+
+def sample_vectors(container_client, sample_size, model=None, seed=0):
+    """ Downloads a uniform random sample of the stored embeddings, keeping only those
+    of the given model """
+    rng = random.Random(seed)
+    sidecar_names = []
+    seen = 0
+    # reservoir sample the sidecar names, so the whole listing is never held in memory
+    for blob in container_client.list_blobs():
+        if not blob.name.endswith(SIDECAR_EXTENSION):
+            continue
+        seen += 1
+        if len(sidecar_names) < sample_size:
+            sidecar_names.append(blob.name)
+        else:
+            slot = rng.randrange(seen)
+            if slot < sample_size:
+                sidecar_names[slot] = blob.name
+    print(f"Sampling {len(sidecar_names)} of {seen} stored embeddings...")
+
+    def read(name):
+        return decode_vectors(container_client.get_blob_client(name).download_blob().readall())
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        sidecars = list(executor.map(read, sidecar_names))
+    vectors = [sidecar.vectors for sidecar in sidecars if model is None or sidecar.model == model]
+    if not vectors:
+        raise ValueError(f"No stored embeddings found for model {model}")
+    return np.concatenate(vectors).astype(np.float32)
+
+
+def load_sample(args):
+    if args.vectors:
+        return np.load(args.vectors).astype(np.float32)
+    model = args.model or os.environ.get("TARGET_EMBEDDINGS_MODEL")
+    if model:
+        model = re.sub(r'[^a-zA-Z0-9_\-.]', '_', model)
+    sample = sample_vectors(get_container_client(), args.sample_size, model, args.seed)
+    if args.save_sample:
+        np.save(args.save_sample, sample)
+        print(f"Sample written to {args.save_sample}")
+    return sample
+
+
+def calibrate(args):
+    """ Fits the compression on a corpus sample and stores it for the index """
+    if args.mode == "none" and not args.dimensions:
+        print("Compression is disabled, nothing to calibrate")
+        return
+    sample = load_sample(args)
+    compressor = VectorCompressor.fit(sample, args.mode, args.dimensions, args.method,
+                                      args.clip_percentile, args.model or os.environ.get("TARGET_EMBEDDINGS_MODEL", ""))
+    blob_name = calibration_blob_name(args.index)
+    get_container_client().get_blob_client(blob_name).upload_blob(compressor.to_bytes(), overwrite=True)
+    print(f"Calibrated on {len(sample)} vectors and written to {blob_name}")
+    print(f"The contentVector field of {args.index} must be {compressor.field_type} with "
+          f"{compressor.output_dimensions} dimensions, searched with the {compressor.metric} metric")
+
+
+def recall_at_k(sample, compressor, query_count, k):
+    """ Holds out query_count vectors as queries and returns the fraction of the exact
+    top k neighbours, by cosine similarity of the full vectors, that a search over
+    the compressed vectors returns """
+    queries, corpus = sample[:query_count], sample[query_count:]
+    corpus_normalized = corpus / np.maximum(np.linalg.norm(corpus, axis=1, keepdims=True), 1e-12)
+    codes = compressor.compress(corpus).astype(np.float32)
+    found = 0
+    for query in queries:
+        exact = np.argpartition(-(corpus_normalized @ query), k)[:k]
+        transformed = np.asarray(compressor.transform_query(query), dtype=np.float32)
+        approximate = np.argpartition(-(codes @ transformed), k)[:k]
+        found += len(np.intersect1d(exact, approximate))
+    return found / (len(queries) * k)
+
+
+def evaluate(args):
+    """ Reports recall@k and the index size of each compression configuration """
+    sample = load_sample(args)
+    np.random.default_rng(args.seed).shuffle(sample)
+    query_count = min(args.queries, len(sample) // 10)
+    # calibrate on the corpus only, so the queries are unseen as they are in production
+    calibration = sample[query_count:]
+    print(f"{len(sample) - query_count} corpus vectors of dimension {sample.shape[1]}, {query_count} queries")
+    print(f"{'configuration':<24}{'dimensions':>12}{'bytes/vector':>14}{'recall@' + str(args.k):>12}{'seconds':>10}")
+    for config in ["none:0:truncate"] + args.configs.split(","):
+        mode, dimensions, method = (config.split(":") + ["0", "truncate"])[:3]
+        start = time.perf_counter()
+        compressor = VectorCompressor.fit(calibration, mode, int(dimensions), method, args.clip_percentile)
+        recall = recall_at_k(sample, compressor, query_count, args.k)
+        bytes_per_vector = compressor.output_dimensions * (1 if mode == "int8" else 4)
+        print(f"{config:<24}{compressor.output_dimensions:>12}{bytes_per_vector:>14}{recall:>12.3f}"
+              f"{time.perf_counter() - start:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate and evaluate the compression of the vectors in the search index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in (("calibrate", "Fit the compression on a corpus sample and store it for an index"),
+                            ("evaluate", "Compare the recall@k of compressed and full vectors")):
+        subparser = subparsers.add_parser(name, help=help_text)
+        subparser.add_argument("--sample_size", type=int, default=20000, help="Number of stored embeddings to sample")
+        subparser.add_argument("--model", default=None,
+                               help="Only sample embeddings of this model, defaults to TARGET_EMBEDDINGS_MODEL")
+        subparser.add_argument("--vectors", default=None, help="Read the sample from a .npy file instead of storage")
+        subparser.add_argument("--save_sample", default=None, help="Write the sample to a .npy file for later runs")
+        subparser.add_argument("--clip_percentile", type=float, default=0.1,
+                               help="Percentile of outliers clipped at each end of the int8 range of a dimension")
+        subparser.add_argument("--seed", type=int, default=0)
+    calibrate_parser = subparsers.choices["calibrate"]
+    calibrate_parser.add_argument("--index", default=os.environ.get("AZURE_SEARCH_INDEX"),
+                                  help="Search index the calibration is for")
+    calibrate_parser.add_argument("--mode", default=os.environ.get("EMBEDDING_COMPRESSION_MODE") or "none",
+                                  choices=["none", "int8"])
+    calibrate_parser.add_argument("--dimensions", type=int, default=int(os.environ.get("EMBEDDING_COMPRESSION_DIMENSIONS") or 0),
+                                  help="Reduce the vectors to this many dimensions, 0 keeps them all")
+    calibrate_parser.add_argument("--method", default="pca", choices=["truncate", "pca"],
+                                  help="Keep the leading dimensions, for Matryoshka models, or project onto the principal components")
+    evaluate_parser = subparsers.choices["evaluate"]
+    evaluate_parser.add_argument("--configs", default="int8:0:truncate,none:256:pca,int8:256:pca",
+                                 help="Comma separated mode:dimensions:method configurations to evaluate")
+    evaluate_parser.add_argument("--queries", type=int, default=200, help="Number of sampled vectors held out as queries")
+    evaluate_parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.command == "calibrate":
+        calibrate(args)
+    else:
+        evaluate(args)
+
+
+if __name__ == "__main__":
+    main()
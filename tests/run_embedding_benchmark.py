@@ -0,0 +1,388 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+'''
+Offline throughput benchmark for the embeddings worker of the enrichment app.
+Runs the worker's fetch, embed, persist and index pipeline against local
+stand-ins for the embeddings queue, blob storage and Azure AI Search
+'''
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import numpy as np
+from rich.console import Console
+from rich.table import Table
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the enrichment app modules, and the shared code that the build copies into it
+sys.path.insert(0, os.path.join(REPO_ROOT, "app", "enrichment"))
+sys.path.insert(0, os.path.join(REPO_ROOT, "functions"))
+
+from embedding_worker import embed_chunks
+from shared_code.search_index_writer import SearchIndexWriter
+from shared_code.vector_sidecar import (encode_vectors, is_chunk_blob,
+                                        read_chunk_vector, sidecar_reference)
+
+console = Console()
+
+SYNTHETIC_MODEL = "synthetic"
+VOCABULARY = ("the of and to in a is that for on as with by be this are from or at an it was which "
+              "agency program public service records budget fiscal policy committee report section "
+              "federal state county contract funding review compliance security training employee "
+              "application request document data information management process requirement schedule "
+              "assessment environmental procurement grant office department administration regulation "
+              "annual quarterly approved revised submitted provided required including within under").split()
+
+
+class LocalBlobStore:
+    """ In memory stand-in for the content container, with a simulated round trip latency """
+
+    def __init__(self, latency_ms):
+        self.latency = latency_ms / 1000
+        self.blobs = {}
+        self.reads = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+
+    def list(self, prefix):
+        return sorted(name for name in self.blobs if name.startswith(prefix))
+
+    def read(self, name):
+        time.sleep(self.latency)
+        with self._lock:
+            self.reads += 1
+            return self.blobs[name]
+
+    def write(self, name, data):
+        time.sleep(self.latency)
+        with self._lock:
+            self.writes += 1
+            self.blobs[name] = data
+
+
+class LocalSearchClient:
+    """ Stand-in for the search client that accepts every document after a simulated
+    latency made of a fixed round trip and a per KB transfer cost """
+
+    def __init__(self, latency_ms, ms_per_kb):
+        self.latency = latency_ms / 1000
+        self.seconds_per_byte = ms_per_kb / 1000 / 1024
+        self.documents = 0
+        self._lock = threading.Lock()
+
+    def upload_documents(self, documents):
+        size = len(json.dumps(documents, separators=(",", ":")))
+        time.sleep(self.latency + size * self.seconds_per_byte)
+        with self._lock:
+            self.documents += len(documents)
+        return [SimpleNamespace(key=document["id"], succeeded=True, status_code=201, error_message=None)
+                for document in documents]
+
+
+class SyntheticModel:
+    """ Deterministic stand-in for an embedding model, spending a fixed time per
+    call and per text so the benchmark can measure the worker without a real model """
+
+    def __init__(self, dimension, ms_per_call, ms_per_text):
+        self.dimension = dimension
+        self.ms_per_call = ms_per_call
+        self.ms_per_text = ms_per_text
+
+    def encode(self, texts):
+        time.sleep((self.ms_per_call + self.ms_per_text * len(texts)) / 1000)
+        vectors = np.empty((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            vectors[row] = np.random.default_rng(zlib.crc32(text.encode("utf-8"))).standard_normal(self.dimension)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class CountingModel:
+    """ Counts the calls and texts that reach a model """
+
+    def __init__(self, model):
+        self.model = model
+        self.calls = 0
+        self.texts = 0
+        self._lock = threading.Lock()
+
+    def encode(self, texts):
+        with self._lock:
+            self.calls += 1
+            self.texts += len(texts)
+        return self.model.encode(texts)
+
+
+def parse_arguments():
+    """
+    Parse command line arguments
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--models", default=SYNTHETIC_MODEL,
+                        help="'|' separated sentence-transformers models to benchmark, "
+                             f"'{SYNTHETIC_MODEL}' runs a stand-in model with a fixed cost per text")
+    parser.add_argument("--batch_sizes", default="8,32",
+                        help="Comma separated MAX_EMBEDDING_BATCH_SIZE values to benchmark")
+    parser.add_argument("--documents", type=int, default=20, help="Number of synthetic documents")
+    parser.add_argument("--chunks_per_document", type=int, default=50, help="Chunks per synthetic document")
+    parser.add_argument("--mean_chunk_words", type=int, default=350,
+                        help="Median words per chunk, lengths follow a log-normal distribution")
+    parser.add_argument("--max_chunk_words", type=int, default=750, help="Longest chunk in words")
+    parser.add_argument("--workers", type=int, default=3, help="EMBEDDING_MESSAGE_WORKERS")
+    parser.add_argument("--io_concurrency", type=int, default=8, help="CHUNK_IO_CONCURRENCY")
+    parser.add_argument("--queue_size", type=int, default=2, help="EMBEDDING_PIPELINE_QUEUE_SIZE")
+    parser.add_argument("--index_concurrency", type=int, default=4, help="SEARCH_INDEX_WRITE_CONCURRENCY")
+    parser.add_argument("--vector_dtype", default="float32", help="EMBEDDING_VECTOR_DTYPE")
+    parser.add_argument("--blob_latency_ms", type=float, default=15, help="Simulated blob storage latency")
+    parser.add_argument("--search_latency_ms", type=float, default=80, help="Simulated search request latency")
+    parser.add_argument("--search_ms_per_kb", type=float, default=0.05, help="Simulated search transfer cost")
+    parser.add_argument("--synthetic_dimension", type=int, default=768)
+    parser.add_argument("--synthetic_ms_per_call", type=float, default=5)
+    parser.add_argument("--synthetic_ms_per_text", type=float, default=2)
+    parser.add_argument("--models_path", default=os.path.join(REPO_ROOT, "app", "enrichment", "models"),
+                        help="EMBEDDINGS_MODELS_PATH for real models")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="embedding_benchmark_results.json",
+                        help="File the results are written to")
+    parser.add_argument("--baseline", help="Results file of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="Relative change from the baseline that is reported as a regression")
+    return parser.parse_args()
+
+
+def generate_corpus(store, args):
+    """ Writes documents x chunks synthetic chunk files shaped like the output of the
+    chunking functions, with log-normally distributed content lengths """
+    rng = random.Random(args.seed)
+    prefix = "upload/benchmark/"
+    for document in range(args.documents):
+        file_name = f"document-{document}.pdf"
+        for chunk in range(args.chunks_per_document):
+            words = int(min(args.max_chunk_words, max(20, rng.lognormvariate(np.log(args.mean_chunk_words), 0.5))))
+            content = " ".join(rng.choice(VOCABULARY) for _ in range(words))
+            chunk_dict = {
+                "file_name": f"upload/benchmark/{file_name}",
+                "file_uri": f"https://localhost/upload/benchmark/{file_name}",
+                "file_class": "text",
+                "processed_datetime": "2024-01-01T00:00:00",
+                "title": f"Benchmark document {document}",
+                "subtitle": f"Part {chunk // 10}",
+                "section": f"Section {chunk}",
+                "pages": [chunk // 2],
+                "token_count": int(words * 1.3),
+                "content": content,
+                "translated_title": f"Benchmark document {document}",
+                "translated_subtitle": f"Part {chunk // 10}",
+                "translated_section": f"Section {chunk}",
+                "translated_content": content,
+                "entities": [],
+                "key_phrases": []
+            }
+            chunk_name = f"{prefix}{file_name}/document-{document}-{chunk}.json"
+            store.blobs[chunk_name] = json.dumps(chunk_dict, indent=2).encode("utf-8")
+    return [f"{prefix}document-{document}.pdf/" for document in range(args.documents)]
+
+
+def load_model(model_name, args):
+    """ Returns the model to benchmark, warmed up so loading is not measured """
+    if model_name == SYNTHETIC_MODEL:
+        model = SyntheticModel(args.synthetic_dimension, args.synthetic_ms_per_call, args.synthetic_ms_per_text)
+    else:
+        # imported here so the synthetic benchmark runs without sentence-transformers installed
+        from model_handling import ModelRegistry, sanitize_model_name
+        registry = ModelRegistry([model_name], models_path=args.models_path)
+        model = registry[sanitize_model_name(model_name)]
+    model.encode(["warm up"])
+    return model
+
+
+def run_configuration(model_name, batch_size, args):
+    """ Embeds and indexes the whole corpus with one model and batch size. Runs in its
+    own process so the peak RSS belongs to this configuration alone """
+    store = LocalBlobStore(args.blob_latency_ms)
+    document_prefixes = generate_corpus(store, args)
+    model = CountingModel(load_model(model_name, args))
+    search_client = LocalSearchClient(args.search_latency_ms, args.search_ms_per_kb)
+
+    # the embeddings queue, one message per document
+    messages = queue.Queue()
+    for prefix in document_prefixes:
+        messages.put({"blob_name": prefix})
+
+    io_pool = ThreadPoolExecutor(max_workers=args.io_concurrency)
+    index_pool = ThreadPoolExecutor(max_workers=args.index_concurrency * args.workers)
+    pipeline_stats = {}
+    chunk_started = {}
+    chunk_latencies = []
+    latency_lock = threading.Lock()
+
+    def load_chunk(chunk_name):
+        with latency_lock:
+            chunk_started[chunk_name] = time.perf_counter()
+        chunk_dict = json.loads(store.read(chunk_name))
+        vector = read_chunk_vector(chunk_dict, store.read)
+        if vector is not None:
+            chunk_dict["contentVector"] = vector
+        return chunk_dict
+
+    def persist_chunk(chunk_name, chunk_dict):
+        vector = chunk_dict["contentVector"]
+        reference = sidecar_reference(chunk_name, model_name, len(vector), args.vector_dtype)
+        store.write(reference["blob"], encode_vectors(vector, model_name, args.vector_dtype))
+        stored_dict = {key: value for key, value in chunk_dict.items() if key != "contentVector"}
+        stored_dict["contentVectorRef"] = reference
+        store.write(chunk_name, json.dumps(stored_dict, indent=2).encode("utf-8"))
+
+    def to_index_document(chunk_name, chunk_dict, text):
+        with latency_lock:
+            chunk_latencies.append(time.perf_counter() - chunk_started[chunk_name])
+        vector = chunk_dict["contentVector"]
+        return {
+            "id": chunk_name.replace("/", "_"),
+            "chunk_file": chunk_name,
+            "content": text,
+            "contentVector": vector.tolist() if hasattr(vector, "tolist") else vector
+        }
+
+    def encode_texts(texts):
+        return model.encode(texts).tolist()
+
+    def worker():
+        while True:
+            try:
+                message = messages.get_nowait()
+            except queue.Empty:
+                return
+            chunk_names = [name for name in store.list(message["blob_name"]) if is_chunk_blob(name)]
+            index_writer = SearchIndexWriter(search_client,
+                                             max_concurrency=args.index_concurrency,
+                                             executor=index_pool)
+            embed_chunks(chunk_names,
+                         load_chunk=load_chunk,
+                         encode_texts=encode_texts,
+                         persist_chunk=persist_chunk,
+                         to_index_document=to_index_document,
+                         index_writer=index_writer,
+                         io_pool=io_pool,
+                         batch_size=batch_size,
+                         queue_size=args.queue_size,
+                         stats=pipeline_stats)
+            failed = index_writer.flush()
+            if failed:
+                raise RuntimeError(f"{len(failed)} chunks failed to index")
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=worker) for _ in range(args.workers)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    seconds = time.perf_counter() - start
+    io_pool.shutdown()
+    index_pool.shutdown()
+
+    chunk_count = args.documents * args.chunks_per_document
+    if search_client.documents != chunk_count:
+        raise RuntimeError(f"Indexed {search_client.documents} of {chunk_count} chunks")
+    latencies_ms = np.array(chunk_latencies) * 1000
+    return {
+        "model": model_name,
+        "batch_size": batch_size,
+        "chunks": chunk_count,
+        "seconds": seconds,
+        "chunks_per_second": chunk_count / seconds,
+        "p50_chunk_latency_ms": float(np.percentile(latencies_ms, 50)),
+        "p99_chunk_latency_ms": float(np.percentile(latencies_ms, 99)),
+        # ru_maxrss is reported in KB on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "model_calls": model.calls,
+        "texts_embedded": model.texts,
+        "mean_texts_per_call": model.texts / model.calls if model.calls else 0.0,
+        "blob_reads": store.reads,
+        "blob_writes": store.writes,
+        "stages": [stats.to_dict() for stats in pipeline_stats.values()]
+    }
+
+
+def find_regressions(results, baseline, tolerance):
+    """ Compares each configuration with the same configuration in the baseline,
+    returning a description of every metric that got worse by more than tolerance """
+    baseline_results = {(result["model"], result["batch_size"]): result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        previous = baseline_results.get((result["model"], result["batch_size"]))
+        if previous is None:
+            continue
+        checks = [("chunks_per_second", result["chunks_per_second"] < previous["chunks_per_second"] * (1 - tolerance)),
+                  ("p99_chunk_latency_ms", result["p99_chunk_latency_ms"] > previous["p99_chunk_latency_ms"] * (1 + tolerance)),
+                  ("peak_rss_mb", result["peak_rss_mb"] > previous["peak_rss_mb"] * (1 + tolerance)),
+                  ("model_calls", result["model_calls"] > previous["model_calls"])]
+        for metric, regressed in checks:
+            if regressed:
+                regressions.append(f"{result['model']} batch {result['batch_size']}: {metric} "
+                                   f"{previous[metric]:.2f} -> {result[metric]:.2f}")
+    return regressions
+
+
+def get_commit():
+    """ Returns the commit the benchmark was run on, if it was run from a git checkout """
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(args):
+    """Main function to run the embedding benchmark"""
+    results = []
+    for model_name in [name.strip() for name in args.models.split("|") if name.strip()]:
+        for batch_size in [int(size) for size in args.batch_sizes.split(",")]:
+            console.print(f"Benchmarking {model_name} with batch size {batch_size}...")
+            # a fresh process per configuration keeps peak RSS and model state separate
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                results.append(executor.submit(run_configuration, model_name, batch_size, args).result())
+
+    table = Table(title="Embedding benchmark")
+    for column in ("Model", "Batch", "Chunks/sec", "p50 ms", "p99 ms", "Peak RSS MB", "Model calls"):
+        table.add_column(column)
+    for result in results:
+        table.add_row(result["model"], str(result["batch_size"]), f"{result['chunks_per_second']:.1f}",
+                      f"{result['p50_chunk_latency_ms']:.0f}", f"{result['p99_chunk_latency_ms']:.0f}",
+                      f"{result['peak_rss_mb']:.0f}", str(result["model_calls"]))
+    console.print(table)
+
+    report = {
+        "commit": get_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "settings": vars(args),
+        "results": results
+    }
+    with open(args.output, "w", encoding="utf-8") as output_file:
+        json.dump(report, output_file, indent=2)
+    console.print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            regressions = find_regressions(results, json.load(baseline_file), args.tolerance)
+        if regressions:
+            for regression in regressions:
+                console.print(f"[red]Regression: {regression}[/red]")
+            sys.exit(1)
+        console.print("[green]No regressions against the baseline[/green]")
+
+
+if __name__ == "__main__":
+    main(parse_arguments())
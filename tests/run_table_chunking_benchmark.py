@@ -0,0 +1,225 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+'''
+Offline benchmark for the chunking of large tables. Renders and chunks synthetic
+Form Recognizer tables with the structured table chunker, and with the HTML path it
+replaced, kept here as the reference, and checks that both cut the same chunks
+'''
+import argparse
+import html
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import tiktoken
+from bs4 import BeautifulSoup
+from rich.console import Console
+from rich.table import Table
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, "functions"))
+
+from shared_code.document_map import RenderedTable
+from shared_code.table_chunker import chunk_table
+
+console = Console()
+
+VOCABULARY = ("the of and to in a is that for on as with by agency program public service records "
+              "budget fiscal policy committee report section federal state county contract funding "
+              "review compliance security training employee & <application> \"request\" 2023 12,450.75 "
+              "$1,200 Q3 FY24 n/a").split()
+
+
+def parse_arguments():
+    """
+    Parse command line arguments
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", default="10,1000,50000", help="Comma separated row counts of the tables")
+    parser.add_argument("--columns", type=int, default=6, help="Columns per table")
+    parser.add_argument("--chunk_target_size", type=int, default=750, help="CHUNK_TARGET_SIZE")
+    parser.add_argument("--reference_limit", type=int, default=5000,
+                        help="Largest table to run the reference path on, as it grows with rows x cells")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per table, the fastest is reported")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="table_chunking_benchmark_results.json",
+                        help="File the results are written to")
+    return parser.parse_args()
+
+
+def generate_table(rng, rows, columns):
+    """ Returns a table shaped like those of the layout model for a spreadsheet-like
+    PDF, with a header row, row headers, spanned cells and the cells out of order """
+    cells = []
+    for row in range(rows):
+        column = 0
+        while column < columns:
+            cell = {"rowIndex": row, "columnIndex": column,
+                    "content": " ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(1, 4)))}
+            if row == 0:
+                cell["kind"] = "columnHeader"
+            elif column == 0:
+                cell["kind"] = "rowHeader"
+            if column < columns - 1 and rng.random() < 0.05:
+                cell["columnSpan"] = 2
+                column += 1
+            cells.append(cell)
+            column += 1
+    rng.shuffle(cells)
+    return {"rowCount": rows, "columnCount": columns, "cells": cells}
+
+
+class ReferenceChunker:
+    """ The table path of the chunker before the structured table chunker, which
+    scanned every cell for every row to render the HTML, parsed the HTML again and
+    encoded the whole chunk each time a row was added to it """
+
+    def __init__(self):
+        self.encoding = tiktoken.get_encoding("cl100k_base")
+
+    def token_count(self, input_text):
+        return len(self.encoding.encode(input_text))
+
+    def table_to_html(self, table):
+        table_html = "<table>"
+        rows = [sorted([cell for cell in table["cells"] if cell["rowIndex"] == i],
+                       key=lambda cell: cell["columnIndex"]) for i in range(table["rowCount"])]
+        thead_open_added = False
+        thead_closed_added = False
+
+        for i, row_cells in enumerate(rows):
+            is_row_a_header = False
+            row_html = "<tr>"
+            for cell in row_cells:
+                tag = "td"
+                if 'kind' in cell:
+                    if (cell["kind"] == "columnHeader" or cell["kind"] == "rowHeader"):
+                        tag = "th"
+                    if (cell["kind"] == "columnHeader"):
+                        is_row_a_header = True
+                cell_spans = ""
+                if 'columnSpan' in cell:
+                    if cell["columnSpan"] > 1:
+                        cell_spans += f" colSpan={cell['columnSpan']}"
+                if 'rowSpan' in cell:
+                    if cell["rowSpan"] > 1:
+                        cell_spans += f" rowSpan={cell['rowSpan']}"
+                row_html += f"<{tag}{cell_spans}>{html.escape(cell['content'])}</{tag}>"
+            row_html += "</tr>"
+            if is_row_a_header and i == 0 and not thead_open_added:
+                row_html = "<thead>" + row_html
+                thead_open_added = True
+            if not is_row_a_header and thead_open_added and not thead_closed_added:
+                row_html = "</thead>" + row_html
+                thead_closed_added = True
+            table_html += row_html
+        table_html += "</table>"
+        return table_html
+
+    def chunk_table_with_headers(self, prefix_text, table_html, standard_chunk_target_size):
+        soup = BeautifulSoup(table_html, 'html.parser')
+        thead = str(soup.find('thead'))
+        chunks = []
+
+        def add_current_table_chunk(chunk):
+            if chunk.strip() and not chunk.endswith("<table>"):
+                chunks.append('<table>' + chunk + '</table>')
+
+        current_chunk = prefix_text
+        chunk_target_size = standard_chunk_target_size - self.token_count(prefix_text)
+        rows = soup.find_all('tr')
+        filtered_rows = [row for row in rows if row.parent.name != "thead"]
+        for row in filtered_rows:
+            row_html = str(row)
+            if self.token_count(current_chunk + row_html) > chunk_target_size:
+                add_current_table_chunk(current_chunk)
+                current_chunk = thead
+                chunk_target_size = standard_chunk_target_size
+            current_chunk += row_html
+        add_current_table_chunk(current_chunk)
+        return chunks
+
+
+def fastest(repeats, run):
+    """ Returns the shortest time of a number of runs and the result of the last """
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def get_commit():
+    """ Returns the commit the benchmark was run on, if it was run from a git checkout """
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(args):
+    """Main function to run the table chunking benchmark"""
+    rng = random.Random(args.seed)
+    reference = ReferenceChunker()
+    prefix_text = "\nThe following table lists the records of the fiscal year."
+    results = []
+    for rows in [int(count) for count in args.rows.split(",")]:
+        table = generate_table(rng, rows, args.columns)
+        console.print(f"Chunking a table of {rows} rows and {len(table['cells'])} cells...")
+
+        structured_seconds, structured_chunks = fastest(args.repeats, lambda: chunk_table(
+            prefix_text, RenderedTable.from_table(table), args.chunk_target_size))
+        result = {
+            "rows": rows,
+            "cells": len(table["cells"]),
+            "chunks": len(structured_chunks),
+            "structured_seconds": structured_seconds,
+            "reference_seconds": None,
+            "speedup": None,
+            "same_chunks": None
+        }
+        if rows <= args.reference_limit:
+            reference_seconds, reference_chunks = fastest(args.repeats, lambda: reference.chunk_table_with_headers(
+                prefix_text, reference.table_to_html(table), args.chunk_target_size))
+            result["reference_seconds"] = reference_seconds
+            result["speedup"] = reference_seconds / structured_seconds
+            result["same_chunks"] = reference_chunks == structured_chunks
+        results.append(result)
+
+    table = Table(title="Table chunking benchmark")
+    for column in ("Rows", "Cells", "Chunks", "Reference s", "Structured s", "Speedup", "Same chunks"):
+        table.add_column(column)
+    for result in results:
+        skipped = result["reference_seconds"] is None
+        table.add_row(str(result["rows"]), str(result["cells"]), str(result["chunks"]),
+                      "skipped" if skipped else f"{result['reference_seconds']:.3f}",
+                      f"{result['structured_seconds']:.3f}",
+                      "" if skipped else f"{result['speedup']:.1f}x",
+                      "" if skipped else str(result["same_chunks"]))
+    console.print(table)
+
+    report = {
+        "commit": get_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "settings": vars(args),
+        "results": results
+    }
+    with open(args.output, "w", encoding="utf-8") as output_file:
+        json.dump(report, output_file, indent=2)
+    console.print(f"Results written to {args.output}")
+
+    if any(result["same_chunks"] is False for result in results):
+        console.print("[red]The structured chunker cut different chunks from the reference[/red]")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(parse_arguments())
@@ -0,0 +1,127 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+'''
+Tests for the packed chunk layout, run against the local filesystem sink and an
+in-memory container
+'''
+import json
+import os
+import sys
+
+import pytest
+from azure.core.exceptions import ResourceNotFoundError
+
+TESTS_ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(TESTS_ROOT), "functions"))
+
+from shared_code.chunk_pack import PackedChunks, PackIndexCache, pack_index_name, packed_chunk_names, read_chunk
+from shared_code.chunk_writer import ChunkPackWriter, LocalChunkSink
+
+FOLDER = "upload/report.pdf"
+
+
+class MemoryBlob:
+    def __init__(self, container, name):
+        self.container = container
+        self.name = name
+
+    def download_blob(self, offset=None, length=None):
+        if self.name not in self.container.blobs:
+            raise ResourceNotFoundError(self.name)
+        data = self.container.blobs[self.name]
+        self.container.reads.append((self.name, offset, length))
+        if offset is not None:
+            data = data[offset:offset + length]
+        return MemoryDownload(data)
+
+
+class MemoryDownload:
+    def __init__(self, data):
+        self.data = data
+
+    def readall(self):
+        return self.data
+
+
+class MemoryContainer:
+    """ The calls of a container client the packed layout makes, over a dict """
+
+    def __init__(self):
+        self.blobs = {}
+        self.reads = []
+
+    def write(self, name, data):
+        self.blobs[name] = data
+
+    def upload_blob(self, name, data, overwrite=False):
+        self.blobs[name] = data.encode("utf-8") if isinstance(data, str) else data
+
+    def get_blob_client(self, name):
+        return MemoryBlob(self, name)
+
+    def delete_blob(self, name):
+        if self.blobs.pop(name, None) is None:
+            raise ResourceNotFoundError(name)
+
+
+def write_document(sink, chunk_count=20):
+    writer = ChunkPackWriter(sink)
+    chunks = {f"{FOLDER}/report-{i}.json": {"content": f"chunk {i} é", "pages": [i]} for i in range(chunk_count)}
+    for name, chunk in chunks.items():
+        writer.add(name, json.dumps(chunk, indent=2, ensure_ascii=False))
+    stats = writer.flush()
+    assert stats["chunks_written"] == chunk_count
+    return chunks
+
+
+def test_pack_offsets_cover_each_chunk(tmp_path):
+    chunks = write_document(LocalChunkSink(str(tmp_path)))
+    folder = os.path.join(tmp_path, *FOLDER.split("/"))
+    with open(os.path.join(folder, "chunks.idx"), encoding="utf-8") as index_file:
+        index = json.load(index_file)
+    with open(os.path.join(tmp_path, *index["pack"].split("/")), "rb") as pack_file:
+        data = pack_file.read()
+
+    assert sorted(os.listdir(folder)) == sorted(["chunks.idx", os.path.basename(index["pack"])])
+    assert [entry["name"] for entry in index["chunks"]] == list(chunks)
+    for entry in index["chunks"]:
+        assert json.loads(data[entry["offset"]:entry["offset"] + entry["length"]]) == chunks[entry["name"]]
+
+
+def test_single_chunks_are_read_with_a_range_read():
+    container = MemoryContainer()
+    chunks = write_document(container)
+    cache = PackIndexCache()
+
+    assert read_chunk(container, f"{FOLDER}/report-7.json", cache) == chunks[f"{FOLDER}/report-7.json"]
+    assert read_chunk(container, f"{FOLDER}/report-8.json", cache) == chunks[f"{FOLDER}/report-8.json"]
+    # the index is read once, and each chunk with a range of the pack
+    assert [read[0] for read in container.reads].count(pack_index_name(FOLDER)) == 1
+    assert all(read[1] is not None for read in container.reads if read[0] != pack_index_name(FOLDER))
+
+    # a document that is not packed is read from the chunk blob
+    container.upload_blob("upload/notes.txt/notes-0.json", json.dumps({"content": "notes"}))
+    assert read_chunk(container, "upload/notes.txt/notes-0.json", cache) == {"content": "notes"}
+
+
+def test_commit_replaces_the_pack_and_stale_indexes_are_refreshed():
+    container = MemoryContainer()
+    write_document(container)
+    cache = PackIndexCache()
+    read_chunk(container, f"{FOLDER}/report-0.json", cache)
+
+    packed_chunks = PackedChunks.open(container, FOLDER)
+    old_pack = packed_chunks.index["pack"]
+    for name, chunk in packed_chunks.read_all().items():
+        packed_chunks.update(name, dict(chunk, content=chunk["content"].upper()))
+    assert packed_chunks.commit()
+    assert old_pack not in container.blobs
+    assert sorted(container.blobs) == sorted([packed_chunks.index["pack"], pack_index_name(FOLDER)])
+
+    # the cached index points at the deleted pack, so it is read again
+    assert read_chunk(container, f"{FOLDER}/report-3.json", cache)["content"] == "CHUNK 3 É"
+    assert packed_chunk_names(container, [pack_index_name(FOLDER)]) == packed_chunks.names
+
+    with pytest.raises(ResourceNotFoundError):
+        read_chunk(container, f"{FOLDER}/report-99.json", cache)
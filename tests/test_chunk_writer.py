@@ -0,0 +1,75 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+'''
+Tests for the background chunk writer of the chunking functions, run against the
+local filesystem sink
+'''
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+TESTS_ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(TESTS_ROOT), "functions"))
+
+from shared_code.chunk_writer import ChunkWriter, LocalChunkSink
+
+
+class SlowSink:
+    """ Records how many writes are in flight at once """
+
+    def __init__(self, fail_path=None):
+        self.fail_path = fail_path
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.paths = []
+        self._lock = threading.Lock()
+
+    def write(self, path, data):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.01)
+        with self._lock:
+            self.in_flight -= 1
+            self.paths.append(path)
+        if path == self.fail_path:
+            raise IOError(f"cannot write {path}")
+
+
+def test_writes_every_chunk_to_the_local_sink(tmp_path):
+    writer = ChunkWriter(LocalChunkSink(str(tmp_path)), max_concurrency=4)
+    contents = {f"upload/report.pdf/report-{i}.json": f'{{"content": "chunk {i} é"}}' for i in range(50)}
+    for path, content in contents.items():
+        writer.add(path, content)
+    stats = writer.flush()
+
+    assert stats["chunks_written"] == 50
+    assert stats["bytes_written"] == sum(len(content.encode("utf-8")) for content in contents.values())
+    for path, content in contents.items():
+        with open(os.path.join(tmp_path, *path.split("/")), encoding="utf-8") as chunk_file:
+            assert chunk_file.read() == content
+
+
+def test_uploads_in_flight_are_bounded():
+    sink = SlowSink()
+    writer = ChunkWriter(sink, max_concurrency=3)
+    for i in range(30):
+        writer.add(f"chunk-{i}.json", "{}")
+    writer.flush()
+
+    assert len(sink.paths) == 30
+    assert 1 < sink.max_in_flight <= 3
+
+
+def test_flush_raises_when_a_chunk_fails():
+    sink = SlowSink(fail_path="chunk-5.json")
+    writer = ChunkWriter(sink, max_concurrency=2)
+    with pytest.raises(IOError):
+        for i in range(10):
+            writer.add(f"chunk-{i}.json", "{}")
+        writer.flush()
+    assert writer.stats()["failed"] == 1
@@ -0,0 +1,63 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+'''
+Golden-file tests for the PDF document map builder. Each case in test_data/document_maps
+is a Form Recognizer layout result, <case>.analyze_result.json, and the structure the
+document map held for it, <case>.document_map.json, as written by the per-character
+builder the interval builder replaced. The structure built now must serialize to the
+same bytes, whether the result is loaded whole or streamed from a file a window of
+pages at a time
+'''
+import glob
+import json
+import os
+import sys
+
+import pytest
+
+TESTS_ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(TESTS_ROOT), "functions"))
+
+from shared_code.analyze_result import AnalyzeResultFile, iter_structure_windows
+from shared_code.document_map import build_document_structure, table_to_html
+
+GOLDEN_PATH = os.path.join(TESTS_ROOT, "test_data", "document_maps")
+CASES = sorted(os.path.basename(path)[:-len(".analyze_result.json")]
+               for path in glob.glob(os.path.join(GOLDEN_PATH, "*.analyze_result.json")))
+
+
+@pytest.mark.parametrize("case", CASES)
+def test_document_map_matches_golden_file(case):
+    with open(os.path.join(GOLDEN_PATH, f"{case}.analyze_result.json"), encoding="utf-8") as f:
+        result = json.load(f)
+    with open(os.path.join(GOLDEN_PATH, f"{case}.document_map.json"), encoding="utf-8") as f:
+        expected = f.read()
+
+    assert json.dumps(build_document_structure(result), indent=2) == expected
+
+
+@pytest.mark.parametrize("case", CASES)
+@pytest.mark.parametrize("window_pages", [1, 50])
+def test_streamed_document_map_matches_golden_file(case, window_pages, tmp_path):
+    with open(os.path.join(GOLDEN_PATH, f"{case}.analyze_result.json"), encoding="utf-8") as f:
+        result = json.load(f)
+    with open(os.path.join(GOLDEN_PATH, f"{case}.document_map.json"), encoding="utf-8") as f:
+        expected = f.read()
+    # the response of the service wraps the result
+    response_path = os.path.join(tmp_path, "analyze_result.json")
+    with open(response_path, "w", encoding="utf-8") as f:
+        json.dump({"status": "succeeded", "analyzeResult": result}, f)
+
+    content, windows = iter_structure_windows(AnalyzeResultFile(response_path), table_to_html, window_pages)
+    windows = list(windows)
+    structure = [element for window in windows for element in window]
+
+    assert content == result["content"]
+    assert json.dumps(structure, indent=2) == expected
+    for window in windows:
+        assert window[-1]["page_number"] - window[0]["page_number"] < window_pages or len(window) == 1
+
+
+def test_golden_files_present():
+    assert CASES, f"No golden files found in {GOLDEN_PATH}"
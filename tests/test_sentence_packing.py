@@ -0,0 +1,68 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+'''
+Regression tests for the sentence packing of oversized paragraphs. The packer must
+cut the same chunks, with the same token counts, as the loop it replaced, which
+counted the whole chunk again every time a sentence was added. The corpus is the
+text of the document map golden files, split into sentences
+'''
+import glob
+import json
+import os
+import re
+import sys
+
+import pytest
+
+TESTS_ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(TESTS_ROOT), "functions"))
+
+from shared_code.token_counter import RunningTokenCount, count_tokens, pack_sentences
+
+GOLDEN_PATH = os.path.join(TESTS_ROOT, "test_data", "document_maps")
+TARGET_SIZES = [0, 8, 50, 200, 750]
+
+
+def reference_pack(sentences, chunk_target_size):
+    """ The packing loop of Utilities.build_chunks before the single pass packer """
+    chunks = []
+    chunk = ""
+    for sentence in sentences:
+        temp_chunk = chunk + " " + sentence if chunk else sentence
+        if count_tokens(temp_chunk) <= chunk_target_size:
+            chunk = temp_chunk
+        else:
+            chunks.append(chunk)
+            chunk = sentence
+    if chunk:
+        chunks.append(chunk)
+    return [(chunk, count_tokens(chunk)) for chunk in chunks]
+
+
+def corpus():
+    documents = {}
+    for path in sorted(glob.glob(os.path.join(GOLDEN_PATH, "*.analyze_result.json"))):
+        with open(path, encoding="utf-8") as f:
+            content = json.load(f)["content"]
+        # a rough sentence split that keeps line breaks and runs of spaces in the
+        # sentences, as they are where the encoders split text differently
+        documents[os.path.basename(path)] = [sentence for sentence in re.split(r"(?<=[.!?]) ", content) if sentence]
+    documents["whitespace_and_digits"] = ["Total 1234", "567 units .", "\n", "  ", "Line\n\n", " Next", "'s", "x", "",
+                                          "$100.50 (a)", "\t tab", "12", "345"]
+    return documents
+
+
+@pytest.mark.parametrize("target_size", TARGET_SIZES)
+@pytest.mark.parametrize("name,sentences", list(corpus().items()))
+def test_packing_matches_reference(name, sentences, target_size):
+    assert pack_sentences(sentences, target_size) == reference_pack(sentences, target_size)
+
+
+def test_running_count_appends_the_same_text_twice():
+    # interned strings are the same object each time, so a count worked out by one
+    # append must not be taken for the count of the next
+    counter = RunningTokenCount()
+    counter.append("a1")
+    assert counter.append("a1") == count_tokens("a1a1")
+    assert counter.count_with("a1") == counter.append("a1") == count_tokens("a1a1a1")